@@ -1,5 +1,7 @@
 # wires numbers and modes ###
-import RPi.GPIO as GPIO
+import os
+import time
+import latency
 
 # Pin configuration
 lch_pin = 6  # Latch control pin (purple)
@@ -10,24 +12,192 @@ lm_pin = 12  # Left motor PWM pin (white)
 arm1_pin = 20  # Arm motor 1 control pin (green)
 arm2_pin = 16  # Arm motor 2 control pin (orange)
 
-# GPIO setup
-GPIO.setmode(GPIO.BCM)
+DIGITAL_PINS = (lch_pin, rm_dir_pin, lm_dir_pin, arm1_pin, arm2_pin)
+PWM_PINS = (rm_pin, lm_pin)
+PWM_FREQUENCY = 1000  # 1 kHz frequency
 
-# Setup pins as output
-GPIO.setup(lch_pin, GPIO.OUT)
-GPIO.setup(rm_dir_pin, GPIO.OUT)
-GPIO.setup(lm_dir_pin, GPIO.OUT)
-GPIO.setup(arm1_pin, GPIO.OUT)
-GPIO.setup(arm2_pin, GPIO.OUT)
+# Backend used when init() gets none: "rpi", "pigpio" or "simulated"
+DEFAULT_BACKEND = os.environ.get("AUTOLINK_GPIO_BACKEND", "rpi")
 
-GPIO.setup(rm_pin, GPIO.OUT)  # Right motor
-rm_pwm = GPIO.PWM(rm_pin, 1000)  # 1 kHz frequency
-GPIO.setup(lm_pin, GPIO.OUT)  # Left motor
-lm_pwm = GPIO.PWM(lm_pin, 1000)  # 1 kHz frequency
+outputs = None  # the GPIOOutputs, created by init()
+recorder = None  # receives every command when the session is recorded, see session_recorder.start()
 
-# Start PWM with 0% duty cycle (off)
-rm_pwm.start(0)
-lm_pwm.start(0)
+
+class RPiGPIOBackend:
+    """
+    RPi.GPIO with software PWM.
+    """
+
+    def __init__(self):
+        import RPi.GPIO as GPIO
+        self.GPIO = GPIO
+
+        # GPIO setup
+        GPIO.setmode(GPIO.BCM)
+
+        # Setup pins as output
+        GPIO.setup(list(DIGITAL_PINS), GPIO.OUT, initial=GPIO.LOW)
+        GPIO.setup(list(PWM_PINS), GPIO.OUT)
+        self.pwm = {pin: GPIO.PWM(pin, PWM_FREQUENCY) for pin in PWM_PINS}
+
+        # Start PWM with 0% duty cycle (off)
+        for pwm in self.pwm.values():
+            pwm.start(0)
+
+    def write_pins(self, pins, levels):
+        self.GPIO.output(pins, [self.GPIO.HIGH if level else self.GPIO.LOW for level in levels])  # one call
+
+    def set_duty(self, pin, duty):
+        self.pwm[pin].ChangeDutyCycle(duty)
+
+    def close(self):
+        for pwm in self.pwm.values():
+            pwm.stop()
+        self.GPIO.cleanup(list(DIGITAL_PINS + PWM_PINS))  # the pins can be set up again
+
+
+class PigpioBackend:
+    """
+    pigpio daemon, with hardware timed PWM (BCM 12 and 13 are the two hardware PWM channels).
+    """
+
+    def __init__(self):
+        import pigpio
+        self.pi = pigpio.pi()
+        if not self.pi.connected:
+            raise RuntimeError("pigpiod is not running")
+        for pin in DIGITAL_PINS + PWM_PINS:
+            self.pi.set_mode(pin, pigpio.OUTPUT)
+        self.pi.clear_bank_1(sum(1 << pin for pin in DIGITAL_PINS))
+        for pin in PWM_PINS:
+            self.pi.hardware_PWM(pin, PWM_FREQUENCY, 0)
+
+    def write_pins(self, pins, levels):
+        high = sum(1 << pin for pin, level in zip(pins, levels) if level)
+        low = sum(1 << pin for pin, level in zip(pins, levels) if not level)
+        if high:
+            self.pi.set_bank_1(high)  # all the pins set high at once
+        if low:
+            self.pi.clear_bank_1(low)
+
+    def set_duty(self, pin, duty):
+        self.pi.hardware_PWM(pin, PWM_FREQUENCY, int(duty * 10000))  # the duty cycle is in millionths
+
+    def close(self):
+        for pin in PWM_PINS:
+            self.pi.hardware_PWM(pin, PWM_FREQUENCY, 0)
+        self.pi.stop()
+
+
+class SimulatedBackend:
+    """
+    In-memory outputs that record every write with its time, for running the control code without a Pi.
+    """
+
+    def __init__(self):
+        self.levels = dict.fromkeys(DIGITAL_PINS, 0)
+        self.duties = dict.fromkeys(PWM_PINS, 0)
+        self.writes = []  # (time.monotonic(), pin, value)
+
+    def write_pins(self, pins, levels):
+        now = time.monotonic()
+        for pin, level in zip(pins, levels):
+            self.levels[pin] = int(bool(level))
+            self.writes.append((now, pin, self.levels[pin]))
+
+    def set_duty(self, pin, duty):
+        self.duties[pin] = duty
+        self.writes.append((time.monotonic(), pin, duty))
+
+    def close(self):
+        pass
+
+
+BACKENDS = {"rpi": RPiGPIOBackend, "pigpio": PigpioBackend, "simulated": SimulatedBackend}
+
+
+class GPIOOutputs:
+    """
+    Shadow copy of the output pins and duty cycles in front of a backend.
+
+    Only the values that changed since the last write reach the backend, the changed digital pins in one
+    backend call. The counters show how many writes were issued and skipped, and how long they took.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.pins = {}  # shadow of the digital pin levels, empty until the first write
+        self.duties = {}  # shadow of the PWM duty cycles
+        self.stats = {"calls": 0, "pin_writes": 0, "duty_writes": 0, "backend_calls": 0, "skipped": 0,
+                      "write_time": 0.0, "max_write_time": 0.0}
+
+    def apply(self, pins, duties):
+        """
+        Write the pin levels and duty cycles that differ from the shadow copy.
+
+        Args:
+            pins (dict): Levels (0/1) by digital pin.
+            duties (dict): Duty cycles (0-100) by PWM pin.
+        """
+        start = time.perf_counter()
+        changed = [pin for pin, level in pins.items() if self.pins.get(pin) != level]
+        if changed:
+            self.backend.write_pins(changed, [pins[pin] for pin in changed])
+            self.pins.update((pin, pins[pin]) for pin in changed)
+            self.stats["backend_calls"] += 1
+        duty_writes = 0
+        for pin, duty in duties.items():
+            if self.duties.get(pin) != duty:
+                self.backend.set_duty(pin, duty)
+                self.duties[pin] = duty
+                duty_writes += 1
+        elapsed = time.perf_counter() - start
+
+        self.stats["calls"] += 1
+        self.stats["pin_writes"] += len(changed)
+        self.stats["duty_writes"] += duty_writes
+        self.stats["backend_calls"] += duty_writes
+        self.stats["skipped"] += len(pins) + len(duties) - len(changed) - duty_writes
+        self.stats["write_time"] += elapsed
+        self.stats["max_write_time"] = max(self.stats["max_write_time"], elapsed)
+        latency.record("gpio", elapsed)
+
+
+def init(backend=None):
+    """
+        Set up the outputs on a backend: import it, set up the pins as outputs and start the PWM with 0% duty cycle.
+
+        Importing the module does not touch the hardware, this runs on the first output or it can be
+        called at startup. The outputs are set up once: a later call keeps them, unless it asks for another
+        backend, then the pins of the previous one are released first.
+
+        Args:
+            backend (str): "rpi" (RPi.GPIO), "pigpio" or "simulated", the current one or DEFAULT_BACKEND by default.
+
+        Returns:
+            GPIOOutputs: The outputs.
+    """
+    global outputs
+    if outputs is not None:
+        if backend is None or isinstance(outputs.backend, BACKENDS[backend]):
+            return outputs
+        outputs.backend.close()
+        outputs = None
+    outputs = GPIOOutputs(BACKENDS[backend or DEFAULT_BACKEND]())
+    return outputs
+
+
+def gpio_stats():
+    """
+        Get the write counters of the outputs.
+
+        Returns:
+            dict: The counters of GPIOOutputs, with the mean write time in microseconds.
+    """
+    stats = dict(outputs.stats) if outputs is not None else {}
+    if stats.get("calls"):
+        stats["mean_write_us"] = stats["write_time"] / stats["calls"] * 1e6
+    return stats
 
 
 def low_output():
@@ -35,20 +205,19 @@ def low_output():
         Set all outputs to low, effectively stopping all motors and
         setting the system to an idle state.
     """
-
-    GPIO.output(lch_pin, GPIO.LOW)
-    GPIO.output(arm1_pin, GPIO.LOW)
-    GPIO.output(arm2_pin, GPIO.LOW)
-    GPIO.output(rm_dir_pin, GPIO.LOW)
-    GPIO.output(lm_dir_pin, GPIO.LOW)
-    rm_pwm.ChangeDutyCycle(10)
-    lm_pwm.ChangeDutyCycle(10)
+    if outputs is None:
+        init()
+    if recorder is not None:
+        recorder.command(None)
+    outputs.apply(dict.fromkeys(DIGITAL_PINS, 0), {rm_pin: 10, lm_pin: 10})
 
 
 def GPIO_activation(lm, rm, latch, up_arm, down_arm, back_lm, back_rm):
     """
         Activate GPIO pins based on the provided parameters to control the motors and arms.
 
+        Only the outputs that changed since the last call are written.
+
         Args:
             lm (int): Duty cycle for the left motor (0-100).
             rm (int): Duty cycle for the right motor (0-100).
@@ -58,17 +227,17 @@ def GPIO_activation(lm, rm, latch, up_arm, down_arm, back_lm, back_rm):
             back_lm (int): Signal for backward motion of the left motor (0/1).
             back_rm (int): Signal for backward motion of the right motor (0/1).
     """
-    # latch activation
-    GPIO.output(lch_pin, GPIO.HIGH if latch else GPIO.LOW)
-
-    # arm activation
-    GPIO.output(arm1_pin, GPIO.HIGH if (down_arm or up_arm) else GPIO.LOW)  # arm motor magnitude
-    GPIO.output(arm2_pin, GPIO.HIGH if down_arm else GPIO.LOW)  # arm motor direction
-
-    # motors activation
-    GPIO.output(rm_dir_pin, GPIO.HIGH if back_rm else GPIO.LOW)  # right motor direction
-    GPIO.output(lm_dir_pin, GPIO.HIGH if back_lm else GPIO.LOW)  # left motor direction
-
-    # Set motor speeds
-    rm_pwm.ChangeDutyCycle(lm)  # left motor magnitude
-    lm_pwm.ChangeDutyCycle(rm)  # right motor magnitude
+    if outputs is None:
+        init()
+    if recorder is not None:
+        recorder.command((lm, rm, latch, up_arm, down_arm, back_lm, back_rm))
+    outputs.apply({
+        lch_pin: int(bool(latch)),  # latch activation
+        arm1_pin: int(bool(down_arm or up_arm)),  # arm motor magnitude
+        arm2_pin: int(bool(down_arm)),  # arm motor direction
+        rm_dir_pin: int(bool(back_rm)),  # right motor direction
+        lm_dir_pin: int(bool(back_lm)),  # left motor direction
+    }, {
+        rm_pin: lm,  # left motor magnitude
+        lm_pin: rm,  # right motor magnitude
+    })
@@ -1,25 +1,49 @@
+from functools import lru_cache
+import json
+import os
+import time
 import cv2 as cv
 from cv2 import aruco
 import numpy as np
+from pose_filter import PoseFilter
+import latency
+from undistortion import get_undistortion
+from marker_board import MarkerBoard
 
-# Load calibration data from file
-calib_data = np.load("arrays.npz")
-cam_mat = calib_data["mtx"]  # Camera matrix
-dist_co = calib_data["dist"]  # Distortion coefficients
-r_vectors = calib_data["rvecs"]  # Rotation vectors
-t_vectors = calib_data["tvecs"]  # Translation vectors
-
-# Initialize variables for marker detection
-first_time = True
-last_x, last_z, last_angle = 0, 0, 0
-last_frame = np.zeros((600, 700, 3), dtype=np.uint8)
-output_x, output_z, output_angle = 0, 1000, 0
-failCount1 = 0
-failCount2 = 0
+# Calibration data file, it is loaded by init() or on the first use of these module attributes
+CALIBRATION_FILE = "arrays.npz"
+_LAZY = ("calib_data", "cam_mat", "dist_co", "r_vectors", "t_vectors", "default_detector", "pose_filter",
+         "detection_stats")
 
 MARKER_SIZE = 9  # Size of the marker in centimeters
-marker_dict = aruco.getPredefinedDictionary(aruco.DICT_4X4_250)
-param_markers = aruco.DetectorParameters()
+# Dictionary and DetectorParameters attributes of the detectors, load_profile() replaces them. The module attributes
+# marker_dict, param_markers and detector are created from them on their first use.
+DICTIONARY = "DICT_4X4_250"
+DETECTOR_SETTINGS = {}
+_LAZY_DETECTOR = ("marker_dict", "param_markers", "detector")
+
+# Region of interest tracking: after a detection only the area around the last corners is searched
+ROI_TRACKING = True
+ROI_PADDING = 0.75  # padding around the last corners, relative to the marker size in pixels
+ROI_MIN_PADDING = 30  # minimal padding in pixels
+ROI_GROWTH = 2  # the padding is multiplied by this after every missed frame
+ROI_MAX_MISSES = 3  # missed frames before falling back to a full frame search
+
+# Pyramid detection: full frame searches run on a downscaled frame, the corners are refined at full resolution
+PYRAMID_DETECTION = False
+PYRAMID_SCALE = 0.5  # scale of the downscaled frame
+PYRAMID_SUBPIX_WINDOW = (5, 5)  # half size of the corner refinement window, in full resolution pixels
+subpix_criteria = (cv.TERM_CRITERIA_EPS + cv.TERM_CRITERIA_MAX_ITER, 30, 0.01)
+
+# Corner undistortion: the detected corners are undistorted in one call and the poses are estimated with the
+# pinhole model of the optimal new camera matrix, cached next to the calibration file
+UNDISTORT_CORNERS = False
+
+# Marker board: the layout file of several markers on the wheelchair whose pose is estimated jointly, see
+# marker_board.py, None estimates the pose of every marker on its own
+BOARD = None
+
+recorder = None  # receives the frames and poses of aruco_detecting when the session is recorded, see session_recorder
 
 
 def my_estimatePoseSingleMarkers(corners, marker_size, mtx, distortion):
@@ -53,90 +77,519 @@ def my_estimatePoseSingleMarkers(corners, marker_size, mtx, distortion):
     return rvecs, tvecs, trash
 
 
-def aruco_detecting(frame):
+@lru_cache(maxsize=4)
+def marker_points(marker_size):
     """
-    Detect ArUco markers in a given frame and estimate their pose.
-    
+    Get the corners of a marker in its own coordinates, in the order the detector returns them.
+    """
+    points = np.array([[-marker_size / 2, marker_size / 2, 0],
+                       [marker_size / 2, marker_size / 2, 0],
+                       [marker_size / 2, -marker_size / 2, 0],
+                       [-marker_size / 2, -marker_size / 2, 0]], dtype=np.float32)
+    points.flags.writeable = False
+    return points
+
+
+def estimate_poses(corners, marker_size=MARKER_SIZE, mtx=None, distortion=None):
+    """
+    Estimate the poses of all the detected markers at once.
+
     Args:
-        frame (ndarray): The input image frame to process.
+        corners (ndarray or list): (N, 4, 2) corners, or the corners tuple of detector.detectMarkers.
+        marker_size (float): Size of the marker.
+        mtx (ndarray): Camera matrix, the calibrated one by default.
+        distortion (ndarray): Distortion coefficients, the calibrated ones by default.
 
     Returns:
-        tuple: Processed frame, detection status, distance to marker, and estimated pose (x, z, angle).
-    """
-    detection = False
-    global first_time, last_x, last_z, last_angle, last_frame, failCount1, failCount2, output_x, output_z, output_angle
-
-    gray_frame = cv.cvtColor(frame, cv.COLOR_BGR2GRAY)  # Convert to grayscale
-    detector = aruco.ArucoDetector(marker_dict, param_markers)
-    marker_corners, marker_IDs, _ = detector.detectMarkers(gray_frame)
-
-    if marker_corners:
-        rVec, tVec, _ = my_estimatePoseSingleMarkers(marker_corners, MARKER_SIZE, cam_mat, dist_co)
-        total_markers = range(len(marker_IDs))
-
-        for ids, corners, i in zip(marker_IDs, marker_corners, total_markers):
-            # Calculate rotation angles and update output if within error thresholds
-            rVec2 = np.array(rVec, dtype=np.float32)
-            rotation_matrix, _ = cv.Rodrigues(rVec2[i])
-            _, _, _, _, _, _, euler_angles = cv.decomposeProjectionMatrix(
-                np.hstack((rotation_matrix, np.zeros((3, 1)))))
-            Angle = euler_angles[1]  # Angle around z-axis
-
-            # Define error thresholds for position and angle
-            x_z_play = 5  # Allowable x and z error distance
-            anPlay = 20  # Allowable angle error
-
-            # Check if the detected marker meets the error thresholds
-            if (abs(tVec[i][0][0] - last_x) < x_z_play and abs(tVec[i][2][0] - last_z) < x_z_play and abs(
-                    Angle - last_angle) < anPlay) or (failCount2 > 2) or first_time:
-                output_z = tVec[i][2][0]
-                output_x = tVec[i][0][0]
-                output_angle = Angle[0]
-                first_time = False
-                detection = True
-                failCount1 = 0
-                failCount2 = 0
-                last_x = tVec[i][0][0]
-                last_z = tVec[i][2][0]
-                last_angle = Angle
-                last_frame = frame
-                corners = corners.reshape(4, 2).astype(int)
-
-                # Draw on the camera window
-                cv.polylines(frame, [corners], True, (0, 255, 255), 4, cv.LINE_AA)
-                cv.drawFrameAxes(frame, cam_mat, dist_co, rVec[i], tVec[i], 4, 4)
-
-                # Calculate distance to marker
-                distance = np.sqrt(np.sum(tVec[i] ** 2))
-
-                # Annotate frame with marker information
-                top_right = corners[0].ravel()
-                bottom_right = corners[2].ravel()
-
-                cv.putText(frame, f"id: {ids[0]} Dist: {round(distance, 2)}", top_right, cv.FONT_HERSHEY_PLAIN, 1.7,
-                           (0, 0, 255), 2, cv.LINE_AA)
-                cv.putText(frame, f"angle: {round(Angle[0], 2)}", (top_right[0], top_right[1] + 30),
-                           cv.FONT_HERSHEY_PLAIN, 1.7, (0, 0, 255), 2, cv.LINE_AA)
-                cv.putText(frame, f"x: {round(tVec[i][0][0], 1)} y: {round(tVec[i][1][0], 1)}", bottom_right,
-                           cv.FONT_HERSHEY_PLAIN, 1.6, (0, 0, 255), 2, cv.LINE_AA)
+        tuple: (rvecs, tvecs), (N, 3) arrays of rotation and translation vectors.
+    """
+    if mtx is None or distortion is None:
+        mtx = _default().cam_mat if mtx is None else mtx
+        distortion = _default().dist_co if distortion is None else distortion
+    corners = np.asarray(corners, dtype=np.float32).reshape(-1, 4, 2)
+    points = marker_points(marker_size)
+    rvecs = np.empty((len(corners), 3))
+    tvecs = np.empty((len(corners), 3))
+    for i in range(len(corners)):
+        _, rvec, tvec = cv.solvePnP(points, corners[i], mtx, distortion, False, cv.SOLVEPNP_IPPE_SQUARE)
+        rvecs[i] = rvec.ravel()
+        tvecs[i] = tvec.ravel()
+    return rvecs, tvecs
+
+
+def yaw_angles(rvecs):
+    """
+    Get the marker angle around the camera's vertical axis for many rotation vectors at once.
+
+    It is euler_angles[1] of cv.decomposeProjectionMatrix in closed form: for a rotation matrix R the
+    decomposition gives atan2(-R[2, 0], sqrt(R[2, 1]^2 + R[2, 2]^2)), so only the last row of R is calculated,
+    with the Rodrigues formula.
+
+    Args:
+        rvecs (ndarray): (N, 3) rotation vectors.
+
+    Returns:
+        ndarray: (N,) angles in degrees.
+    """
+    rvecs = np.asarray(rvecs, dtype=np.float64).reshape(-1, 3)
+    theta = np.linalg.norm(rvecs, axis=1)
+    kx, ky, kz = (rvecs / np.where(theta < 1e-12, 1, theta)[:, None]).T  # rotation axis
+    cos, sin = np.cos(theta), np.sin(theta)
+    r20 = kz * kx * (1 - cos) - ky * sin
+    r21 = kz * ky * (1 - cos) + kx * sin
+    r22 = cos + kz * kz * (1 - cos)
+    return np.degrees(np.arctan2(-r20, np.hypot(r21, r22)))
+
+
+class MarkerDetector:
+    """
+    ArUco marker detector of one camera, with its own calibration and tracking state.
+
+    Every camera gets its own detector, so several cameras can be processed at the same time on their
+    own threads or processes. The module functions use default_detector, for the calibration in arrays.npz.
+    """
+
+    def __init__(self, camera_matrix, distortion, marker_size=MARKER_SIZE, aruco_detector=None,
+                 roi_tracking=ROI_TRACKING, pyramid_detection=PYRAMID_DETECTION,
+                 undistort_corners=UNDISTORT_CORNERS, calibration_path=None, board=None):
+        self.cam_mat = camera_matrix
+        self.dist_co = distortion
+        self.calibration_path = calibration_path  # the undistortion camera matrix is cached next to it
+        self.marker_size = marker_size
+        self.detector = aruco_detector or aruco.ArucoDetector(*_detector_settings())
+        self.roi_tracking = roi_tracking
+        self.pyramid_detection = pyramid_detection
+        self.undistort_corners = undistort_corners
+        self.board = board  # MarkerBoard of the wheelchair, None for single markers
+        self._undistortion = None
+        self.roi_corners = None  # corners of the last detection, in full frame coordinates
+        self.roi_misses = 0
+        self.stats = {"roi_searches": 0, "roi_hits": 0, "full_searches": 0, "full_hits": 0,
+                      "pyramid_searches": 0, "pyramid_hits": 0, "frames": 0, "measured_frames": 0}
+        self.pose_filter = PoseFilter()  # tracks the wheelchair pose between frames, rejects the outliers
+        self.last_frame = np.zeros((600, 700, 3), dtype=np.uint8)
+        self.overlay = []  # (id, corners, rvec, tvec, distance, angle) of the accepted markers of last_frame
+        self.frame_overlay = []  # the overlay of the frame the last aruco_detecting returned, [] without markers
+        self.measurement = None  # (tvec, angle, timestamp) of the last accepted marker
+
+    @classmethod
+    def from_calibration(cls, path=CALIBRATION_FILE, **kwargs):
+        """
+        Create a detector for the camera calibrated in a file saved by cameraCalibration.py.
+        """
+        data = np.load(path)
+        return cls(data["mtx"], data["dist"], calibration_path=path, **kwargs)
+
+    def reset(self):
+        """
+        Forget the tracked marker and the statistics.
+        """
+        self.roi_corners = None
+        self.roi_misses = 0
+        self.stats.update(dict.fromkeys(self.stats, 0))
+        self.pose_filter.reset()
+        self.measurement = None
+        self.overlay = []
+        self.frame_overlay = []
+
+    def draw_overlay(self, frame, markers=None):
+        """
+        Draw the accepted markers on a frame returned by aruco_detecting, see draw_overlay().
+
+        Args:
+            frame (ndarray): The frame to draw on.
+            markers (list): The overlay to draw, the one of last_frame by default. frame_overlay is the one of
+                the frame aruco_detecting returned.
+        """
+        return draw_overlay(frame, self.overlay if markers is None else markers, self.cam_mat, self.dist_co)
+
+    def valid_pose_rate(self):
+        """
+        Get the fraction of the frames with an accepted pose measurement, without the predicted poses.
+
+        Returns:
+            float: The valid pose rate (0 before any frame).
+        """
+        return self.stats["measured_frames"] / self.stats["frames"] if self.stats["frames"] else 0.0
+
+    def _measurements(self, marker_corners, marker_IDs, frame_shape):
+        """
+        Estimate the poses of the detected markers, or the joint pose of the markers of the board.
+
+        Returns:
+            list: (ids, corners, rvec, tvec, angle) of every measurement, the board gives at most one.
+        """
+        if self.undistort_corners:
+            undistortion = self.undistortion(frame_shape)
+            pose_corners = undistortion.undistort_points(marker_corners)
+            mtx, distortion = undistortion.new_cam_mat, undistortion.no_distortion
+        else:
+            pose_corners, mtx, distortion = marker_corners, self.cam_mat, self.dist_co
+
+        if self.board is not None:
+            pose = self.board.estimate_pose(pose_corners, marker_IDs, mtx, distortion)
+            if pose is None:
+                return []  # only markers that are not on the wheelchair
+            rvec, tvec, used = pose
+            return [([marker_IDs[i][0] for i in used], [marker_corners[i] for i in used], rvec, tvec,
+                     yaw_angles(rvec)[0])]
+
+        rVec, tVec = estimate_poses(pose_corners, self.marker_size, mtx, distortion)
+        angles = yaw_angles(rVec)  # Angles around the vertical axis
+        return [([ids[0]], [corners], rVec[i], tVec[i], angles[i])
+                for i, (ids, corners) in enumerate(zip(marker_IDs, marker_corners))]
+
+    def undistortion(self, frame_shape):
+        """
+        Get the undistortion of this camera at the resolution of its frames, built or loaded on the first call.
+
+        Returns:
+            Undistortion: The undistortion with the new camera matrix.
+        """
+        resolution = (frame_shape[1], frame_shape[0])
+        if self._undistortion is None or self._undistortion.resolution != resolution:
+            cache_dir = os.path.dirname(os.path.abspath(self.calibration_path)) if self.calibration_path else None
+            self._undistortion = get_undistortion(self.cam_mat, self.dist_co, resolution, cache_dir)
+        return self._undistortion
+
+    def _roi_box(self, frame_shape):
+        """
+        Get the region of interest around the last detected corners, grown by the missed frames.
+
+        Returns:
+            tuple: (left, top, right, bottom) of the region in the frame.
+        """
+        low = self.roi_corners.min(axis=0)
+        high = self.roi_corners.max(axis=0)
+        pad = max(ROI_PADDING * (high - low).max(), ROI_MIN_PADDING) * ROI_GROWTH ** self.roi_misses
+        left, top = np.maximum(np.floor(low - pad), 0).astype(int)
+        right = int(min(np.ceil(high[0] + pad), frame_shape[1]))
+        bottom = int(min(np.ceil(high[1] + pad), frame_shape[0]))
+        return left, top, right, bottom
+
+    def pyramid_detect(self, gray_frame):
+        """
+        Detect ArUco markers on a downscaled frame and refine their corners on the full resolution frame.
+
+        Args:
+            gray_frame (ndarray): The full resolution grayscale frame.
+
+        Returns:
+            tuple: Detected corners (in full frame coordinates) and their IDs, like detector.detectMarkers.
+        """
+        small_frame = cv.resize(gray_frame, (0, 0), fx=PYRAMID_SCALE, fy=PYRAMID_SCALE, interpolation=cv.INTER_AREA)
+        marker_corners, marker_IDs, _ = self.detector.detectMarkers(small_frame)
+        self.stats["pyramid_searches"] += 1
+        if not marker_corners:
+            return marker_corners, marker_IDs
+        self.stats["pyramid_hits"] += 1
+
+        refined_corners = []
+        for corners in marker_corners:
+            # map the pixel centers of the downscaled frame back to the full resolution frame
+            full_corners = ((corners.reshape(4, 1, 2) + 0.5) / PYRAMID_SCALE - 0.5).astype(np.float32)
+            cv.cornerSubPix(gray_frame, full_corners, PYRAMID_SUBPIX_WINDOW, (-1, -1), subpix_criteria)
+            refined_corners.append(full_corners.reshape(1, 4, 2))
+        return tuple(refined_corners), marker_IDs
+
+    def detect_markers(self, gray_frame):
+        """
+        Detect ArUco markers, searching only around the last detection while the marker is tracked.
+
+        Full frame searches use pyramid_detect when pyramid_detection is set.
+
+        Args:
+            gray_frame (ndarray): The grayscale frame.
+
+        Returns:
+            tuple: Detected corners (in full frame coordinates) and their IDs, like detector.detectMarkers.
+        """
+        if self.roi_tracking and self.roi_corners is not None:
+            left, top, right, bottom = self._roi_box(gray_frame.shape)
+            marker_corners, marker_IDs, _ = self.detector.detectMarkers(gray_frame[top:bottom, left:right])
+            self.stats["roi_searches"] += 1
+            if marker_corners:
+                self.stats["roi_hits"] += 1
+                offset = np.array([left, top], dtype=np.float32)
+                marker_corners = tuple(corners + offset for corners in marker_corners)
             else:
-                distance = 500000
-                failCount2 += 1
-                frame = last_frame  # Use last valid frame if detection fails
+                self.roi_misses += 1
+                if self.roi_misses > ROI_MAX_MISSES:  # the marker is lost, search the full frame next time
+                    self.roi_corners = None
+                return marker_corners, marker_IDs
+        else:
+            marker_corners, marker_IDs = (), None
+            if self.pyramid_detection:
+                marker_corners, marker_IDs = self.pyramid_detect(gray_frame)
+            if not marker_corners:  # nothing found on the downscaled frame, search the full resolution one
+                marker_corners, marker_IDs, _ = self.detector.detectMarkers(gray_frame)
+                self.stats["full_searches"] += 1
+                if marker_corners:
+                    self.stats["full_hits"] += 1
 
-    else:
-        distance = 500000
+        if marker_corners:
+            self.roi_corners = np.concatenate([corners.reshape(4, 2) for corners in marker_corners])
+            self.roi_misses = 0
+        return marker_corners, marker_IDs
+
+    def roi_hit_rate(self):
+        """
+        Get the fraction of the region of interest searches that found a marker.
+
+        Returns:
+            float: The ROI hit rate (0 before any ROI search).
+        """
+        return self.stats["roi_hits"] / self.stats["roi_searches"] if self.stats["roi_searches"] else 0.0
+
+    def aruco_detecting(self, frame, timestamp=None):
+        """
+        Detect ArUco markers in a given frame and estimate their pose.
+
+        Nothing is drawn on the frame, the accepted markers of the returned frame are kept in frame_overlay for
+        draw_overlay(), which the windows call only for the frames they show. With a board, all its visible
+        markers give one pose.
+        The measured poses go through pose_filter. Without a detection the pose is predicted while the track
+        is valid, so the detection only drops after the marker was lost for pose_filter.max_coast seconds.
+
+        Args:
+            frame (ndarray): The input image frame to process.
+            timestamp (float): time.monotonic() when the frame was captured, now by default.
+
+        Returns:
+            tuple: Processed frame, detection status, distance to marker, and estimated pose (x, z, angle).
+        """
+        if timestamp is None:
+            timestamp = time.monotonic()
         detection = False
-        failCount2 = 0
-        failCount1 += 1
-        if failCount1 > 10:
-            failCount1 = 0
-            first_time = True
-        elif not first_time:
-            detection = True
-
-    # Reset output if no detection
-    if not detection:
-        output_x, output_z, output_angle = 0, 1000, 0
-
-    return frame, detection, distance, output_x, output_z, output_angle
+        distance = 500000
+
+        start = time.monotonic()
+        gray_frame = cv.cvtColor(frame, cv.COLOR_BGR2GRAY)  # Convert to grayscale
+        start = latency.lap("grayscale", start)
+        marker_corners, marker_IDs = self.detect_markers(gray_frame)
+        start = latency.lap("detection", start)
+        filtering = 0.0
+
+        self.stats["frames"] += 1
+        self.frame_overlay = []
+
+        if marker_corners:
+            measurements = self._measurements(marker_corners, marker_IDs, frame.shape)
+            latency.lap("pose_estimation", start)
+
+            overlay = []
+            rejected = False
+            for ids, corners, rvec, tvec, Angle in measurements:
+                # Check if the detected marker agrees with the tracked pose
+                start = time.monotonic()
+                accepted = self.pose_filter.update(tvec[0], tvec[2], Angle, timestamp)
+                filtering += time.monotonic() - start
+                if accepted:
+                    detection = True
+                    self.measurement = (tvec, Angle, timestamp)
+
+                    # Calculate distance to marker
+                    distance = np.linalg.norm(tvec)
+                    overlay += [(marker_id, marker.reshape(4, 2).astype(int), rvec, tvec, distance, Angle)
+                                for marker_id, marker in zip(ids, corners)]
+                else:
+                    rejected = True
+            if overlay:
+                self.last_frame = frame.copy()  # the caller may reuse its frame buffer for the next frame
+                self.overlay = self.frame_overlay = overlay
+                self.stats["measured_frames"] += 1
+            elif rejected:
+                frame = self.last_frame  # Use last valid frame if the measurement is rejected
+                self.frame_overlay = self.overlay
+
+        start = time.monotonic()
+        if not detection:
+            detection = self.pose_filter.tracking(timestamp)  # Coast on the predicted pose through short dropouts
+
+        # Reset output if no detection
+        if not detection:
+            latency.record("filtering", filtering + time.monotonic() - start)
+            return frame, detection, distance, 0, 1000, 0
+        output_x, output_z, output_angle = self.pose_filter.predict(timestamp)
+        latency.record("filtering", filtering + time.monotonic() - start)
+        return frame, detection, distance, output_x, output_z, output_angle
+
+
+def draw_overlay(frame, markers, mtx, distortion):
+    """
+    Draw the accepted markers of aruco_detecting on a frame: outline, axes, ID, distance, angle and position.
+
+    Args:
+        frame (ndarray): The frame to draw on.
+        markers (list): (id, corners, rvec, tvec, distance, angle) of every marker, see MarkerDetector.overlay.
+        mtx (ndarray): Camera matrix.
+        distortion (ndarray): Distortion coefficients.
+
+    Returns:
+        ndarray: The frame.
+    """
+    for marker_id, corners, rvec, tvec, distance, angle in markers:
+        # Draw on the camera window
+        cv.polylines(frame, [corners], True, (0, 255, 255), 4, cv.LINE_AA)
+        cv.drawFrameAxes(frame, mtx, distortion, rvec, tvec, 4, 4)
+
+        # Annotate frame with marker information
+        top_right = corners[0].ravel()
+        bottom_right = corners[2].ravel()
+
+        cv.putText(frame, f"id: {marker_id} Dist: {round(distance, 2)}", top_right, cv.FONT_HERSHEY_PLAIN,
+                   1.7, (0, 0, 255), 2, cv.LINE_AA)
+        cv.putText(frame, f"angle: {round(angle, 2)}", (top_right[0], top_right[1] + 30),
+                   cv.FONT_HERSHEY_PLAIN, 1.7, (0, 0, 255), 2, cv.LINE_AA)
+        cv.putText(frame, f"x: {round(tvec[0], 1)} y: {round(tvec[1], 1)}", bottom_right,
+                   cv.FONT_HERSHEY_PLAIN, 1.6, (0, 0, 255), 2, cv.LINE_AA)
+    return frame
+
+
+def detector_parameters(settings):
+    """
+    Create detector parameters from a dict of DetectorParameters attributes, the others keep their defaults.
+    """
+    parameters = aruco.DetectorParameters()
+    for name, value in settings.items():
+        setattr(parameters, name, value)
+    return parameters
+
+
+def load_profile(path):
+    """
+    Use the dictionary and the detector parameters selected in a profile of detector_tuning.py for the detectors
+    created afterwards, and for the default camera's detector when it is not created yet.
+
+    Args:
+        path (str): The profile file.
+
+    Returns:
+        dict: The selected settings, with their measured latency, recall and pose error.
+    """
+    global DICTIONARY, DETECTOR_SETTINGS
+    with open(path) as file:
+        selected = json.load(file)["selected"]
+    DICTIONARY, DETECTOR_SETTINGS = selected["dictionary"], selected["parameters"]
+    for name in _LAZY_DETECTOR:
+        globals().pop(name, None)  # created again with the new settings
+    return selected
+
+
+def _detector_settings():
+    """
+    Get the dictionary and the detector parameters of DICTIONARY and DETECTOR_SETTINGS, created on the first call.
+
+    Returns:
+        tuple: (marker_dict, param_markers)
+    """
+    global marker_dict, param_markers
+    if "marker_dict" not in globals():
+        marker_dict = aruco.getPredefinedDictionary(getattr(aruco, DICTIONARY))
+        param_markers = detector_parameters(DETECTOR_SETTINGS)
+    return marker_dict, param_markers
+
+
+def _module_detector():
+    global detector
+    if "detector" not in globals():
+        detector = aruco.ArucoDetector(*_detector_settings())
+    return detector
+
+
+def init(calibration=CALIBRATION_FILE):
+    """
+    Load the calibration data and create the detector of the default camera.
+
+    Importing the module does not load anything, this runs on the first use of the calibration or of the
+    module functions, or it can be called at startup.
+
+    Args:
+        calibration (str): Calibration data file saved by cameraCalibration.py.
+
+    Returns:
+        MarkerDetector: The default camera's detector.
+    """
+    global calib_data, cam_mat, dist_co, r_vectors, t_vectors, default_detector, pose_filter, detection_stats
+    # Load calibration data from file
+    calib_data = np.load(calibration)
+    cam_mat = calib_data["mtx"]  # Camera matrix
+    dist_co = calib_data["dist"]  # Distortion coefficients
+    r_vectors = calib_data["rvecs"]  # Rotation vectors
+    t_vectors = calib_data["tvecs"]  # Translation vectors
+
+    # The detector of the default camera
+    default_detector = MarkerDetector(cam_mat, dist_co, aruco_detector=_module_detector(),
+                                      calibration_path=calibration, board=default_board())
+    pose_filter = default_detector.pose_filter
+    detection_stats = default_detector.stats
+    return default_detector
+
+
+@lru_cache(maxsize=4)
+def _load_board(path):
+    return MarkerBoard.from_file(path)
+
+
+def default_board():
+    """
+    Get the board of the BOARD layout file.
+
+    Returns:
+        MarkerBoard: The board, or None when BOARD is not set.
+    """
+    return _load_board(BOARD) if BOARD else None
+
+
+def __getattr__(name):
+    """
+    Load the calibration or create the detector on the first access to one of the lazy module attributes.
+    """
+    if name in _LAZY:
+        init()
+        return globals()[name]
+    if name in _LAZY_DETECTOR:
+        _module_detector()
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _default():
+    return globals().get("default_detector") or init()
+
+
+def pyramid_detect(gray_frame):
+    """
+    pyramid_detect of the default camera's detector.
+    """
+    return _default().pyramid_detect(gray_frame)
+
+
+def detect_markers(gray_frame):
+    """
+    detect_markers of the default camera's detector.
+    """
+    return _default().detect_markers(gray_frame)
+
+
+def roi_hit_rate():
+    """
+    roi_hit_rate of the default camera's detector.
+    """
+    return _default().roi_hit_rate()
+
+
+def aruco_detecting(frame, timestamp=None):
+    """
+    Detect ArUco markers in a frame of the default camera and estimate their pose.
+
+    See MarkerDetector.aruco_detecting.
+    """
+    if recorder is None:
+        return _default().aruco_detecting(frame, timestamp)
+    if timestamp is None:
+        timestamp = time.monotonic()
+    recorder.frame(frame, timestamp)
+    result = _default().aruco_detecting(frame, timestamp)
+    recorder.pose(timestamp, *result[1:])
+    return result
@@ -0,0 +1,240 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import aruco_detection
+import mapping_processing
+import camera_capture
+import GPIO_activation
+import keyboard_control
+import docking_control
+import latency
+from docking_geometry import docking_decision
+from pose_filter import MAX_COAST, MAX_PREDICTION
+import ui_service
+from ui_service import UI_RATE
+
+UI_PERIOD = 1 / UI_RATE  # seconds between refreshes of the windows
+KEY_QUEUE_SIZE = 16  # pressed keys waiting for the control task
+
+
+def put_latest(queue, item):
+    """
+    Put an item in a bounded queue, dropping the oldest item when it is full.
+    """
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(item)
+
+
+def get_newest(queue):
+    """
+    Get the newest item of a queue without waiting, dropping the older ones.
+
+    Returns:
+        The newest item, or None if the queue is empty.
+    """
+    item = None
+    while not queue.empty():
+        item = queue.get_nowait()
+    return item
+
+
+class Runtime:
+    """
+    main.py as asyncio tasks: camera acquisition, pose estimation, docking control, windows and operator input.
+
+    The tasks talk through bounded queues that keep only the newest frame and pose, so a slow stage drops
+    old frames instead of falling behind. The detection runs in a one-thread executor and the camera waits in
+    the default one, so the event loop keeps the windows responsive while docking and disconnecting.
+    """
+
+    def __init__(self, camera_index=0, tick=docking_control.TICK):
+        self.camera_index = camera_index
+        self.tick = tick
+        self.frames = None  # captured frames, created in run() inside the event loop
+        self.poses = None  # (detection, distance, x, z, angle, timestamp, velocity) of the detected frames
+        self.keys = None  # keys pressed in the windows
+        self.display = None  # newest frame, with its accepted markers
+        self.pose = (False, 500000, 0, 1000, 0, 0.0, (0.0, 0.0, 0.0))  # newest pose
+        self.mode = "detection"  # detection, docking, user or disconnecting
+        self.running = True
+        self.latency = {"commands": 0, "sum": 0.0, "max": 0.0}  # frame capture to motor command, in seconds
+        self.counts = {"captured": 0, "dropped": 0, "detected": 0}
+        self._detect_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="detection")
+
+    async def capture(self, cap):
+        """
+        Camera task: wait for new frames in the executor and queue them, dropping the older ones.
+        """
+        loop = asyncio.get_running_loop()
+        while self.running:
+            result = await loop.run_in_executor(None, cap.read_frame)
+            if result is None:
+                if not cap.isOpened():
+                    print("There is a camera problem")
+                    self.running = False
+                continue
+            if self.frames.full():
+                self.counts["dropped"] += 1
+            put_latest(self.frames, result)
+            self.counts["captured"] += 1
+
+    async def detect(self):
+        """
+        Detection task: estimate the pose of the newest frame in the detection executor.
+        """
+        loop = asyncio.get_running_loop()
+        while self.running:
+            frame, timestamp, _ = await self.frames.get()
+            aruco_image, detection, distance, wheelX, wheelZ, wheelAngle = await loop.run_in_executor(
+                self._detect_executor, aruco_detection.aruco_detecting, frame, timestamp)
+            velocity = tuple(aruco_detection.pose_filter.state[3:])
+            detector = aruco_detection.default_detector
+            self.display = (aruco_image, detector.frame_overlay)
+            put_latest(self.poses, (detection, distance, wheelX, wheelZ, wheelAngle, timestamp, velocity))
+            self.counts["detected"] += 1
+
+    async def ui(self):
+        """
+        Window task: pass the newest frame and map to the UI thread of ui_service, and the keys pressed in the
+        windows, or typed in headless mode, to the control task.
+        """
+        shown = None
+        while self.running:
+            if self.display is not None and self.display is not shown:
+                shown = self.display
+                detection, _, wheelX, wheelZ, wheelAngle = self.pose[:5]
+                # the markers and the map are drawn only when the UI thread refreshes the windows
+                ui_service.show_detection(shown[0], detection, wheelX, wheelZ, wheelAngle, markers=shown[1])
+            key = ui_service.read_key()
+            if key != -1:
+                put_latest(self.keys, key)
+            await asyncio.sleep(UI_PERIOD)
+
+    def _predicted_pose(self, now):
+        """
+        Extrapolate the newest pose to now with the pose filter's velocity. A pose whose frame is older than
+        MAX_COAST is not a detection anymore, so the docking stops when the detect task stalls.
+        """
+        detection, distance, wheelX, wheelZ, wheelAngle, timestamp, velocity = self.pose
+        if detection and now - timestamp > MAX_COAST:
+            detection = False
+        if detection:
+            dt = min(max(now - timestamp, 0.0), MAX_PREDICTION)
+            wheelX, wheelZ = wheelX + velocity[0] * dt, wheelZ + velocity[1] * dt
+            wheelAngle = wheelAngle + velocity[2] * dt
+        return detection, distance, wheelX, wheelZ, wheelAngle
+
+    async def control(self):
+        """
+        Control task: the permission to connect, the docking, the user control and the disconnection,
+        one tick at a time on a fixed rate.
+        """
+        timer = docking_control.LoopTimer(self.tick)
+        machine = None
+        message = None
+        while self.running:
+            now = await timer.wait_async()
+            pose = get_newest(self.poses)
+            if pose is not None:
+                self.pose = pose
+            key = get_newest(self.keys) or -1
+            if key in (ord("q"), ord("Q")):
+                self.running = False
+                break
+
+            if self.mode == "detection":
+                detection, _, wheelX, wheelZ, wheelAngle = self.pose[:5]
+                if not detection:
+                    new_message = "No detection\n"
+                elif docking_decision(wheelX, wheelZ, wheelAngle)[0]:
+                    new_message = "You got a permission to connect: press 'c' for connection"
+                    if key in (ord("c"), ord("C")):
+                        machine = docking_control.DockingStateMachine()
+                        self.mode = "docking"
+                else:
+                    new_message = "No permission to connect, adjust the wheelchair position "
+                if new_message != message:
+                    print(new_message)
+                    message = new_message
+
+            elif self.mode == "docking":
+                status = machine.tick(now, *self._predicted_pose(time.monotonic()))
+                if pose is not None and pose[0]:
+                    elapsed = time.monotonic() - pose[5]
+                    self.latency["commands"] += 1
+                    self.latency["sum"] += elapsed
+                    self.latency["max"] = max(self.latency["max"], elapsed)
+                    latency.record("photon_to_pwm", elapsed)
+                if status == docking_control.DONE:
+                    print("connected , press 'd' for disconnection\n")
+                    print("user control...")
+                    self.mode = "user"
+                elif status == docking_control.LOST:
+                    print("Connection interrupted. Returning to detection step.")
+                    GPIO_activation.low_output()
+                    self.mode, message = "detection", None
+
+            elif self.mode == "user":
+                lm, rm, latch, up_arm, down_arm, back_lm, back_rm, disconnect, emergency_stop = \
+                    keyboard_control.keyboard_reader(now)
+                if emergency_stop:
+                    print("Emergency Stop Activated. Halting all operations.")
+                    GPIO_activation.low_output()  # Stop all GPIO outputs
+                else:
+                    GPIO_activation.GPIO_activation(lm, rm, latch, up_arm, down_arm, back_lm, back_rm)
+                if emergency_stop or disconnect:
+                    print("disconnecting")
+                    machine = docking_control.DockingStateMachine(docking_control.DISCONNECT_STEPS, first="stop")
+                    self.mode = "disconnecting"
+
+            elif self.mode == "disconnecting":
+                if machine.tick(now, *self._predicted_pose(now)) == docking_control.DONE:
+                    self.mode, message = "detection", None
+
+            if timer.done():  # The tick overran the safety budget, stop until the next command
+                if self.mode in ("docking", "disconnecting"):
+                    machine.stop(time.monotonic())  # and resume the hold of the step on the next tick
+                elif self.mode == "user":
+                    GPIO_activation.low_output()
+        if self.mode != "detection":
+            GPIO_activation.low_output()
+        self.loop_stats = timer.summary()
+
+    async def run(self):
+        """
+        Run the tasks until 'q' is pressed or the camera fails.
+        """
+        self.frames = asyncio.Queue(maxsize=1)
+        self.poses = asyncio.Queue(maxsize=1)
+        self.keys = asyncio.Queue(maxsize=KEY_QUEUE_SIZE)
+        cap = camera_capture.get_camera(self.camera_index)
+        # load the calibration and render the map layers while the camera starts
+        aruco_detection.init()
+        mapping_processing.init()
+        start = time.monotonic()
+        tasks = [asyncio.create_task(self.capture(cap)), asyncio.create_task(self.detect()),
+                 asyncio.create_task(self.ui())]
+        await self.control()
+        self.running = False
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        cap.stop()
+        self._detect_executor.shutdown()
+        ui_service.destroy_windows()
+
+        elapsed = max(time.monotonic() - start, 1e-9)
+        print(f"captured: {self.counts['captured'] / elapsed:.1f} frames/s, detected: "
+              f"{self.counts['detected'] / elapsed:.1f} frames/s, dropped: {self.counts['dropped']} frames")
+        if self.latency["commands"]:
+            print(f"frame to command latency: mean {self.latency['sum'] / self.latency['commands'] * 1000:.1f} ms, "
+                  f"max {self.latency['max'] * 1000:.1f} ms")
+
+
+def run(camera_index=0):
+    """
+    Run main.py's loop on the asyncio runtime.
+    """
+    asyncio.run(Runtime(camera_index).run())
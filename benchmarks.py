@@ -0,0 +1,756 @@
+import argparse
+import itertools
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from functools import lru_cache
+import cv2 as cv
+from cv2 import aruco
+import numpy as np
+
+import mapping_processing
+import docking_geometry
+import docking_lut
+import aruco_detection
+import keyboard_control
+import marker_board
+import cameraCalibration
+
+FRAME_SIZE = (640, 480)  # (width, height) of the synthetic frames
+BACKGROUND = 120  # grey level of the synthetic background
+SUPERSAMPLING = 4  # the synthetic frames are rendered this many times bigger and averaged down
+THRESHOLD = 0.25  # relative change that counts as a regression when comparing with a baseline
+
+# Unit and direction of every result, and the smallest absolute change that can be a regression
+METRICS = {
+    "mapping_image_ms": ("ms", "lower", 0.05),
+    "mapping_image_kb": ("KiB", "lower", 16),
+    "blankImg_ms": ("ms", "lower", 0.05),
+    "blankImg_kb": ("KiB", "lower", 16),
+    "docking_sweep_us": ("us/pose", "lower", 0.01),
+    "docking_lut_us": ("us/pose", "lower", 1),
+    "aruco_detecting_ms": ("ms", "lower", 0.2),
+    "aruco_detecting_roi_ms": ("ms", "lower", 0.2),
+    "roi_hit_rate": ("fraction", "higher", 0.02),
+    "pyramid_detect_ms": ("ms", "lower", 0.2),
+    "scene_aruco_detecting_ms": ("ms", "lower", 0.2),
+    "scene_pose_estimation_ms": ("ms", "lower", 0.02),
+    "scene_detection_rate": ("fraction", "higher", 0.01),
+    "scene_position_error_median_cm": ("cm", "lower", 0.1),
+    "scene_position_error_p95_cm": ("cm", "lower", 0.2),
+    "scene_angle_error_median_deg": ("deg", "lower", 0.2),
+    "scene_angle_error_p95_deg": ("deg", "lower", 0.5),
+    "single_valid_pose_rate": ("fraction", "higher", 0.02),
+    "board_valid_pose_rate": ("fraction", "higher", 0.02),
+    "board_position_error_median_cm": ("cm", "lower", 0.1),
+    "single_docking_s": ("s", "lower", 0.2),
+    "board_docking_s": ("s", "lower", 0.2),
+    "motors_ms": ("ms", "lower", 0.05),
+    "keyboard_reader_us": ("us/tick", "lower", 5),
+    "calibration_corners_ms": ("ms", "lower", 1.0),
+    "calibration_corners_found": ("fraction", "higher", 0.01),
+    "pose_estimation_10_markers_ms": ("ms", "lower", 0.05),
+    "startup_ms": ("ms", "lower", 20),
+}
+
+# Wheelchair poses (x, z, angle) spread over the camera's field of view
+np.random.seed(0)
+poses = np.column_stack((np.random.uniform(-60, 60, 200), np.random.uniform(20, 150, 200),
+                         np.random.uniform(-60, 60, 200)))
+
+
+def measure(func, calls, repeat=3):
+    """
+        Measure how long one call takes and how much memory it allocates.
+
+        Args:
+            func (callable): Function to call, it gets the index of the call.
+            calls (int): Number of calls in one measurement.
+            repeat (int): Number of measurements, the fastest one is reported.
+
+        Returns:
+            tuple: (ms_per_call, kb_peak_allocated_per_call)
+    """
+    func(0)  # warm up, builds the caches
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for i in range(calls):
+            func(i)
+        best = min(best, time.perf_counter() - start)
+
+    # peak of the memory allocated while a call runs, numpy reports its buffers to tracemalloc
+    allocated = 0
+    tracemalloc.start()
+    for i in range(calls):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        func(i)
+        allocated += tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    return best / calls * 1000, allocated / calls / 1024
+
+
+def bench_mapping_image(calls=len(poses)):
+    return measure(lambda i: mapping_processing.mapping_image(*poses[i % len(poses)]), calls)
+
+
+def bench_blankImg(calls=100):
+    return measure(lambda i: mapping_processing.blankImg(), calls)
+
+
+def bench_docking_sweep(size=1000000):
+    """
+        Time the vectorized docking geometry over a sweep of poses.
+
+        Returns:
+            float: Microseconds per pose.
+    """
+    sweepX, sweepZ, sweepAngle = np.meshgrid(np.linspace(-60, 60, 100), np.linspace(20, 150, 100),
+                                             np.linspace(-60, 60, size // 10000), indexing="ij")
+    start = time.perf_counter()
+    docking_geometry.docking_geometry(sweepX, sweepZ, sweepAngle)
+    return (time.perf_counter() - start) / sweepX.size * 1e6
+
+
+def bench_docking_lut(calls=len(poses)):
+    """
+        Time a lookup of the docking table against the exact decision of one pose.
+
+        Returns:
+            tuple: (lut_us, exact_us, agreement) microseconds per pose and the fraction of the poses with the
+                same goodPos.
+    """
+    lut = docking_lut.init()
+    lut_ms = measure(lambda i: lut.lookup(*poses[i % len(poses)]), calls)[0]
+    exact_ms = measure(lambda i: docking_geometry.docking_decision(*poses[i % len(poses)]), calls)[0]
+    agreement = np.mean([lut.lookup(*pose)[0] == docking_geometry.docking_decision(*pose)[0] for pose in poses])
+    return lut_ms * 1000, exact_ms * 1000, float(agreement)
+
+
+def marker_frames(count=200, side=90, marker_id=7, noise=0):
+    """
+        Make camera frames of a marker that moves a few pixels between frames.
+
+        Args:
+            count (int): Number of frames.
+            side (int): Marker side in pixels.
+            marker_id (int): ID of the marker in DICT_4X4_250.
+            noise (float): Standard deviation of the gaussian noise added to the frames.
+
+        Returns:
+            list: BGR frames of 480x640.
+    """
+    marker = aruco.generateImageMarker(aruco_detection.marker_dict, marker_id, side)
+    marker = cv.copyMakeBorder(marker, side // 4, side // 4, side // 4, side // 4, cv.BORDER_CONSTANT, value=255)
+    rng = np.random.default_rng(0)
+    frames = []
+    for i in range(count):
+        frame = np.full((480, 640), 120, dtype=np.uint8)
+        x = int(200 + 120 * np.sin(i / 40))
+        y = int(150 + 60 * np.cos(i / 30))
+        frame[y:y + marker.shape[0], x:x + marker.shape[1]] = marker
+        if noise:
+            frame = np.clip(frame + rng.normal(0, noise, frame.shape), 0, 255).astype(np.uint8)
+        frames.append(cv.cvtColor(frame, cv.COLOR_GRAY2BGR))
+    return frames
+
+
+def bench_aruco_detecting(roi_tracking, frames=None):
+    """
+        Time aruco_detecting on a moving marker, with or without the region of interest tracking.
+
+        Returns:
+            tuple: (ms_per_frame, roi_hit_rate, detected_fraction)
+    """
+    frames = frames or marker_frames()
+    aruco_detection.default_detector.roi_tracking = roi_tracking
+    aruco_detection.default_detector.reset()
+    detected = 0
+    start = time.perf_counter()
+    for frame in frames:
+        detected += aruco_detection.aruco_detecting(frame.copy())[2] != 500000
+    elapsed = time.perf_counter() - start
+    return elapsed / len(frames) * 1000, aruco_detection.roi_hit_rate(), detected / len(frames)
+
+
+def bench_pyramid_detect(frames=None):
+    """
+        Compare the pyramid detection with the full resolution detection on far markers.
+
+        Returns:
+            tuple: (full_ms, pyramid_ms, found_fraction, max_position_error_cm, max_angle_error_deg)
+    """
+    frames = frames or marker_frames(side=40, noise=4)
+    grays = [cv.cvtColor(frame, cv.COLOR_BGR2GRAY) for frame in frames]
+
+    def detect_all(detect):
+        start = time.perf_counter()
+        results = [detect(gray) for gray in grays]
+        return (time.perf_counter() - start) / len(grays) * 1000, results
+
+    full_ms, full_results = detect_all(lambda gray: aruco_detection.detector.detectMarkers(gray)[0])
+    pyramid_ms, pyramid_results = detect_all(lambda gray: aruco_detection.pyramid_detect(gray)[0])
+
+    found, position_error, angle_error = 0, 0.0, 0.0
+    for full_corners, pyramid_corners in zip(full_results, pyramid_results):
+        if not full_corners or not pyramid_corners:
+            continue
+        found += 1
+        poses = [aruco_detection.my_estimatePoseSingleMarkers(corners[:1], aruco_detection.MARKER_SIZE,
+                                                              aruco_detection.cam_mat, aruco_detection.dist_co)
+                 for corners in (full_corners, pyramid_corners)]
+        position_error = max(position_error, float(np.linalg.norm(poses[0][1][0] - poses[1][1][0])))
+        rotations = [cv.Rodrigues(pose[0][0])[0] for pose in poses]
+        cos_angle = (np.trace(rotations[0].T @ rotations[1]) - 1) / 2
+        angle_error = max(angle_error, float(np.degrees(np.arccos(np.clip(cos_angle, -1, 1)))))
+    return full_ms, pyramid_ms, found / len(grays), position_error, angle_error
+
+
+def marker_corners(count, seed=0):
+    """
+        Project markers at random poses in front of the camera.
+
+        Returns:
+            ndarray: (count, 4, 2) corners, like the detected ones.
+    """
+    rng = np.random.default_rng(seed)
+    points = aruco_detection.marker_points(aruco_detection.MARKER_SIZE)
+    corners = np.empty((count, 4, 2), dtype=np.float32)
+    for i in range(count):
+        rvec = np.array([np.pi + rng.normal(0, 0.2), rng.uniform(-1, 1), rng.normal(0, 0.1)])
+        tvec = np.array([rng.uniform(-30, 30), rng.uniform(-10, 10), rng.uniform(40, 200)])
+        projected, _ = cv.projectPoints(points, rvec, tvec, aruco_detection.cam_mat, aruco_detection.dist_co)
+        corners[i] = projected.reshape(4, 2) + rng.normal(0, 0.3, (4, 2))
+    return corners
+
+
+def bench_pose_estimation(count, calls=50):
+    """
+        Compare the per marker pose and angle calculation of aruco_detecting with the batched one.
+
+        Returns:
+            tuple: (per_marker_ms, batched_ms, max_angle_difference_deg) for all the markers of a frame.
+    """
+    corners = marker_corners(count)
+    detected = tuple(corners[i:i + 1] for i in range(count))
+
+    def per_marker():
+        rVec, tVec, _ = aruco_detection.my_estimatePoseSingleMarkers(detected, aruco_detection.MARKER_SIZE,
+                                                                     aruco_detection.cam_mat, aruco_detection.dist_co)
+        angles = []
+        for i in range(count):
+            rVec2 = np.array(rVec, dtype=np.float32)
+            rotation_matrix, _ = cv.Rodrigues(rVec2[i])
+            euler_angles = cv.decomposeProjectionMatrix(np.hstack((rotation_matrix, np.zeros((3, 1)))))[6]
+            angles.append(euler_angles[1][0])
+        return angles
+
+    def batched():
+        rvecs, _ = aruco_detection.estimate_poses(detected)
+        return aruco_detection.yaw_angles(rvecs)
+
+    timings = []
+    for func in (per_marker, batched):
+        timings.append(measure(lambda i: func(), calls)[0])
+    difference = float(np.abs(np.array(per_marker()) - batched()).max())
+    return timings[0], timings[1], difference
+
+
+@lru_cache(maxsize=4)
+def distortion_maps(size=FRAME_SIZE):
+    """
+        Get the remap tables that distort a pinhole image like the calibrated camera does.
+
+        Returns:
+            tuple: (map1, map2) for cv.remap, the distorted pixel of every pinhole pixel.
+    """
+    grid = np.mgrid[0:size[1], 0:size[0]][::-1].reshape(2, -1).T.astype(np.float32)
+    pinhole = cv.undistortPoints(grid.reshape(-1, 1, 2), aruco_detection.cam_mat, aruco_detection.dist_co,
+                                 P=aruco_detection.cam_mat).reshape(size[1], size[0], 2)
+    return cv.convertMaps(pinhole, None, cv.CV_16SC2)
+
+
+def marker_rvec(yaw):
+    """
+        Rotation vector of a marker facing the camera, turned by yaw degrees around the vertical axis.
+    """
+    theta = np.radians(yaw)
+    turn = np.array([[np.cos(theta), 0, np.sin(theta)], [0, 1, 0], [-np.sin(theta), 0, np.cos(theta)]])
+    return cv.Rodrigues(turn @ np.diag([1.0, -1.0, -1.0]))[0].ravel()
+
+
+def render_scene(markers, blur=0.0, noise=0.0, seed=0, side=120, dictionary=None):
+    """
+        Render a camera frame of markers at known poses, with the lens distortion of the calibration.
+
+        The markers are warped on a SUPERSAMPLING times bigger pinhole image that is then averaged down, so the
+        edges are anti-aliased like in a real camera and the corners are not quantized to whole pixels.
+
+        Args:
+            markers (list): (marker_id, tvec, yaw) of every marker, tvec in centimeters in the camera frame, or
+                (marker_id, tvec, yaw, size) for markers of another size than MARKER_SIZE.
+            blur (float): Sigma of the gaussian blur, 0 for none.
+            noise (float): Standard deviation of the gaussian noise.
+            seed (int): Seed of the noise.
+            side (int): Side of the rendered marker images in pixels, before warping.
+            dictionary (aruco.Dictionary): Dictionary of the markers, the detector's one by default.
+
+        Returns:
+            ndarray: 480x640 BGR frame.
+    """
+    border = side // 6  # white quiet zone around the marker
+    # outer edges of the image pixels, projectPoints gives the positions of pixel centers
+    source = np.array([[0, 0], [1, 0], [1, 1], [0, 1]], dtype=np.float32) * (side + 2 * border) - 0.5
+    size = (FRAME_SIZE[0] * SUPERSAMPLING, FRAME_SIZE[1] * SUPERSAMPLING)
+
+    # a pinhole image with a soft gradient, the distortion is applied to the whole frame at the end
+    pinhole = np.tile(np.linspace(BACKGROUND - 30, BACKGROUND + 30, size[0], dtype=np.float32), (size[1], 1))
+    for marker_id, tvec, yaw, *marker_size in markers:
+        half = (marker_size[0] if marker_size else aruco_detection.MARKER_SIZE) / 2 * (side + 2 * border) / side
+        outline = np.array([[-half, half, 0], [half, half, 0], [half, -half, 0], [-half, -half, 0]],
+                           dtype=np.float32)
+        image = aruco.generateImageMarker(dictionary or aruco_detection.marker_dict, marker_id, side)
+        image = cv.copyMakeBorder(image, border, border, border, border, cv.BORDER_CONSTANT, value=255)
+        projected, _ = cv.projectPoints(outline, marker_rvec(yaw), np.asarray(tvec, dtype=np.float64),
+                                        aruco_detection.cam_mat, None)
+        target = (projected.reshape(4, 2) + 0.5) * SUPERSAMPLING - 0.5
+        # warp only the box around the marker
+        left, top = np.clip(np.floor(target.min(axis=0)).astype(int), 0, size)
+        right, bottom = np.clip(np.ceil(target.max(axis=0)).astype(int) + 1, 0, size)
+        if right <= left or bottom <= top:
+            continue  # out of the frame
+        homography = cv.getPerspectiveTransform(source, (target - (left, top)).astype(np.float32))
+        box = (right - left, bottom - top)
+        warped = cv.warpPerspective(image, homography, box, flags=cv.INTER_NEAREST)
+        mask = cv.warpPerspective(np.ones_like(image), homography, box, flags=cv.INTER_NEAREST)
+        np.copyto(pinhole[top:bottom, left:right], warped, where=mask.astype(bool))
+    pinhole = cv.resize(pinhole, FRAME_SIZE, interpolation=cv.INTER_AREA)
+
+    frame = cv.remap(pinhole, *distortion_maps(), cv.INTER_LINEAR, borderMode=cv.BORDER_REPLICATE)
+    if blur:
+        frame = cv.GaussianBlur(frame, (0, 0), blur)
+    if noise:
+        rng = np.random.default_rng(seed)
+        frame = frame + rng.normal(0, noise, frame.shape)
+    frame = np.clip(frame, 0, 255).astype(np.uint8)
+    return cv.cvtColor(frame, cv.COLOR_GRAY2BGR)
+
+
+def synthetic_scenes(count=120, seed=0):
+    """
+        Make frames of one to three markers side by side in the field of view, at random distances and yaws,
+        a third of them blurred and a third noisy.
+
+        Returns:
+            list: (frame, markers) with the markers as render_scene takes them.
+    """
+    rng = np.random.default_rng(seed)
+    scenes = []
+    for i in range(count):
+        markers = []
+        for marker_id in rng.choice(250, size=1 + i % 3, replace=False):
+            z = rng.uniform(40, 180)
+            x = ((len(markers) + 1) // 2 * (-1) ** len(markers) * 0.3 + rng.uniform(-0.05, 0.05)) * z  # side by side
+            markers.append((int(marker_id), (x, rng.uniform(-0.05, 0.05) * z, z), rng.uniform(-50, 50)))
+        blur = 1.2 if i % 3 == 1 else 0.0
+        noise = 6.0 if i % 3 == 2 else 0.0
+        scenes.append((render_scene(markers, blur, noise, seed=i), markers))
+    return scenes
+
+
+def bench_scenes(scenes=None):
+    """
+        Time aruco_detecting and the pose estimation on the synthetic scenes and check the estimated poses
+        of the detected markers against the rendered ones.
+
+        Returns:
+            dict: Timings per frame, detection rate and the median and 95th percentile pose errors.
+    """
+    scenes = scenes or synthetic_scenes()
+    detector = aruco_detection.default_detector
+    roi_tracking = detector.roi_tracking
+    detector.roi_tracking = False  # the scenes are unrelated frames
+    try:
+        start = time.perf_counter()
+        for frame, _ in scenes:
+            detector.reset()
+            aruco_detection.aruco_detecting(frame.copy())
+        detecting_ms = (time.perf_counter() - start) / len(scenes) * 1000
+
+        detections = [detector.detect_markers(cv.cvtColor(frame, cv.COLOR_BGR2GRAY)) for frame, _ in scenes]
+    finally:
+        detector.roi_tracking = roi_tracking
+        detector.reset()
+
+    start = time.perf_counter()
+    for corners, _ in detections:
+        if corners:
+            aruco_detection.my_estimatePoseSingleMarkers(corners, aruco_detection.MARKER_SIZE,
+                                                         aruco_detection.cam_mat, aruco_detection.dist_co)
+    estimation_ms = (time.perf_counter() - start) / len(scenes) * 1000
+
+    position_errors, angle_errors, rendered, found = [], [], 0, 0
+    for (_, markers), (corners, ids) in zip(scenes, detections):
+        rendered += len(markers)
+        if not corners:
+            continue
+        rvecs, tvecs = aruco_detection.estimate_poses(corners)
+        angles = aruco_detection.yaw_angles(rvecs)
+        truth = {marker_id: (np.asarray(tvec), yaw) for marker_id, tvec, yaw in markers}
+        for i, marker_id in enumerate(np.asarray(ids).ravel()):
+            if marker_id not in truth:
+                continue  # a false detection counts as a missed marker
+            found += 1
+            position_errors.append(float(np.linalg.norm(tvecs[i] - truth[marker_id][0])))
+            angle_errors.append(abs(float(angles[i]) - truth[marker_id][1]))
+    return {"scene_aruco_detecting_ms": detecting_ms, "scene_pose_estimation_ms": estimation_ms,
+            "scene_detection_rate": found / rendered,
+            "scene_position_error_median_cm": float(np.median(position_errors)),
+            "scene_position_error_p95_cm": float(np.percentile(position_errors, 95)),
+            "scene_angle_error_median_deg": float(np.median(angle_errors)),
+            "scene_angle_error_p95_deg": float(np.percentile(angle_errors, 95))}
+
+
+def board_markers(board, tvec, yaw):
+    """
+        Place the markers of a board at a pose, the board origin at tvec, turned by yaw degrees.
+
+        Returns:
+            list: (marker_id, tvec, yaw, size) of every marker, as render_scene takes them.
+    """
+    rotation = cv.Rodrigues(marker_rvec(yaw))[0]
+    return [(marker_id, np.asarray(tvec, dtype=np.float64) + rotation @ corners.mean(axis=0), yaw,
+             float(corners[1, 0] - corners[0, 0])) for marker_id, corners in board.corners.items()]
+
+
+def occlude(frame, tvec, cover, shift=(0.0, 0.0)):
+    """
+        Hide a part of the marker at tvec behind a dark square, like a hand or a bag in front of the wheelchair.
+
+        Args:
+            frame (ndarray): The frame, changed in place.
+            tvec (tuple): Center of the marker in the camera frame.
+            cover (float): Side of the square relative to the marker, 0 for none.
+            shift (tuple): Offset of the square from the marker center, relative to the marker.
+    """
+    if not cover:
+        return frame
+    center = cv.projectPoints(np.asarray(tvec, dtype=np.float64).reshape(1, 3), np.zeros(3), np.zeros(3),
+                              aruco_detection.cam_mat, aruco_detection.dist_co)[0].ravel()
+    side = aruco_detection.cam_mat[0, 0] * aruco_detection.MARKER_SIZE / tvec[2]  # marker side in pixels
+    x, y = (center + np.asarray(shift) * side).astype(int)
+    half = int(cover * side / 2)
+    frame[max(y - half, 0):max(y + half, 0), max(x - half, 0):max(x + half, 0)] = 40
+    return frame
+
+
+def _valid_pose(detector, tvec, yaw, tolerance=(0.05, 10.0)):
+    """
+        Check that the last frame gave an accepted measurement within tolerance of the truth: the position error
+        relative to the distance, and the angle error in degrees.
+    """
+    if detector.measurement is None:
+        return False
+    measured, angle, _ = detector.measurement
+    return bool(np.linalg.norm(np.asarray(measured) - tvec) < tolerance[0] * np.linalg.norm(tvec) and
+                abs(angle - yaw) < tolerance[1])
+
+
+def bench_board(count=150, seed=0):
+    """
+        Compare the joint pose of the marker board of marker_board.BOARD_FILE with the single marker in its
+        center, on synthetic frames at random poses, with steep angles and half of them partly occluded.
+
+        Returns:
+            dict: Fraction of the frames with a valid pose in both modes, and the board's median position error.
+    """
+    board = marker_board.MarkerBoard.from_file()
+    single = aruco_detection.MarkerDetector(aruco_detection.cam_mat, aruco_detection.dist_co, roi_tracking=False)
+    joint = aruco_detection.MarkerDetector(aruco_detection.cam_mat, aruco_detection.dist_co, roi_tracking=False,
+                                           board=board)
+    rng = np.random.default_rng(seed)
+    valid = {"single": 0, "board": 0}
+    errors = []
+    for i in range(count):
+        z = rng.uniform(50, 200)
+        tvec = np.array([rng.uniform(-0.2, 0.2) * z, rng.uniform(-0.05, 0.05) * z, z])
+        yaw = rng.uniform(-70, 70)
+        cover = rng.uniform(0.4, 1.0) if i % 2 else 0.0
+        shift = rng.uniform(-0.3, 0.3, 2)
+        for name, detector, markers in (("single", single, [(7, tvec, yaw)]),
+                                        ("board", joint, board_markers(board, tvec, yaw))):
+            frame = occlude(render_scene(markers, seed=i), tvec, cover, shift)
+            detector.reset()
+            detector.aruco_detecting(frame, 0.0)
+            valid[name] += _valid_pose(detector, tvec, yaw)
+            if name == "board" and detector.measurement is not None:
+                errors.append(float(np.linalg.norm(detector.measurement[0] - tvec)))
+    return {"single_valid_pose_rate": valid["single"] / count, "board_valid_pose_rate": valid["board"] / count,
+            "board_position_error_median_cm": float(np.median(errors))}
+
+
+def bench_docking_session(use_board, steps=90, fps=30.0):
+    """
+        Simulate the approach of a docking session on synthetic frames: the wheelchair comes from far and turned
+        to the docking pose, but the robot only moves on the frames with a valid pose. The center marker is
+        partly hidden one third of the time.
+
+        Args:
+            use_board (bool): Detect the board of marker_board.BOARD_FILE, or only its center marker.
+            steps (int): Frames with a valid pose needed to complete the approach.
+            fps (float): Frame rate of the session.
+
+        Returns:
+            tuple: (docking_seconds, valid_pose_rate), the time is capped at 5 times the undisturbed one.
+    """
+    board = marker_board.MarkerBoard.from_file() if use_board else None
+    detector = aruco_detection.MarkerDetector(aruco_detection.cam_mat, aruco_detection.dist_co, board=board)
+    start, end = np.array([35.0, 2.0, 190.0, 60.0]), np.array([0.0, 2.0, 35.0, 0.0])  # x, y, z, yaw
+    done, frames = 0, 0
+    while done < steps and frames < 5 * steps:
+        x, y, z, yaw = start + (end - start) * done / steps
+        tvec = np.array([x, y, z])
+        markers = board_markers(board, tvec, yaw) if use_board else [(7, tvec, yaw)]
+        cover = 0.9 if (frames // 20) % 3 == 1 else 0.0  # a hand in front of the center marker
+        frame = occlude(render_scene(markers, noise=3.0, seed=frames), tvec, cover, (0.1, -0.2))
+        detector.measurement = None
+        detector.aruco_detecting(frame, frames / fps)
+        done += _valid_pose(detector, tvec, yaw)
+        frames += 1
+    return frames / fps, detector.valid_pose_rate()
+
+
+def bench_motors(calls=200):
+    """
+        Time the drawing of keyboard_control.motors, without showing the window.
+
+        Returns:
+            float: Milliseconds per call.
+    """
+    states = [(i % 100, (i * 7) % 100, i % 2, i % 3 == 0, i % 3 == 1, i % 4 == 0, i % 4 == 1, i % 5 == 0, i % 5 == 1)
+              for i in range(calls)]
+    show = keyboard_control.ui_service.show
+    keyboard_control.ui_service.show = lambda *args: None
+    try:
+        return measure(lambda i: keyboard_control.motors(*states[i % calls]), calls)[0]
+    finally:
+        keyboard_control.ui_service.show = show
+
+
+def bench_keyboard_reader(ticks=2000):
+    """
+        Time a control tick of keyboard_control.keyboard_reader driven by a scripted drive: forward, turns,
+        backward, arm and latch keys. The panel is drawn but not shown.
+
+        Returns:
+            float: Microseconds per tick.
+    """
+    script = [(50, ["up"]), (25, ["up", "right"]), (25, ["up", "left"]), (10, []), (40, ["down"]),
+              (10, ["down", "left"]), (10, ["left"]), (10, ["right"]), (5, ["u"]), (5, ["y"]), (3, ["l"]), (7, [])]
+    show, source = keyboard_control.ui_service.show, keyboard_control.source
+    state = {name: getattr(keyboard_control, name) for name in ("lm", "rm", "time0", "time1", "time2", "time3",
+                                                                "extra1", "extra2", "latch", "latch_time")}
+    keyboard_control.ui_service.show = lambda *args: None
+    keyboard_control.set_input(keyboard_control.ScriptedInput(script, repeat=True))
+    clock = itertools.count(time.monotonic() / 0.02)  # 20 ms control ticks, the time never goes back
+    try:
+        return measure(lambda i: keyboard_control.keyboard_reader(next(clock) * 0.02), ticks)[0] * 1000
+    finally:
+        keyboard_control.ui_service.show = show
+        keyboard_control.set_input(source)
+        for name, value in state.items():  # the ramps ran ahead of the real time
+            setattr(keyboard_control, name, value)
+
+
+def checkerboard_image(square=36, yaw=0.0, seed=0):
+    """
+        Render a calibration image of the CHECKERBOARD of cameraCalibration.py, slightly turned.
+
+        Returns:
+            ndarray: 480x640 grey image.
+    """
+    rows, columns = cameraCalibration.CHECKERBOARD[1] + 1, cameraCalibration.CHECKERBOARD[0] + 1
+    board = np.kron((np.indices((rows, columns)).sum(axis=0) % 2) * 255, np.ones((square, square))).astype(np.uint8)
+    board = cv.copyMakeBorder(board, square, square, square, square, cv.BORDER_CONSTANT, value=255)
+    height, width = board.shape
+    source = np.array([[0, 0], [width, 0], [width, height], [0, height]], dtype=np.float32) - 0.5
+    shift = np.radians(yaw) * 60
+    target = np.array([[100 + shift, 20], [540 - shift, 20 + shift], [540 - shift, 460 - shift], [100 + shift, 460]],
+                      dtype=np.float32)
+    image = cv.warpPerspective(board, cv.getPerspectiveTransform(source, target), FRAME_SIZE,
+                               borderValue=BACKGROUND)
+    rng = np.random.default_rng(seed)
+    return np.clip(image + rng.normal(0, 3, image.shape), 0, 255).astype(np.uint8)
+
+
+def bench_calibration_corners(count=6):
+    """
+        Time the checkerboard corner detection of cameraCalibration.py on rendered images.
+
+        Returns:
+            tuple: (ms_per_image, found_fraction)
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        paths = []
+        for i in range(count):
+            paths.append(os.path.join(directory, f"{i}.png"))
+            cv.imwrite(paths[-1], checkerboard_image(yaw=(i - count / 2) * 4, seed=i))
+        start = time.perf_counter()
+        found = sum(len(cameraCalibration.find_corners(path)[1]) > 0 for path in paths)
+        return (time.perf_counter() - start) / count * 1000, found / count
+
+
+def compare(results, baseline, threshold=THRESHOLD):
+    """
+        Compare results with a baseline.
+
+        Args:
+            results (dict): Results by metric name.
+            baseline (dict): Baseline results by metric name, metrics missing from either are skipped.
+            threshold (float): Relative change that counts as a regression.
+
+        Returns:
+            list: (name, baseline_value, value) of the metrics that regressed.
+    """
+    regressions = []
+    for name, (_, better, floor) in METRICS.items():
+        if name not in results or name not in baseline:
+            continue
+        change = results[name] - baseline[name]
+        worse = change if better == "lower" else -change
+        if worse > max(threshold * abs(baseline[name]), floor):
+            regressions.append((name, baseline[name], results[name]))
+    return regressions
+
+
+# Run by bench_startup in a new interpreter: import the modules main.py uses and process the first frame
+STARTUP_SCRIPT = """
+import time
+start = time.perf_counter()
+import numpy as np
+import aruco_detection, mapping_processing, connection_functions
+imported = time.perf_counter()
+frame = np.load({frame_path!r})
+_, detection, _, wheelX, wheelZ, wheelAngle = aruco_detection.aruco_detecting(frame)
+mapping_processing.mapping_image(wheelX, wheelZ, wheelAngle)
+print((imported - start) * 1000, (time.perf_counter() - imported) * 1000, detection)
+"""
+
+
+def bench_startup(runs=5):
+    """
+        Time a cold start, from a new interpreter importing the modules to the first processed frame.
+
+        Returns:
+            tuple: (total_ms, import_ms, first_frame_ms) of the fastest run, the total includes the interpreter start.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        frame_path = os.path.join(directory, "frame.npy")
+        np.save(frame_path, marker_frames(1)[0])
+        script = STARTUP_SCRIPT.format(frame_path=frame_path)
+        best = None
+        for _ in range(runs):
+            start = time.perf_counter()
+            output = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True,
+                                    cwd=os.path.dirname(os.path.abspath(__file__))).stdout.split()
+            total = (time.perf_counter() - start) * 1000
+            if output[2] != "True":
+                raise RuntimeError("the marker was not detected on the first frame")
+            if best is None or total < best[0]:
+                best = (total, float(output[0]), float(output[1]))
+    return best
+
+
+def run_all():
+    """
+        Run every benchmark and print the results.
+
+        Returns:
+            dict: Results by metric name, see METRICS.
+    """
+    results = {}
+    for name, bench in (("mapping_image", bench_mapping_image), ("blankImg", bench_blankImg)):
+        ms, kb = bench()
+        results[f"{name}_ms"], results[f"{name}_kb"] = ms, kb
+        print(f"{name:<16} {ms:8.3f} ms/frame {kb:10.1f} KiB peak allocated/frame")
+    results["docking_sweep_us"] = bench_docking_sweep()
+    print(f"{'docking sweep':<16} {results['docking_sweep_us']:8.3f} us/pose")
+    lut_us, exact_us, agreement = bench_docking_lut()
+    results["docking_lut_us"] = lut_us
+    print(f"{'docking lut':<16} {lut_us:8.3f} us/pose  exact: {exact_us:.3f} us/pose  same goodPos: {agreement:.3f}")
+    frames = marker_frames()
+    for roi_tracking in (False, True):
+        ms, hit_rate, detected = bench_aruco_detecting(roi_tracking, frames)
+        results["aruco_detecting_roi_ms" if roi_tracking else "aruco_detecting_ms"] = ms
+        print(f"{'aruco_detecting':<16} {ms:8.3f} ms/frame  roi tracking: {roi_tracking!s:<5} "
+              f"roi hit rate: {hit_rate:.2f}  detected: {detected:.2f}")
+    results["roi_hit_rate"] = hit_rate
+    full_ms, pyramid_ms, found, position_error, angle_error = bench_pyramid_detect()
+    results["pyramid_detect_ms"] = pyramid_ms
+    print(f"{'pyramid detect':<16} {pyramid_ms:8.3f} ms/frame  full resolution: {full_ms:.3f} ms/frame  "
+          f"found: {found:.2f}  max pose error: {position_error:.2f} cm {angle_error:.2f} deg")
+    for count in (1, 5, 10, 25, 50):
+        per_marker_ms, batched_ms, difference = bench_pose_estimation(count)
+        if count == 10:
+            results["pose_estimation_10_markers_ms"] = batched_ms
+        print(f"{'pose estimation':<16} {batched_ms:8.3f} ms/frame  markers: {count:<3} "
+              f"per marker: {per_marker_ms:.3f} ms/frame  max angle difference: {difference:.1e} deg")
+    scenes = bench_scenes()
+    results.update(scenes)
+    print(f"{'scenes':<16} {scenes['scene_aruco_detecting_ms']:8.3f} ms/frame  "
+          f"pose estimation: {scenes['scene_pose_estimation_ms']:.3f} ms/frame  "
+          f"detected: {scenes['scene_detection_rate']:.2f}")
+    print(f"{'pose accuracy':<16} position error median {scenes['scene_position_error_median_cm']:.2f} cm, "
+          f"p95 {scenes['scene_position_error_p95_cm']:.2f} cm  angle error median "
+          f"{scenes['scene_angle_error_median_deg']:.2f} deg, p95 {scenes['scene_angle_error_p95_deg']:.2f} deg")
+    board = bench_board()
+    results.update(board)
+    print(f"{'board':<16} valid poses: {board['board_valid_pose_rate']:.2f}  single marker: "
+          f"{board['single_valid_pose_rate']:.2f}  position error median "
+          f"{board['board_position_error_median_cm']:.2f} cm")
+    for use_board, name in ((False, "single"), (True, "board")):
+        seconds, rate = bench_docking_session(use_board)
+        results[f"{name}_docking_s"] = seconds
+        print(f"{name + ' docking':<16} {seconds:8.3f} s  valid poses: {rate:.2f}")
+    results["motors_ms"] = bench_motors()
+    print(f"{'motors':<16} {results['motors_ms']:8.3f} ms/call")
+    results["keyboard_reader_us"] = bench_keyboard_reader()
+    print(f"{'keyboard_reader':<16} {results['keyboard_reader_us']:8.3f} us/tick")
+    results["calibration_corners_ms"], results["calibration_corners_found"] = bench_calibration_corners()
+    print(f"{'calib corners':<16} {results['calibration_corners_ms']:8.3f} ms/image  "
+          f"found: {results['calibration_corners_found']:.2f}")
+    total_ms, import_ms, first_frame_ms = bench_startup()
+    results["startup_ms"] = total_ms
+    print(f"{'startup':<16} {total_ms:8.3f} ms to the first frame  imports: {import_ms:.3f} ms  "
+          f"first frame: {first_frame_ms:.3f} ms")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the hot paths and the pose accuracy.")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--save-baseline", metavar="PATH", help="write the results as the new baseline")
+    parser.add_argument("--baseline", metavar="PATH", help="compare with this baseline, fail on a regression")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD,
+                        help="relative change that counts as a regression (default %(default)s)")
+    args = parser.parse_args()
+
+    results = run_all()
+    for path in (args.json, args.save_baseline):
+        if path:
+            with open(path, "w") as file:
+                json.dump(results, file, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.threshold)
+        for name, before, after in regressions:
+            unit = METRICS[name][0]
+            print(f"REGRESSION {name}: {before:.3f} -> {after:.3f} {unit}")
+        if regressions:
+            sys.exit(1)
+        print("no regressions")
@@ -3,69 +3,141 @@
 import cv2
 import numpy as np
 import glob
+import hashlib
+import os
+import sys
+from multiprocessing import Pool
 
 # Defining the dimensions of checkerboard
 CHECKERBOARD = (9, 11)
 criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.001)
-
-# Creating vector to store vectors of 3D points for each checkerboard image
-objpoints = []
-# Creating vector to store vectors of 2D points for each checkerboard image
-imgpoints = []
+CORNERS_CACHE = "./images/corners_cache.npz"  # refined corners of every image, by the hash of its content
 
 # Defining the world coordinates for 3D points
 objp = np.zeros((1, CHECKERBOARD[0] * CHECKERBOARD[1], 3), np.float32)
 objp[0, :, :2] = np.mgrid[0:CHECKERBOARD[0], 0:CHECKERBOARD[1]].T.reshape(-1, 2)
-prev_img_shape = None
 
-# Extracting path of individual image stored in a given  directory
-images = glob.glob('./images/*.png')
-for frame in images:
-    img = cv2.imread(frame)
+
+def image_key(path):
+    """
+    Get the cache key of an image, the hash of its content and the checkerboard dimensions.
+    """
+    with open(path, "rb") as file:
+        digest = hashlib.sha1(file.read()).hexdigest()
+    return f"{digest}_{CHECKERBOARD[0]}x{CHECKERBOARD[1]}"
+
+
+def find_corners(path):
+    """
+    Find and refine the checkerboard corners of an image, runs in the worker processes.
+
+    Returns:
+        tuple: (path, corners, image_size), corners is an empty array if the checkerboard was not found.
+    """
+    img = cv2.imread(path)
     gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
     # Find the chess board corners
     # If desired number of corners are found in the image then ret = true
     ret, corners = cv2.findChessboardCorners(gray, CHECKERBOARD,
                                              cv2.CALIB_CB_ADAPTIVE_THRESH + cv2.CALIB_CB_FAST_CHECK + cv2.CALIB_CB_NORMALIZE_IMAGE)
+    if not ret:
+        return path, np.empty((0, 1, 2), np.float32), gray.shape[::-1]
+    # refining pixel coordinates for given 2d points.
+    corners2 = cv2.cornerSubPix(gray, corners, (11, 11), (-1, -1), criteria)
+    return path, corners2, gray.shape[::-1]
+
+
+def load_cache(path=CORNERS_CACHE):
+    """
+    Returns:
+        dict: Cached corners and image sizes by image key, empty if there is no cache.
+    """
+    if not os.path.exists(path):
+        return {}
+    with np.load(path) as cache:
+        return dict(cache)
+
+
+def save_cache(cache, path=CORNERS_CACHE):
+    temporary = path + ".tmp.npz"
+    np.savez(temporary, **cache)
+    os.replace(temporary, path)
+
 
+def detect_all_corners(images, processes=None):
     """
-    If desired number of corner are detected,
-    we refine the pixel coordinates and display 
-    them on the images of checker board
+    Get the refined corners of all the images, detecting only the new or changed ones, on a process pool.
+
+    The cache keeps only the images of this run, the entries of deleted or replaced images are dropped.
+
+    Args:
+        images (list): Paths of the checkerboard images.
+        processes (int): Number of worker processes, the number of cores by default.
+
+    Returns:
+        tuple: (corners, image_size), corners has the refined corners of every image with a checkerboard.
+    """
+    cache = load_cache()
+    keys = {path: image_key(path) for path in images}
+    new_images = [path for path in images if keys[path] not in cache]
+    print(f"{len(images) - len(new_images)} images cached, detecting corners in {len(new_images)}")
+
+    if new_images:
+        with Pool(processes) as pool:
+            for path, corners, size in pool.imap_unordered(find_corners, new_images):
+                cache[keys[path]] = corners
+                cache[keys[path] + "_size"] = np.array(size)
+    current = {name: cache[name] for key in keys.values() for name in (key, key + "_size")}
+    if new_images or len(current) < len(cache):
+        cache = current
+        save_cache(cache)
+
+    corners = [cache[keys[path]] for path in images if len(cache[keys[path]])]
+    image_size = tuple(int(v) for v in cache[keys[images[0]] + "_size"]) if images else None
+    return corners, image_size
+
+
+def show_corners(images):
     """
-    if ret:
-        objpoints.append(objp)
-        # refining pixel coordinates for given 2d points.
-        corners2 = cv2.cornerSubPix(gray, corners, (11, 11), (-1, -1), criteria)
-
-        imgpoints.append(corners2)
-
-        # Draw and display the corners
-        img = cv2.drawChessboardCorners(img, CHECKERBOARD, corners2, ret)
-        cv2.circle(img, (int(corners2[0, 0, 0]), int(corners2[0, 0, 1])), 8, (100, 0, 100), 6)
-
-    cv2.imshow('img', img)
-    cv2.waitKey(300)
-
-cv2.destroyAllWindows()
-
-h, w = img.shape[:2]
-
-"""
-Performing camera calibration by 
-passing the value of known 3D points (objpoints)
-and corresponding pixel coordinates of the 
-detected corners (imgpoints)
-"""
-ret, mtx, dist, rvecs, tvecs = cv2.calibrateCamera(objpoints, imgpoints, gray.shape[::-1], None, None)
-
-print("Camera matrix : \n")
-print(mtx)
-print("dist : \n")
-print(dist)
-print("rvecs : \n")
-print(rvecs)
-print("tvecs : \n")
-print(tvecs)
-
-np.savez("arrays", mtx=mtx, dist=dist, rvecs=rvecs, tvecs=tvecs)
+    Show the detected corners of every image, for checking the checkerboard detection.
+    """
+    cache = load_cache()
+    for path in images:
+        img = cv2.imread(path)
+        corners2 = cache[image_key(path)]
+        if len(corners2):
+            # Draw and display the corners
+            img = cv2.drawChessboardCorners(img, CHECKERBOARD, corners2, True)
+            cv2.circle(img, (int(corners2[0, 0, 0]), int(corners2[0, 0, 1])), 8, (100, 0, 100), 6)
+        cv2.imshow('img', img)
+        cv2.waitKey(300)
+    cv2.destroyAllWindows()
+
+
+if __name__ == "__main__":
+    # 'python cameraCalibration.py' runs headless, add '--show' to display the detected corners
+    # Extracting path of individual image stored in a given  directory
+    images = sorted(glob.glob('./images/*.png'))
+    imgpoints, image_size = detect_all_corners(images)
+    objpoints = [objp] * len(imgpoints)
+    if "--show" in sys.argv:
+        show_corners(images)
+
+    """
+    Performing camera calibration by
+    passing the value of known 3D points (objpoints)
+    and corresponding pixel coordinates of the
+    detected corners (imgpoints)
+    """
+    ret, mtx, dist, rvecs, tvecs = cv2.calibrateCamera(objpoints, imgpoints, image_size, None, None)
+
+    print("Camera matrix : \n")
+    print(mtx)
+    print("dist : \n")
+    print(dist)
+    print("rvecs : \n")
+    print(rvecs)
+    print("tvecs : \n")
+    print(tvecs)
+
+    np.savez("arrays", mtx=mtx, dist=dist, rvecs=rvecs, tvecs=tvecs)
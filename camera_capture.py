@@ -0,0 +1,137 @@
+import threading
+import time
+import cv2 as cv
+
+
+class CameraCapture:
+    """
+    Shared camera that grabs frames on a background thread and keeps only the newest one.
+
+    The camera is opened once and kept open, so handing it from the detection loop to
+    auto_connection costs nothing, and the frames are never older than the camera's frame period.
+    Frames are shared with every consumer, copy a frame before drawing on it if another consumer uses it.
+    """
+
+    def __init__(self, index=0):
+        self.index = index
+        self._cap = None
+        self._thread = None
+        self._running = False
+        self._condition = threading.Condition()
+        self._frame = None
+        self._timestamp = 0.0  # time.monotonic() when the frame was captured
+        self._seq = 0  # sequence number of the newest frame, 0 before the first one
+        self._read_seq = 0  # sequence number of the last frame returned by read()
+        self._failed = False
+
+    def start(self):
+        """
+        Open the camera and start the grabber thread, if it is not running yet.
+
+        Returns:
+            CameraCapture: The started camera.
+        """
+        if self._running:
+            return self
+        self._cap = cv.VideoCapture(self.index)
+        self._cap.set(cv.CAP_PROP_BUFFERSIZE, 1)  # keep the driver from queueing stale frames
+        self._failed = not self._cap.isOpened()
+        if not self._failed:
+            self._running = True
+            self._thread = threading.Thread(target=self._grab, name=f"camera-{self.index}", daemon=True)
+            self._thread.start()
+        return self
+
+    def _grab(self):
+        """
+        Grabber thread: read frames as fast as the camera delivers them and keep the newest one.
+        """
+        while self._running:
+            ret, frame = self._cap.read()
+            timestamp = time.monotonic()
+            with self._condition:
+                if not ret:
+                    self._failed = True
+                    self._running = False
+                else:
+                    self._frame, self._timestamp = frame, timestamp
+                    self._seq += 1
+                self._condition.notify_all()
+
+    def latest(self):
+        """
+        Get the newest frame without waiting.
+
+        Returns:
+            tuple: (frame, timestamp, seq), frame is None before the first frame arrived.
+        """
+        with self._condition:
+            return self._frame, self._timestamp, self._seq
+
+    def read_frame(self, timeout=1.0):
+        """
+        Wait for a frame newer than the last one returned by read_frame() or read().
+
+        Args:
+            timeout (float): Maximal wait in seconds.
+
+        Returns:
+            tuple: (frame, timestamp, seq), or None if the camera failed or no new frame arrived in time.
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._seq > self._read_seq or self._failed, timeout):
+                return None
+            if self._seq <= self._read_seq:  # failed without a new frame
+                return None
+            self._read_seq = self._seq
+            return self._frame, self._timestamp, self._seq
+
+    def read(self, timeout=1.0):
+        """
+        Drop in for cv.VideoCapture.read(): wait for a new frame.
+
+        Returns:
+            tuple: (ret, frame), ret is False if the camera failed.
+        """
+        result = self.read_frame(timeout)
+        if result is None:
+            return False, None
+        return True, result[0]
+
+    def isOpened(self):
+        """
+        Returns:
+            bool: True while the grabber thread runs, False after the camera failed or the thread died.
+        """
+        return self._running and self._thread is not None and self._thread.is_alive()
+
+    def stop(self):
+        """
+        Stop the grabber thread and release the camera.
+        """
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+            self._thread = None
+        if self._cap is not None:
+            self._cap.release()
+            self._cap = None
+
+
+cameras = {}  # started cameras by index
+
+
+def get_camera(index=0):
+    """
+    Get the shared, started camera for an index, opening it on the first call.
+
+    Args:
+        index (int): Camera index for cv.VideoCapture.
+
+    Returns:
+        CameraCapture: The shared camera.
+    """
+    camera = cameras.get(index)
+    if camera is None or not camera.isOpened():
+        camera = cameras[index] = CameraCapture(index)
+    return camera.start()
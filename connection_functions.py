@@ -1,158 +1,144 @@
 import GPIO_activation
+import aruco_detection
 from aruco_detection import aruco_detecting
-import mapping_processing
-import cv2 as cv
+import docking_control
 import keyboard_control
+import camera_capture
+import ui_service
+import session_recorder
+import latency
 import time
+from pose_filter import MAX_COAST
 
 # Initialize motor control variables
 lm, rm, up_arm, down_arm, back_lm, back_rm = 0, 0, 0, 0, 0, 0
+last_loop_stats = {}  # tick statistics of the last auto_connection, see docking_control.LoopTimer.summary
 
 
-def auto_connection():
+def auto_connection(show=True, pipeline=None, tick=docking_control.TICK):
     """
     Automatically connects a motorized device to a wheelchair using ArUco marker detection.
 
     The function captures video frames from the camera, detects ArUco markers,
     and processes the detected information to maneuver the device into position.
+    The docking steps of docking_control.STEPS run on a fixed rate loop that never sleeps inside a step,
+    every tick takes the newest frame if there is one and steers on the pose predicted for that moment.
+    A tick that overruns the safety budget stops the motors.
+
+    Args:
+        show (bool): Show the frames and the map in the OpenCV windows of the UI thread, see ui_service.
+            When False nothing is drawn, for running headless on the robot.
+        pipeline (VisionPipeline): Take the poses from a running vision pipeline or camera rig instead of
+            capturing and detecting here. A pipeline that renders shows its own windows, the others are
+            shown here with their show().
+        tick (float): Control period in seconds.
     """
-    cap = cv.VideoCapture(0)  # Open the camera
-    step = 1
-    first_step = True
-    midle_dis = 45  # Threshold distance to the wheelchair
-    min_dis = 20  # Minimum distance for stopping
-    min_ang = 4  # Minimum angle in degrees
-    motor_speed1 = 90  # Speed for the first motor
-    motor_speed2 = 25  # Speed for the second motor
-    detection_lost_count = 0  # Counter for lost marker detection
-    max_detection_lost = 1000  # Maximum retries for marker detection, adjust it per controller
-
-    while True:
-        ret, frame = cap.read()  # Read frame from the camera
-        if not ret:
+    global last_loop_stats
+    if pipeline is None:
+        cap = camera_capture.get_camera(0)  # The shared camera, already open when called from main.py
+        result = cap.read_frame()  # Wait for the first frame before starting the loop
+        if result is None:
             print("Camera issue detected. Exiting auto_connection.")
-            return False  # Fail if the camera is not working
-
-        aruco_image, detection, distance, wheelX, wheelZ, wheelAngle = aruco_detecting(frame)
-
-        if not detection:
-            detection_lost_count += 1
-            print(f"Marker not detected. Retry {detection_lost_count}/{max_detection_lost}")
-
-            if detection_lost_count >= max_detection_lost:
-                print("Marker detection failed. Stopping the process.")
-                # Stop all motors or reset process
+            return False
+    else:
+        show = show and not pipeline.renders  # a rendering process shows the windows
+        result = None
+    machine = docking_control.DockingStateMachine()
+    timer = docking_control.LoopTimer(tick)
+    detection, distance, wheelX, wheelZ, wheelAngle = False, 500000, 0, 1000, 0
+    frame_time = None  # capture time of the frame of the newest pose
+    status = docking_control.RUNNING
+
+    while status == docking_control.RUNNING:
+        now = timer.wait()  # Start of the next tick
+        new_frame = False
+        if pipeline is None:
+            if result is None:
+                result = cap.read_frame(timeout=0)  # Newest frame, without waiting
+            if result is not None:
+                frame, timestamp, _ = result
+                latency.record("capture", time.monotonic() - timestamp)  # age of the frame when it is processed
+                frame_time = timestamp
+                aruco_image, detection, distance, wheelX, wheelZ, wheelAngle = aruco_detecting(frame, timestamp)
+                new_frame = True
+                result = None
+            elif not cap.isOpened():
+                print("Camera issue detected. Exiting auto_connection.")
                 GPIO_activation.low_output()
-                return False  # Return failure flag
+                return False  # Fail if the camera is not working
             else:
-                # Retry by continuing to look for the marker
-                cv.imshow("aruco", frame)
-                continue
+                detection = aruco_detection.pose_filter.tracking(now)  # No new frame, coast on the prediction
+
+            predicted = time.monotonic()
+            if detection:
+                # Latency compensation: the pose at the moment the command is issued, not when the frame was captured
+                wheelX, wheelZ, wheelAngle = aruco_detection.pose_filter.predict(predicted)
+            if session_recorder.recorder is not None:
+                session_recorder.recorder.tick(now, timer.stats["ticks"], predicted, detection, distance, wheelX,
+                                               wheelZ, wheelAngle)
         else:
-            detection_lost_count = 0  # Reset counter when marker is detected
-
-        # Process mapping and connection steps
-        map_image, goodPos, turnRad, x1 = mapping_processing.mapping_image(wheelX, wheelZ, wheelAngle)
-
-        if step == 1:
-            if first_step:
-                print(f'step {step}')
-                first_step = False
-            # Step 1: Approach the wheelchair
-            d = 50  # Half of the distance between the motors
-            i = float((turnRad - d) / (turnRad + d))  # Calculate rotation ratio
-
-            # Adjust motor speeds based on the turn ratio. 
-            # x1 bigger then 0 means the machine turns right, else left.  <----x1---->
-            if x1 > 0:
-                lm = motor_speed1
-                rm = lm * i
-            else:
-                rm = motor_speed1
-                lm = rm * i
-
-            GPIO_activation.GPIO_activation(lm, rm, 0, 0, 0, 0, 0)
-
-            if distance < midle_dis:
-                GPIO_activation.low_output()  # Stop motors
-                time.sleep(1)
-                step = 2  # Move to next step
-                first_step = True
-
-        elif step == 2:
-            # Step 2: Adjust angle towards the wheelchair
-            if first_step:
-                print(f'step {step}')
-                first_step = False
-            if wheelAngle > 0:
-                lm = motor_speed2
-                rm = lm
-                back_lm = 1
-                back_rm = 0
+            pose = pipeline.read_pose(timeout=0, predict=True)  # Newest pose from the detection process
+            if pose is not None:
+                detection, distance, wheelX, wheelZ, wheelAngle, frame_time = pose
+                new_frame = True
+            elif pipeline.failed():
+                print("Camera issue detected. Exiting auto_connection.")
+                GPIO_activation.low_output()
+                return False
+            if detection and now - frame_time > MAX_COAST:
+                detection = False  # No new pose for too long, do not steer on an old one
+
+        steering = detection and machine.needs_pose()
+        status = machine.tick(now, detection, distance, wheelX, wheelZ, wheelAngle)
+        if steering and frame_time is not None:
+            latency.record("photon_to_pwm", time.monotonic() - frame_time)  # from the capture to the motor command
+
+        if show and new_frame:
+            # the UI thread draws and shows the newest frame and map at its own rate
+            if pipeline is None:
+                ui_service.show_detection(aruco_image, detection, wheelX, wheelZ, wheelAngle)
             else:
-                lm = motor_speed2
-                rm = lm
-                back_lm = 0
-                back_rm = 1
-
-            GPIO_activation.GPIO_activation(lm, rm, 0, 0, 0, back_lm, back_rm)
-
-            if abs(wheelAngle) < min_ang:
-                GPIO_activation.low_output()  # Stop motors
-                time.sleep(1)
-                step = 3  # Move to next step
-                first_step = True
-
-        elif step == 3:
-            # Step 3: Move closer to the wheelchair
-            if first_step:
-                print(f'step {step}')
-                first_step = False
-            lm = motor_speed2
-            rm = lm
-            GPIO_activation.GPIO_activation(lm, rm, 0, 0, 0, 0, 0)
-
-            if distance < min_dis:
-                GPIO_activation.low_output()  # Stop motors
-                time.sleep(1)
-                step = 4  # Move to next step
-                first_step = True
-
-        elif step == 4:
-            # Step 4: Perform final connection
-            if first_step:
-                print(f'step {step}\n')
-
-            up_arm = 1  # Raise arm to connect
-            GPIO_activation.GPIO_activation(0, 0, 0, up_arm, 0, 0, 0)
-            time.sleep(3)
-
-            GPIO_activation.low_output()  # Stop all outputs
-            time.sleep(1)
+                pipeline.show()
 
-            cap.release()  # Release camera
-            cv.destroyAllWindows()  # Close OpenCV windows
-            return True
+        if timer.done():
+            machine.stop(time.monotonic())  # The tick overran the safety budget, stop until the next command
 
-        cv.waitKey(1)  # Wait for a key press
-        cv.imshow("aruco", aruco_image)  # Show detected ArUco image
-        cv.imshow("mapp", map_image)  # Show mapping image
+    last_loop_stats = timer.summary()
+    print("control loop: " + ", ".join(f"{name} {value:.2f}" if isinstance(value, float) else f"{name} {value}"
+                                       for name, value in last_loop_stats.items()))
+    if latency.enabled:
+        print(latency.report())
+    if status == docking_control.LOST:
+        print("Marker detection failed. Stopping the process.")
+        GPIO_activation.low_output()  # Stop all motors
+        return False  # Return failure flag
 
+    if show:
+        ui_service.destroy_windows()  # Close OpenCV windows
+    return True
 
-def user_control():
+
+def user_control(tick=docking_control.TICK):
     """
     Provides user control over the motorized device via keyboard input.
 
-    This function continuously reads user inputs and sends corresponding
+    This function reads the pressed keys once per control tick on a fixed rate loop and sends corresponding
     activation commands to the motors until a disconnect command is received.
+
+    Args:
+        tick (float): Control period in seconds.
     """
+    keyboard_control.last_state = None  # the panel window was closed by the last session, show it again
+    timer = docking_control.LoopTimer(tick)
     while True:
+        now = timer.wait()  # Start of the next tick
         # Read user commands from keyboard
-        lm, rm, latch, up_arm, down_arm, back_lm, back_rm, disconnect, emergency_stop = keyboard_control.keyboard_reader()
+        lm, rm, latch, up_arm, down_arm, back_lm, back_rm, disconnect, emergency_stop = \
+            keyboard_control.keyboard_reader(now)
         if emergency_stop:
             print("Emergency Stop Activated. Halting all operations.")
             GPIO_activation.low_output()  # Stop all GPIO outputs
-            cv.destroyAllWindows()  # Close all OpenCV windows
+            ui_service.destroy_windows()  # Close all OpenCV windows
             time.sleep(0.5)  # Small delay to ensure smooth termination
             break  # Exit the loop immediately
         GPIO_activation.GPIO_activation(lm, rm, latch, up_arm, down_arm, back_lm, back_rm)
@@ -160,32 +146,35 @@ def user_control():
         if disconnect:
             GPIO_activation.low_output()  # Stop motors
             time.sleep(1)
-            cv.destroyAllWindows()  # Close OpenCV windows
+            ui_service.destroy_windows()  # Close OpenCV windows
             break
 
+        if timer.done():
+            GPIO_activation.low_output()  # The tick overran the safety budget, stop until the next command
 
-def disconnection():
-    """
-    Handles the disconnection process for the motorized device.
 
-    This function lowers the arm, moves the device backward, and stops all outputs.
+def disconnection(pipeline=None, tick=docking_control.TICK):
     """
-    motor_speed2 = 25  # Speed for backward movement
-
-    down_arm = 1  # Lower the arm
-    GPIO_activation.GPIO_activation(0, 0, 0, 0, down_arm, 0, 0)
-    time.sleep(3)
-
-    GPIO_activation.low_output()  # Stop all outputs
-    time.sleep(1)
+    Handles the disconnection process for the motorized device.
 
-    # Move backward
-    lm = motor_speed2
-    rm = lm
-    back_lm = 1
-    back_rm = 1
-    GPIO_activation.GPIO_activation(lm, rm, 0, 0, 0, back_lm, back_rm)
-    time.sleep(5)
+    This function lowers the arm, moves the device backward, and stops all outputs. The steps of
+    docking_control.DISCONNECT_STEPS run on the fixed rate loop of auto_connection, so nothing sleeps and a
+    tick that overruns the safety budget stops the motors until the next one.
 
-    GPIO_activation.low_output()  # Stop all outputs
-    time.sleep(1)
+    Args:
+        pipeline (VisionPipeline): The running vision pipeline or camera rig, whose windows are kept up to date
+            when it does not render them itself.
+        tick (float): Control period in seconds.
+    """
+    machine = docking_control.DockingStateMachine(docking_control.DISCONNECT_STEPS, first="stop")
+    timer = docking_control.LoopTimer(tick)
+    status = docking_control.RUNNING
+    while status == docking_control.RUNNING:
+        now = timer.wait()  # Start of the next tick
+        # the steps only hold outputs for a time, they never steer on the pose
+        status = machine.tick(now, False, 500000, 0, 1000, 0)
+        if pipeline is not None and not pipeline.renders:
+            pipeline.show()
+
+        if timer.done():
+            machine.stop(time.monotonic())  # The tick overran the safety budget, stop until the next command
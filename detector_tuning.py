@@ -0,0 +1,240 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import cv2 as cv
+from cv2 import aruco
+import numpy as np
+
+import aruco_detection
+
+TRUTH_FILE = "truth.json"  # ground truth of a dataset directory, see make_dataset
+PROFILE_FILE = "detector_profile.json"
+TRIALS = 96  # parameter sets tried besides the defaults
+SEED = 0
+MARKER_IDS = (7, 8, 9, 10, 11)  # the IDs of the synthetic datasets, the markers of board.json
+DICTIONARY_SIZES = (50, 100, 250, 1000)  # the ArUco dictionaries of a family share their first markers
+RECALL_TOLERANCE = 0.01  # the selected parameters may lose this much recall against the defaults
+ERROR_TOLERANCE = 1.1  # and have a median position error this many times the defaults
+
+# Values tried for every DetectorParameters attribute, the first one is the OpenCV default
+SEARCH_SPACE = {
+    "adaptiveThreshWinSizeMax": (23, 13, 33),
+    "adaptiveThreshWinSizeStep": (10, 4, 20),
+    "polygonalApproxAccuracyRate": (0.03, 0.05, 0.08),
+    "minMarkerPerimeterRate": (0.03, 0.02, 0.05),
+    "cornerRefinementMethod": (aruco.CORNER_REFINE_NONE, aruco.CORNER_REFINE_SUBPIX, aruco.CORNER_REFINE_CONTOUR,
+                               aruco.CORNER_REFINE_APRILTAG),
+    "useAruco3Detection": (False, True),
+    "minMarkerLengthRatioOriginalImg": (0.0, 0.02, 0.05),  # the downscaling of the Aruco3 detection
+}
+
+_dataset = None  # (gray frames, truths, marker size) of a worker process
+
+
+def make_dataset(directory, count=120, dictionary=aruco_detection.DICTIONARY, ids=MARKER_IDS, seed=SEED):
+    """
+    Write synthetic frames of the calibrated camera with their ground truth, like benchmarks.synthetic_scenes: one
+    to three markers side by side at random distances and yaws, a third of them blurred and a third noisy.
+
+    A dataset is a directory of images with a TRUTH_FILE: {"dictionary", "marker_size", "frames": {file name:
+    [[marker_id, [x, y, z], yaw], ...]}}, the markers' centers in the camera frame in cm and yaws in degrees.
+    Recorded frames with measured poses can be written in the same format.
+
+    Args:
+        directory (str): The dataset directory, created if needed.
+        count (int): Number of frames.
+        dictionary (str): Name of the aruco dictionary of the markers, an AprilTag family or an ArUco one.
+        ids (tuple): Marker IDs to choose from.
+        seed (int): Seed of the poses and the noise.
+    """
+    import benchmarks  # only for rendering, the workers do not need it
+
+    os.makedirs(directory, exist_ok=True)
+    marker_dictionary = aruco.getPredefinedDictionary(getattr(aruco, dictionary))
+    rng = np.random.default_rng(seed)
+    frames = {}
+    for i in range(count):
+        markers = []
+        for marker_id in rng.choice(ids, size=min(1 + i % 3, len(ids)), replace=False):
+            z = rng.uniform(40, 180)
+            x = ((len(markers) + 1) // 2 * (-1) ** len(markers) * 0.3 + rng.uniform(-0.05, 0.05)) * z
+            markers.append((int(marker_id), [x, rng.uniform(-0.05, 0.05) * z, z], rng.uniform(-50, 50)))
+        blur = 1.2 if i % 3 == 1 else 0.0
+        noise = 6.0 if i % 3 == 2 else 0.0
+        name = f"frame_{i:04d}.png"
+        cv.imwrite(os.path.join(directory, name),
+                   benchmarks.render_scene(markers, blur, noise, seed=i, dictionary=marker_dictionary))
+        frames[name] = markers
+    with open(os.path.join(directory, TRUTH_FILE), "w") as file:
+        json.dump({"dictionary": dictionary, "marker_size": aruco_detection.MARKER_SIZE, "frames": frames}, file)
+
+
+def load_dataset(directory):
+    """
+    Returns:
+        tuple: (gray frames, truths, info) with the truth of every frame as {marker_id: (tvec, yaw)} and the
+            contents of the TRUTH_FILE without the frames.
+    """
+    with open(os.path.join(directory, TRUTH_FILE)) as file:
+        info = json.load(file)
+    grays, truths = [], []
+    for name, markers in sorted(info.pop("frames").items()):
+        grays.append(cv.imread(os.path.join(directory, name), cv.IMREAD_GRAYSCALE))
+        truths.append({marker_id: (np.asarray(tvec), yaw) for marker_id, tvec, yaw in markers})
+    return grays, truths, info
+
+
+def compatible_dictionaries(name, max_id):
+    """
+    Get the dictionaries that decode the markers of a dataset: the ArUco dictionaries of the same family big enough
+    for its IDs, or the dictionary itself for the AprilTag and the other ones.
+    """
+    family, _, size = name.rpartition("_")
+    if not size.isdigit() or not family.startswith("DICT_") or "X" not in family:
+        return [name]
+    return [f"{family}_{size}" for size in DICTIONARY_SIZES if size > max_id and hasattr(aruco, f"{family}_{size}")]
+
+
+def candidates(dictionary, dictionaries, trials=TRIALS, seed=SEED):
+    """
+    Sample parameter sets of SEARCH_SPACE and dictionaries, the OpenCV defaults with the dataset's dictionary first.
+
+    Returns:
+        list: {"dictionary", "parameters"} settings, without duplicates.
+    """
+    rng = np.random.default_rng(seed)
+    settings = [{"dictionary": dictionary, "parameters": {}}]
+    seen = {json.dumps(settings[0], sort_keys=True)}
+    for _ in range(trials * 10):
+        if len(settings) > trials:
+            break
+        parameters = {name: values[int(rng.integers(len(values)))] for name, values in SEARCH_SPACE.items()}
+        parameters = {name: value for name, value in parameters.items() if value != SEARCH_SPACE[name][0]}
+        candidate = {"dictionary": dictionaries[int(rng.integers(len(dictionaries)))], "parameters": parameters}
+        key = json.dumps(candidate, sort_keys=True)
+        if key not in seen:
+            seen.add(key)
+            settings.append(candidate)
+    return settings
+
+
+def _init_worker(directory):
+    global _dataset
+    cv.setNumThreads(1)  # one process per core, the latencies are the ones of a single thread
+    grays, truths, info = load_dataset(directory)
+    _dataset = (grays, truths, info["marker_size"])
+
+
+def evaluate(settings, repeat=2):
+    """
+    Run a detector with the settings on the worker's dataset.
+
+    Returns:
+        dict: The settings with the mean detection latency in ms, the recall, the false detections per frame and
+            the median position error in cm of the detected markers.
+    """
+    grays, truths, marker_size = _dataset
+    marker_dict = aruco.getPredefinedDictionary(getattr(aruco, settings["dictionary"]))
+    detector = aruco.ArucoDetector(marker_dict, aruco_detection.detector_parameters(settings["parameters"]))
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        detections = [detector.detectMarkers(gray)[:2] for gray in grays]
+        best = min(best, time.perf_counter() - start)
+
+    rendered = found = false = 0
+    errors = []
+    for truth, (corners, ids) in zip(truths, detections):
+        rendered += len(truth)
+        if not corners:
+            continue
+        _, tvecs = aruco_detection.estimate_poses(corners, marker_size)
+        for marker_id, tvec in zip(np.asarray(ids).ravel(), tvecs):
+            if int(marker_id) in truth:
+                found += 1
+                errors.append(float(np.linalg.norm(tvec - truth[int(marker_id)][0])))
+            else:
+                false += 1
+    return dict(settings, latency_ms=best / len(grays) * 1000, recall=found / rendered,
+                false_per_frame=false / len(grays),
+                position_error_cm=float(np.median(errors)) if errors else float("inf"))
+
+
+def pareto_front(results):
+    """
+    Keep the results no other result beats on latency, recall and position error at once, sorted by latency.
+    """
+    def dominates(a, b):
+        better_or_equal = (a["latency_ms"] <= b["latency_ms"] and a["recall"] >= b["recall"] and
+                           a["position_error_cm"] <= b["position_error_cm"])
+        return better_or_equal and (a["latency_ms"] < b["latency_ms"] or a["recall"] > b["recall"] or
+                                    a["position_error_cm"] < b["position_error_cm"])
+
+    front = [a for a in results if not any(dominates(b, a) for b in results)]
+    return sorted(front, key=lambda result: result["latency_ms"])
+
+
+def select(front, baseline):
+    """
+    Get the fastest settings of the front that keep the recall and the pose error of the defaults, within
+    RECALL_TOLERANCE and ERROR_TOLERANCE, and make no more false detections.
+    """
+    for result in front:  # sorted by latency
+        if (result["recall"] >= baseline["recall"] - RECALL_TOLERANCE and
+                result["position_error_cm"] <= baseline["position_error_cm"] * ERROR_TOLERANCE and
+                result["false_per_frame"] <= baseline["false_per_frame"]):
+            return result
+    return baseline
+
+
+def tune(directory, trials=TRIALS, workers=None, seed=SEED):
+    """
+    Search the detector settings on a dataset with a process pool.
+
+    Returns:
+        dict: The profile: the defaults' results, the Pareto front and the selected settings.
+    """
+    with open(os.path.join(directory, TRUTH_FILE)) as file:
+        info = json.load(file)
+    max_id = max(marker_id for markers in info["frames"].values() for marker_id, _, _ in markers)
+    settings = candidates(info["dictionary"], compatible_dictionaries(info["dictionary"], max_id), trials, seed)
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(directory,)) as pool:
+        results = list(pool.map(evaluate, settings))
+    baseline = results[0]
+    front = pareto_front(results)
+    return {"dataset": os.path.abspath(directory), "frames": len(info["frames"]), "trials": len(results),
+            "baseline": baseline, "pareto": front, "selected": select(front, baseline)}
+
+
+def _summary(result):
+    parameters = ", ".join(f"{name}={value}" for name, value in result["parameters"].items()) or "defaults"
+    return (f"{result['latency_ms']:7.3f} ms  recall {result['recall']:.3f}  error {result['position_error_cm']:.2f} cm"
+            f"  false {result['false_per_frame']:.2f}/frame  {result['dictionary']}  {parameters}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tune the ArUco detector parameters on a dataset with ground truth.")
+    parser.add_argument("dataset", help="directory of frames with a truth.json")
+    parser.add_argument("--make-synthetic", type=int, metavar="COUNT",
+                        help="first write COUNT synthetic frames to the dataset directory")
+    parser.add_argument("--dictionary", default=aruco_detection.DICTIONARY, help="dictionary of the synthetic markers")
+    parser.add_argument("--trials", type=int, default=TRIALS, help="parameter sets to try (default %(default)s)")
+    parser.add_argument("--workers", type=int, help="worker processes, one per core by default")
+    parser.add_argument("--output", default=PROFILE_FILE, help="profile to write (default %(default)s)")
+    args = parser.parse_args()
+
+    if args.make_synthetic:
+        make_dataset(args.dataset, args.make_synthetic, args.dictionary)
+    start = time.perf_counter()
+    profile = tune(args.dataset, args.trials, args.workers)
+    print(f"{profile['trials']} settings on {profile['frames']} frames in {time.perf_counter() - start:.1f} s")
+    print("defaults: " + _summary(profile["baseline"]))
+    print("Pareto front:")
+    for result in profile["pareto"]:
+        print("  " + _summary(result))
+    print("selected: " + _summary(profile["selected"]))
+    with open(args.output, "w") as file:
+        json.dump(profile, file, indent=2)
+    print(f"profile written to {args.output}, load it with 'python main.py --detector-profile'")
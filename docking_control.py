@@ -0,0 +1,259 @@
+import asyncio
+import time
+import GPIO_activation
+import docking_lut
+from docking_geometry import docking_decision, HALF_WHEEL_BASE
+
+TICK = 0.02  # control period in seconds
+SAFETY_BUDGET = 0.1  # a tick that ends later than this after its deadline stops the motors
+MAX_LOST_TIME = 30.0  # seconds the marker may be lost during a step before the docking fails
+
+MIDDLE_DISTANCE = 45  # Threshold distance to the wheelchair
+MIN_DISTANCE = 20  # Minimum distance for stopping
+MIN_ANGLE = 4  # Minimum angle in degrees
+MOTOR_SPEED1 = 90  # Speed for the first motor
+MOTOR_SPEED2 = 25  # Speed for the second motor
+
+RUNNING, DONE, LOST = "running", "done", "lost"
+STOP = None  # outputs of a step that stops everything with low_output()
+
+
+def approach(distance, wheelX, wheelZ, wheelAngle):
+    """
+    Step 1: drive along the turning arc towards the wheelchair.
+
+    The arc is looked up in docking_lut.table when it is loaded, and calculated otherwise.
+
+    Returns:
+        bool: True when the wheelchair is closer than MIDDLE_DISTANCE.
+    """
+    if docking_lut.table is not None:
+        _, _, x1, i = docking_lut.table.lookup(wheelX, wheelZ, wheelAngle)  # x1 is only the turn direction
+    else:
+        _, turnRad, x1 = docking_decision(wheelX, wheelZ, wheelAngle)
+        i = float((turnRad - HALF_WHEEL_BASE) / (turnRad + HALF_WHEEL_BASE))  # Calculate rotation ratio
+
+    # Adjust motor speeds based on the turn ratio.
+    # x1 bigger then 0 means the machine turns right, else left.  <----x1---->
+    if x1 > 0:
+        lm = MOTOR_SPEED1
+        rm = lm * i
+    else:
+        rm = MOTOR_SPEED1
+        lm = rm * i
+    GPIO_activation.GPIO_activation(lm, rm, 0, 0, 0, 0, 0)
+    return distance < MIDDLE_DISTANCE
+
+
+def align(distance, wheelX, wheelZ, wheelAngle):
+    """
+    Step 2: turn in place towards the wheelchair.
+
+    Returns:
+        bool: True when the angle error is below MIN_ANGLE.
+    """
+    if wheelAngle > 0:
+        GPIO_activation.GPIO_activation(MOTOR_SPEED2, MOTOR_SPEED2, 0, 0, 0, 1, 0)
+    else:
+        GPIO_activation.GPIO_activation(MOTOR_SPEED2, MOTOR_SPEED2, 0, 0, 0, 0, 1)
+    return abs(wheelAngle) < MIN_ANGLE
+
+
+def close_in(distance, wheelX, wheelZ, wheelAngle):
+    """
+    Step 3: move straight closer to the wheelchair.
+
+    Returns:
+        bool: True when the wheelchair is closer than MIN_DISTANCE.
+    """
+    GPIO_activation.GPIO_activation(MOTOR_SPEED2, MOTOR_SPEED2, 0, 0, 0, 0, 0)
+    return distance < MIN_DISTANCE
+
+
+# The docking steps. A step with "run" calls it every tick with the pose until it returns True, a step with
+# "hold" writes its "enter" outputs every tick for that many seconds of output, without blocking the loop.
+# "label" is the step number printed when the step starts.
+STEPS = {
+    "approach": {"run": approach, "next": "approach_stop", "label": 1},
+    "approach_stop": {"enter": STOP, "hold": 1.0, "next": "align"},
+    "align": {"run": align, "next": "align_stop", "label": 2},
+    "align_stop": {"enter": STOP, "hold": 1.0, "next": "close_in"},
+    "close_in": {"run": close_in, "next": "close_in_stop", "label": 3},
+    "close_in_stop": {"enter": STOP, "hold": 1.0, "next": "raise_arm"},
+    "raise_arm": {"enter": (0, 0, 0, 1, 0, 0, 0), "hold": 3.0, "next": "release", "label": 4},  # up_arm
+    "release": {"enter": STOP, "hold": 1.0, "next": None},
+}
+
+# The disconnection: lower the arm, then move backward away from the wheelchair
+DISCONNECT_STEPS = {
+    "stop": {"enter": STOP, "hold": 1.0, "next": "lower_arm"},
+    "lower_arm": {"enter": (0, 0, 0, 0, 1, 0, 0), "hold": 3.0, "next": "arm_stop"},  # down_arm
+    "arm_stop": {"enter": STOP, "hold": 1.0, "next": "back_up"},
+    "back_up": {"enter": (MOTOR_SPEED2, MOTOR_SPEED2, 0, 0, 0, 1, 1), "hold": 5.0, "next": "back_up_stop"},
+    "back_up_stop": {"enter": STOP, "hold": 1.0, "next": None},
+}
+
+
+class LoopTimer:
+    """
+    Fixed rate scheduler of the control loop, measuring how late the ticks start and end.
+
+    wait() sleeps until the deadline of the next tick, done() ends the tick. A tick that ends after the next
+    deadline misses it, the missed deadlines are skipped instead of being run late.
+    """
+
+    def __init__(self, tick=TICK, budget=SAFETY_BUDGET):
+        self.tick = tick
+        self.budget = budget
+        self.deadline = None
+        self.started = 0.0
+        self.stats = {"ticks": 0, "missed": 0, "overruns": 0, "jitter_sum": 0.0, "max_jitter": 0.0,
+                      "max_work": 0.0}
+
+    def wait(self):
+        """
+        Wait for the deadline of the next tick.
+
+        Returns:
+            float: time.monotonic() at the start of the tick.
+        """
+        now = time.monotonic()
+        if self.deadline is not None and now < self.deadline:
+            time.sleep(self.deadline - now)
+        return self._start()
+
+    async def wait_async(self):
+        """
+        Like wait(), for a loop running in an asyncio task.
+        """
+        now = time.monotonic()
+        if self.deadline is not None and now < self.deadline:
+            await asyncio.sleep(self.deadline - now)
+        return self._start()
+
+    def _start(self):
+        now = time.monotonic()
+        if self.deadline is None:
+            self.deadline = now
+        jitter = now - self.deadline  # how late the tick started
+        self.stats["ticks"] += 1
+        self.stats["jitter_sum"] += jitter
+        self.stats["max_jitter"] = max(self.stats["max_jitter"], jitter)
+        self.started = now
+        return now
+
+    def done(self):
+        """
+        End the tick and schedule the next one.
+
+        Returns:
+            bool: True if the tick ended more than the safety budget after its deadline.
+        """
+        end = time.monotonic()
+        self.stats["max_work"] = max(self.stats["max_work"], end - self.started)
+        late = end - self.deadline
+        periods = int(late // self.tick) + 1  # the next deadline that is still ahead
+        self.stats["missed"] += periods - 1
+        self.deadline += periods * self.tick
+        if late > self.budget:
+            self.stats["overruns"] += 1
+            return True
+        return False
+
+    def summary(self):
+        """
+        Returns:
+            dict: The tick counters, with the mean and maximal start jitter and the maximal work in milliseconds.
+        """
+        ticks = max(self.stats["ticks"], 1)
+        return {"ticks": self.stats["ticks"], "missed": self.stats["missed"], "overruns": self.stats["overruns"],
+                "mean_jitter_ms": self.stats["jitter_sum"] / ticks * 1000,
+                "max_jitter_ms": self.stats["max_jitter"] * 1000, "max_work_ms": self.stats["max_work"] * 1000}
+
+
+class DockingStateMachine:
+    """
+    Runs the docking steps of STEPS, one tick at a time, without ever sleeping.
+
+    While a step that needs the pose has no detection the motors are stopped, the docking fails when the
+    marker stays lost for max_lost_time seconds. The loop stops the motors with stop() after an overrun,
+    a hold that is stopped writes its outputs again on the next tick and lasts that much longer, so the
+    arm and the motors always run for the whole hold.
+    """
+
+    def __init__(self, steps=STEPS, first="approach", max_lost_time=MAX_LOST_TIME):
+        self.steps = steps
+        self.max_lost_time = max_lost_time
+        self.step = None
+        self.entered = 0.0  # time the current step started
+        self.lost_since = None
+        self.stopped_at = None  # time the outputs were stopped by stop() during the current step
+        self._first = first
+
+    def _enter(self, name, now):
+        self.step = name
+        self.entered = now
+        self.stopped_at = None
+        spec = self.steps[name]
+        if "label" in spec:
+            print(f'step {spec["label"]}')
+        if "enter" in spec:
+            self._write(spec)
+
+    def _write(self, spec):
+        if spec["enter"] is STOP:
+            GPIO_activation.low_output()  # Stop motors
+        else:
+            GPIO_activation.GPIO_activation(*spec["enter"])
+
+    def stop(self, now):
+        """
+        Stop the motors out of the steps, like after a tick that overran the safety budget. A hold is
+        resumed on the next tick and extended by the time it was stopped.
+
+        Args:
+            now (float): time.monotonic() of the stop.
+        """
+        GPIO_activation.low_output()
+        if self.stopped_at is None:
+            self.stopped_at = now
+
+    def needs_pose(self):
+        """
+        Returns:
+            bool: True if the current step steers on the pose.
+        """
+        return self.step is None or "run" in self.steps[self.step]
+
+    def tick(self, now, detection, distance, wheelX, wheelZ, wheelAngle):
+        """
+        Run one tick of the current step and move to the next step when it is done.
+
+        Returns:
+            str: RUNNING, DONE after the last step, or LOST when the marker was lost for too long.
+        """
+        if self.step is None:
+            self._enter(self._first, now)
+        spec = self.steps[self.step]
+        if "hold" in spec:
+            if self.stopped_at is not None:
+                self.entered += max(now - self.stopped_at, 0.0)  # the stopped time does not count
+                self.stopped_at = None
+            if spec["enter"] is not STOP:
+                self._write(spec)  # only the outputs that were stopped are written again
+            done = now - self.entered >= spec["hold"]
+        elif not detection:
+            if self.lost_since is None:
+                self.lost_since = now
+                print("Marker not detected, waiting for it with the motors stopped")
+            GPIO_activation.low_output()
+            return LOST if now - self.lost_since > self.max_lost_time else RUNNING
+        else:
+            self.lost_since = None
+            done = spec["run"](distance, wheelX, wheelZ, wheelAngle)
+
+        if done:
+            if spec["next"] is None:
+                return DONE
+            self._enter(spec["next"], now)
+        return RUNNING
@@ -0,0 +1,90 @@
+import numpy as np
+
+# Geometry of the map drawn by mapping_processing, in pixels of its full size 'pathImg'. mapping_processing
+# imports these, so the drawn map and the docking decision always use the same ones.
+x0, y0 = 900, 1200  # the robot is at the bottom center of the map
+cameraPos = (x0, y0 - 110)  # camera position offset
+PIXELS_PER_CM = 4.5  # map scale
+MIDDLE_DIST = 100  # distance from the wheelchair to the middle point of the turning arc
+GOOD_ANGLE = 45  # the wheelchair angle error allowed for a permission to connect
+HALF_WHEEL_BASE = 50  # Half of the distance between the motors
+
+
+def docking_geometry(wheelX, wheelY, wheelAngle, good_angle=GOOD_ANGLE):
+    """
+        Calculate the turning arc towards the wheelchair for one pose or for arrays of poses.
+
+        It is the calculation mapping_image draws, without any drawing, done for all the poses at once.
+
+        Args:
+            wheelX (float or np.ndarray): X position of the wheel.
+            wheelY (float or np.ndarray): Y (z) position of the wheel.
+            wheelAngle (float or np.ndarray): Orientation angle of the wheel.
+            good_angle (float): The angle error allowed for a good position, in degrees.
+
+        Returns:
+            dict: Arrays with the shape of the broadcast inputs:
+                - wheelPos (np.ndarray): (..., 2) wheelchair position on the map.
+                - middlePoint (np.ndarray): (..., 2) middle point of the turning arc on the map.
+                - x1 (np.ndarray): X displacement of the middle point from the camera position, never 0.
+                - Bangle (np.ndarray): Angle of the middle point from the camera, in radians.
+                - turnRad (np.ndarray): Turning radius.
+                - goodPos (np.ndarray): Indicates if the position is valid for connecting.
+                - arcCenter (np.ndarray): (..., 2) center of the turning arc on the map.
+                - arcStart, arcEnd (np.ndarray): Angles of the turning arc as drawn by cv.ellipse, in degrees.
+    """
+    wheelX, wheelY, wheelAngle = np.broadcast_arrays(np.asarray(wheelX, dtype=np.float64),
+                                                     np.asarray(wheelY, dtype=np.float64),
+                                                     np.asarray(wheelAngle, dtype=np.float64))
+    # int() truncates towards zero, like the scalar calculation
+    wheelPosX = np.trunc(x0 + wheelX * PIXELS_PER_CM).astype(np.int64)
+    wheelPosY = np.trunc(cameraPos[1] - wheelY * PIXELS_PER_CM).astype(np.int64)
+
+    theta = np.radians(wheelAngle)
+    middleX = wheelPosX + np.trunc(MIDDLE_DIST * np.sin(theta)).astype(np.int64)
+    middleY = wheelPosY + np.trunc(MIDDLE_DIST * np.cos(theta)).astype(np.int64)
+
+    x1 = middleX - cameraPos[0]
+    y1 = middleY - cameraPos[1]
+    x1 = np.where(x1 == 0, 1, x1)  # prevent division by zero
+
+    Bangle = np.arctan(y1 / x1)
+    d1 = np.sqrt(x1 ** 2 + y1 ** 2)
+    turnRad = np.trunc(d1 / (2 * np.cos(Bangle))).astype(np.int64)
+
+    # the arc ends at the camera heading, the wheelchair should face the same way at the end of the arc
+    BangleDeg = Bangle * 180 / np.pi
+    right = Bangle > 0
+    goodPos = np.where(right, np.abs(180 - 2 * BangleDeg - wheelAngle) < good_angle,
+                       np.abs(180 + 2 * BangleDeg + wheelAngle) < good_angle)
+    arcCenterX = np.where(right, cameraPos[0] - turnRad, cameraPos[0] + turnRad)
+    arcStart = np.where(right, 0.0, 180.0)
+    arcEnd = np.where(right, -(180 - 2 * np.abs(BangleDeg)), 360 - 2 * np.abs(BangleDeg))
+
+    return {
+        "wheelPos": np.stack((wheelPosX, wheelPosY), axis=-1),
+        "middlePoint": np.stack((middleX, middleY), axis=-1),
+        "x1": x1,
+        "Bangle": Bangle,
+        "turnRad": turnRad,
+        "goodPos": goodPos,
+        "arcCenter": np.stack((arcCenterX, np.full_like(arcCenterX, cameraPos[1])), axis=-1),
+        "arcStart": arcStart,
+        "arcEnd": arcEnd,
+    }
+
+
+def docking_decision(wheelX, wheelY, wheelAngle):
+    """
+        Get the docking decision for a single pose without drawing the map.
+
+        Args:
+            wheelX (float): X position of the wheel.
+            wheelY (float): Y (z) position of the wheel.
+            wheelAngle (float): Orientation angle of the wheel.
+
+        Returns:
+            tuple: (goodPos, turnRad, x1), the same values mapping_image returns with its image.
+    """
+    geometry = docking_geometry(wheelX, wheelY, wheelAngle)
+    return bool(geometry["goodPos"]), int(geometry["turnRad"]), int(geometry["x1"])
@@ -0,0 +1,222 @@
+import argparse
+import hashlib
+import os
+import time
+import cv2 as cv
+import numpy as np
+
+import docking_geometry
+from docking_geometry import HALF_WHEEL_BASE
+
+# The quantized poses of the table, (first, last, step): wheelchair x and z in cm and angle in degrees
+X_RANGE = (-100.0, 100.0, 2.0)
+Z_RANGE = (10.0, 250.0, 2.0)
+ANGLE_RANGE = (-90.0, 90.0, 2.0)
+CHANNELS = ("goodPos", "turnRad", "direction", "ratio")  # the values of a cell, in this order
+CACHE_DIR = os.path.dirname(os.path.abspath(__file__))  # the table is saved next to the code
+HEAT_MAP_SCALE = 3  # pixels per cell of the heat map
+
+table = None  # the DockingLUT of the control loop, loaded by init()
+
+
+def axis(first, last, step):
+    return np.linspace(first, last, int(round((last - first) / step)) + 1)
+
+
+def motor_ratio(turnRad):
+    """
+        The speed of the inner motor relative to the outer one on a turning arc, step 1 of auto_connection.
+    """
+    return (turnRad - HALF_WHEEL_BASE) / (turnRad + HALF_WHEEL_BASE)
+
+
+def table_key():
+    """
+        Get a short hash of the grid and of the geometry constants, a saved table is only used with them.
+    """
+    constants = (X_RANGE, Z_RANGE, ANGLE_RANGE, docking_geometry.x0, docking_geometry.y0, docking_geometry.cameraPos,
+                 docking_geometry.PIXELS_PER_CM, docking_geometry.MIDDLE_DIST, docking_geometry.GOOD_ANGLE,
+                 HALF_WHEEL_BASE)
+    return hashlib.sha1(repr(constants).encode()).hexdigest()[:16]
+
+
+def build():
+    """
+        Calculate the docking geometry of every pose of the grid.
+
+        Returns:
+            np.ndarray: float32 table of shape (x, z, angle, len(CHANNELS)).
+    """
+    xs, zs, angles = axis(*X_RANGE), axis(*Z_RANGE), axis(*ANGLE_RANGE)
+    geometry = docking_geometry.docking_geometry(xs[:, None, None], zs[None, :, None], angles[None, None, :])
+    values = np.empty(geometry["turnRad"].shape + (len(CHANNELS),), dtype=np.float32)
+    values[..., 0] = geometry["goodPos"]
+    values[..., 1] = geometry["turnRad"]
+    values[..., 2] = np.sign(geometry["x1"])  # 1 when the robot turns right, x1 is never 0
+    values[..., 3] = motor_ratio(geometry["turnRad"])
+    return values
+
+
+class DockingLUT:
+    """
+        The docking decision and the steering of step 1 precomputed over a grid of wheelchair poses.
+
+        The table is built once and saved as a .npy file in cache_dir, named by table_key(), and memory mapped
+        when it exists. The turning radius and the motor ratio are interpolated between the 8 cells around a
+        pose, goodPos and the turn direction are the ones of the nearest cell. Poses outside the grid are
+        calculated with docking_geometry.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR):
+        self.path = os.path.join(cache_dir, f"docking_lut_{table_key()}.npy") if cache_dir is not None else None
+        self.origin = (X_RANGE[0], Z_RANGE[0], ANGLE_RANGE[0])
+        self.steps = (X_RANGE[2], Z_RANGE[2], ANGLE_RANGE[2])
+        self.values = self._load()
+        if self.values is None:
+            self.values = build()
+            self._save()
+        self.shape = self.values.shape[:3]
+
+    def _load(self):
+        if self.path is None:
+            return None
+        try:
+            return np.asarray(np.load(self.path, mmap_mode="r"))  # still mapped, indexing a memmap is slower
+        except (OSError, ValueError):  # missing or partly written
+            return None
+
+    def _save(self):
+        if self.path is None:
+            return
+        try:
+            temporary = self.path + ".tmp"
+            with open(temporary, "wb") as file:
+                np.save(file, self.values)
+            os.replace(temporary, self.path)  # readers never see a partly written table
+        except OSError as error:
+            print(f"Could not save the docking table: {error}")
+
+    def lookup(self, wheelX, wheelZ, wheelAngle):
+        """
+            Get the docking decision and the steering of a pose.
+
+            Args:
+                wheelX (float): X position of the wheel.
+                wheelZ (float): Z position of the wheel.
+                wheelAngle (float): Orientation angle of the wheel.
+
+            Returns:
+                tuple: (goodPos, turnRad, direction, ratio), direction is 1 when the robot turns right and -1 when
+                    it turns left, ratio is the speed of the inner motor relative to the outer one.
+        """
+        cell, fraction = [], []
+        for value, origin, step, size in zip((wheelX, wheelZ, wheelAngle), self.origin, self.steps, self.shape):
+            position = (value - origin) / step
+            if not 0 <= position <= size - 1:
+                geometry = docking_geometry.docking_geometry(wheelX, wheelZ, wheelAngle)
+                turnRad = int(geometry["turnRad"])
+                return bool(geometry["goodPos"]), turnRad, 1 if geometry["x1"] > 0 else -1, motor_ratio(turnRad)
+            index = min(int(position), size - 2)
+            cell.append(index)
+            fraction.append(position - index)
+        (i, j, k), (tx, tz, ta) = cell, fraction
+        # the 8 cells around the pose as nested lists, arithmetic on a few floats is faster than on small arrays
+        block = self.values[i:i + 2, j:j + 2, k:k + 2].tolist()
+        nearest = block[tx >= 0.5][tz >= 0.5][ta >= 0.5]
+        turnRad = ratio = 0.0
+        for a, wx in ((0, 1 - tx), (1, tx)):
+            for b, wz in ((0, 1 - tz), (1, tz)):
+                for c, wa in ((0, 1 - ta), (1, ta)):
+                    weight = wx * wz * wa
+                    turnRad += block[a][b][c][1] * weight
+                    ratio += block[a][b][c][3] * weight
+        return bool(nearest[0]), turnRad, int(nearest[2]), ratio
+
+    def feasibility(self, wheelAngle=None):
+        """
+            Get the permission to connect over the positions of the grid.
+
+            Args:
+                wheelAngle (float): Angle of the wheelchair, all the angles of the grid by default.
+
+            Returns:
+                np.ndarray: (x, z) goodPos at the nearest angle of the grid, or the fraction of the angles
+                    with goodPos.
+        """
+        if wheelAngle is None:
+            return np.asarray(self.values[..., 0]).mean(axis=2)
+        k = int(round((wheelAngle - self.origin[2]) / self.steps[2]))
+        return np.asarray(self.values[:, :, min(max(k, 0), self.shape[2] - 1), 0])
+
+    def heat_map(self, wheelAngle=None, scale=HEAT_MAP_SCALE):
+        """
+            Draw where the wheelchair gets an immediate permission to connect, seen from above with the camera
+            at the bottom center, far positions at the top and a line every 50 cm.
+
+            Args:
+                wheelAngle (float): Angle of the wheelchair, the fraction of all the angles by default.
+                scale (int): Pixels per cell.
+
+            Returns:
+                np.ndarray: BGR image, red where most headings are allowed and blue where none are.
+        """
+        feasible = self.feasibility(wheelAngle)
+        image = cv.applyColorMap(np.round(feasible.T[::-1] * 255).astype(np.uint8), cv.COLORMAP_JET)
+        image = cv.resize(image, None, fx=scale, fy=scale, interpolation=cv.INTER_NEAREST)
+        height, width = image.shape[:2]
+
+        def pixel(x, z):
+            return (int(round(((x - self.origin[0]) / self.steps[0] + 0.5) * scale)),
+                    int(round(height - ((z - self.origin[1]) / self.steps[1] + 0.5) * scale)))
+
+        for x in range(int(np.ceil(X_RANGE[0] / 50)) * 50, int(X_RANGE[1]) + 1, 50):
+            cv.line(image, (pixel(x, 0)[0], 0), (pixel(x, 0)[0], height), (255, 255, 255), 1)
+        for z in range(int(np.ceil(Z_RANGE[0] / 50)) * 50, int(Z_RANGE[1]) + 1, 50):
+            cv.line(image, (0, pixel(0, z)[1]), (width, pixel(0, z)[1]), (255, 255, 255), 1)
+            cv.putText(image, f"{z} cm", (4, pixel(0, z)[1] - 4), cv.FONT_HERSHEY_SIMPLEX, 0.4, (255, 255, 255), 1)
+        cv.circle(image, (pixel(0, 0)[0], height - 1), 6, (255, 255, 255), -1)  # the camera
+        title = "all angles" if wheelAngle is None else f"angle {wheelAngle:g} deg"
+        cv.putText(image, f"permission to connect, {title}", (4, 16), cv.FONT_HERSHEY_SIMPLEX, 0.5,
+                   (255, 255, 255), 1)
+        return image
+
+
+def init(cache_dir=CACHE_DIR):
+    """
+        Load the table of the control loop, building and saving it the first time.
+
+        Returns:
+            DockingLUT: The loaded table.
+    """
+    global table
+    if table is None:
+        table = DockingLUT(cache_dir)
+    return table
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the docking lookup table and draw its feasibility heat map.")
+    parser.add_argument("--heat-map", metavar="PATH", default="docking_heat_map.png", help="heat map image to write")
+    parser.add_argument("--angle", type=float, help="wheelchair angle of the heat map, all the angles by default")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    lut = init()
+    print(f"{lut.path}: {lut.shape[0]} x {lut.shape[1]} x {lut.shape[2]} poses, "
+          f"{lut.values.nbytes / 2 ** 20:.1f} MiB, loaded in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    # agreement with the exact calculation on random poses of the grid
+    np.random.seed(0)
+    samples = [(np.random.uniform(X_RANGE[0], X_RANGE[1]), np.random.uniform(Z_RANGE[0], Z_RANGE[1]),
+                np.random.uniform(ANGLE_RANGE[0], ANGLE_RANGE[1])) for _ in range(2000)]
+    same, ratio_error = 0, []
+    for pose in samples:
+        goodPos, turnRad, direction, ratio = lut.lookup(*pose)
+        exactGood, exactRad, x1 = docking_geometry.docking_decision(*pose)
+        same += goodPos == exactGood
+        ratio_error.append(abs(ratio - motor_ratio(exactRad)))
+    print(f"goodPos agrees on {same / len(samples):.3f} of the poses, motor ratio error median "
+          f"{np.median(ratio_error):.4f}, p99 {np.percentile(ratio_error, 99):.4f}")
+
+    cv.imwrite(args.heat_map, lut.heat_map(args.angle))
+    print(f"heat map written to {args.heat_map}")
@@ -1,7 +1,8 @@
 import cv2
+import camera_capture
 
-# Initialize video capture from the default camera (0)
-cap = cv2.VideoCapture(0)
+# Start the shared capture of the default camera (0)
+cap = camera_capture.get_camera(0)
 
 num = 0  # Counter for saved images
 
@@ -29,5 +30,5 @@ while cap.isOpened():
     cv2.imshow('Img', img)
 
 # Release the camera and destroy all windows before termination
-cap.release()
+cap.stop()
 cv2.destroyAllWindows()
@@ -1,22 +1,32 @@
-import keyboard
 import numpy as np
 import cv2
+import threading
 import time
+import ui_service
+
+keyboard = None  # the keyboard module, imported by init() when the keyboard is first read
+source = None  # where the keys are read from, a KeyboardInput on the first keyboard_reader() call
+previous = frozenset()  # the keys pressed at the last keyboard_reader() call
 
 # Initialize a blank image for the motor display
 motorsImg = np.zeros((500, 600, 3), dtype=np.uint8)
+panelImg = None  # the static part of motorsImg, drawn on the first call of motors()
+last_state = None  # the arguments of the last motors() call, it is not drawn again while they are the same
+INDICATOR_ROWS = (80, 180, 280, 380)  # centers of the indicator circles, at x = 120 and x = 260
 
 # Motor speed variables
 lm, rm = 0, 0
-time0 = time.time()
-time1 = time.time()
-time2 = time.time()
-time3 = time.time()
+time0 = time.monotonic()
+time1 = time.monotonic()
+time2 = time.monotonic()
+time3 = time.monotonic()
 
 # Control variables
 extra1 = 0
 extra2 = 0
 latch = False
+latch_time = -float("inf")  # time of the last latch toggle
+LATCH_DEBOUNCE = 0.4  # seconds between two latch toggles
 fsa = 60  # forward straight acceleration
 bsa = 30  # backward straight acceleration
 ta = 60  # turning acceleration
@@ -29,10 +39,64 @@ up_forward_turn_limit = 55
 turnMotorLimit = 25
 
 
+def _panel_template():
+    """
+       Draw the parts of the control window that never change: labels, lines, outlines and borders.
+
+       Returns:
+           ndarray: The static panel, the size of motorsImg.
+    """
+    panel = np.zeros_like(motorsImg)
+    font = cv2.FONT_HERSHEY_SIMPLEX
+
+    cv2.rectangle(panel, (400, 480), (590, 5), (200, 200, 200), 4)
+
+    # Outlines of the indicators, the filled dots are drawn over them
+    for y in INDICATOR_ROWS:
+        cv2.circle(panel, (120, y), 15, (200, 200, 200), 3)
+        cv2.circle(panel, (260, y), 15, (200, 200, 200), 3)
+
+    # Add text labels and lines for visual guidance
+    cv2.putText(panel, "forward", (60, 130), font, 1, (200, 0, 255), 2)
+    cv2.putText(panel, "backward", (200, 130), font, 1, (200, 0, 255), 2)
+    cv2.line(panel, (0, 145), (400, 145), (200, 200, 200), 4)
+
+    # Display arm control labels
+    cv2.putText(panel, "L turn", (70, 230), font, 1, (200, 0, 255), 2)
+    cv2.putText(panel, "R turn", (215, 230), font, 1, (200, 0, 255), 2)
+    cv2.line(panel, (0, 245), (400, 245), (200, 200, 200), 4)
+
+    # Display latch control labels
+    cv2.putText(panel, "up_arm", (50, 330), font, 1, (200, 0, 255), 2)
+    cv2.putText(panel, "down_arm", (200, 330), font, 1, (200, 0, 255), 2)
+    cv2.line(panel, (0, 345), (400, 345), (200, 200, 200), 4)
+
+    # Display latch status labels
+    cv2.putText(panel, "latch_on", (45, 430), font, 1, (200, 0, 255), 2)
+    cv2.putText(panel, "latch_off", (200, 430), font, 1, (200, 0, 255), 2)
+    cv2.line(panel, (0, 480), (400, 480), (200, 200, 200), 4)
+
+    # Draw borders
+    cv2.line(panel, (185, 5), (185, 480), (200, 200, 200), 1)
+    cv2.line(panel, (0, 5), (0, 480), (200, 200, 200), 4)
+    cv2.line(panel, (0, 5), (400, 5), (200, 200, 200), 4)
+    return panel
+
+
+def _restore(y0, y1, x0, x1):
+    """
+       Copy a region of the static panel back to motorsImg, erasing what was drawn over it.
+    """
+    motorsImg[y0:y1, x0:x1] = panelImg[y0:y1, x0:x1]
+
+
 def motors(Lm, Rm, Latch, up_arm, down_arm, l_turn, r_turn, back_lm, back_rm):
     """
        Visualize motor states and controls on a blank image.
 
+       The static panel is drawn once, every call only restores and redraws the bars and the indicator dots,
+       and nothing is drawn or shown when the state did not change since the last call.
+
        Args:
            Lm (int): Speed of the left motor (0-100).
            Rm (int): Speed of the right motor (0-100).
@@ -44,12 +108,17 @@ def motors(Lm, Rm, Latch, up_arm, down_arm, l_turn, r_turn, back_lm, back_rm):
            back_lm (int): Backward motion status for left motor (0/1).
            back_rm (int): Backward motion status for right motor (0/1).
     """
-
-    motorsImg.fill(0)  # Clear the image
-
-    font = cv2.FONT_HERSHEY_SIMPLEX
-
-    # draw motor speed rectangles
+    global panelImg, last_state
+    state = (Lm, Rm, Latch, up_arm, down_arm, l_turn, r_turn, back_lm, back_rm)
+    if state == last_state:
+        return
+    if panelImg is None:
+        panelImg = _panel_template()
+        motorsImg[:] = panelImg
+    last_state = state
+
+    # draw motor speed rectangles over the cleared bars, then their outline again
+    _restore(0, motorsImg.shape[0], 400, motorsImg.shape[1])
     cv2.rectangle(motorsImg, (410, 480), (460, (480 - int((Lm / 100) * 450))), (0, 180, 120), -1)
     cv2.rectangle(motorsImg, (470, 480), (520, (480 - int((Rm / 100) * 450))), (0, 180, 120), -1)
 
@@ -60,72 +129,124 @@ def motors(Lm, Rm, Latch, up_arm, down_arm, l_turn, r_turn, back_lm, back_rm):
 
     cv2.rectangle(motorsImg, (400, 480), (590, 5), (200, 200, 200), 4)
 
-    # Draw control indicators
-    cv2.circle(motorsImg, (120, 80), 15, (200, 200, 200), 3)
-    cv2.circle(motorsImg, (260, 80), 15, (200, 200, 200), 3)
+    # clear the dots inside the outlines
+    for y in INDICATOR_ROWS:
+        _restore(y - 13, y + 14, 107, 134)
+        _restore(y - 13, y + 14, 247, 274)
 
+    # Draw control indicators
     if back_lm and back_rm:
         cv2.circle(motorsImg, (260, 80), 13, (0, 0, 255), -1)
     elif Lm != 0 or Rm != 0:
         cv2.circle(motorsImg, (120, 80), 13, (0, 0, 255), -1)
 
-    # Add text labels and lines for visual guidance
-    cv2.putText(motorsImg, "forward", (60, 130), font, 1, (200, 0, 255), 2)
-    cv2.putText(motorsImg, "backward", (200, 130), font, 1, (200, 0, 255), 2)
-    cv2.line(motorsImg, (0, 145), (400, 145), (200, 200, 200), 4)
-
     # Draw turning arm direction indicators
-    cv2.circle(motorsImg, (120, 180), 15, (200, 200, 200), 3)
-    cv2.circle(motorsImg, (260, 180), 15, (200, 200, 200), 3)
     if l_turn:
         cv2.circle(motorsImg, (120, 180), 13, (0, 0, 255), -1)
     elif r_turn:
         cv2.circle(motorsImg, (260, 180), 13, (0, 0, 255), -1)
 
-    # Display arm control labels
-    cv2.putText(motorsImg, "L turn", (70, 230), font, 1, (200, 0, 255), 2)
-    cv2.putText(motorsImg, "R turn", (215, 230), font, 1, (200, 0, 255), 2)
-    cv2.line(motorsImg, (0, 245), (400, 245), (200, 200, 200), 4)
-
     # Draw arm control indicators
-    cv2.circle(motorsImg, (120, 280), 15, (200, 200, 200), 3)
-    cv2.circle(motorsImg, (260, 280), 15, (200, 200, 200), 3)
     if up_arm:
         cv2.circle(motorsImg, (120, 280), 13, (0, 0, 255), -1)
     elif down_arm:
         cv2.circle(motorsImg, (260, 280), 13, (0, 0, 255), -1)
 
-    # Display latch control labels
-    cv2.putText(motorsImg, "up_arm", (50, 330), font, 1, (200, 0, 255), 2)
-    cv2.putText(motorsImg, "down_arm", (200, 330), font, 1, (200, 0, 255), 2)
-    cv2.line(motorsImg, (0, 345), (400, 345), (200, 200, 200), 4)
-
     # Draw latch indicators
-    cv2.circle(motorsImg, (120, 380), 15, (200, 200, 200), 3)
-    cv2.circle(motorsImg, (260, 380), 15, (200, 200, 200), 3)
     if Latch:
         cv2.circle(motorsImg, (120, 380), 13, (0, 255, 0), -1)
     else:
         cv2.circle(motorsImg, (260, 380), 13, (0, 0, 255), -1)
 
-    # Display latch status labels
-    cv2.putText(motorsImg, "latch_on", (45, 430), font, 1, (200, 0, 255), 2)
-    cv2.putText(motorsImg, "latch_off", (200, 430), font, 1, (200, 0, 255), 2)
-    cv2.line(motorsImg, (0, 480), (400, 480), (200, 200, 200), 4)
+    ui_service.show("robot control", motorsImg.copy())  # Display the control window on the UI thread
 
-    # Draw borders
-    cv2.line(motorsImg, (185, 5), (185, 480), (200, 200, 200), 1)
-    cv2.line(motorsImg, (0, 5), (0, 480), (200, 200, 200), 4)
-    cv2.line(motorsImg, (0, 5), (400, 5), (200, 200, 200), 4)
 
-    cv2.waitKey(1)  # Wait for a short period
-    cv2.imshow("robot control", motorsImg)  # Display the control window
+class KeyboardInput:
+    """
+       The pressed keys of the keyboard module, kept up to date by its key down and key up events.
+
+       The keyboard is hooked once, reading the state is a copy of a set instead of a query per key.
+    """
+
+    def __init__(self):
+        init()
+        self.pressed = set()
+        self._lock = threading.Lock()
+        keyboard.hook(self._event)
+
+    def _event(self, event):
+        name = (event.name or "").lower()  # 'L' with shift is the 'l' key
+        with self._lock:
+            if event.event_type == keyboard.KEY_DOWN:
+                self.pressed.add(name)
+            else:
+                self.pressed.discard(name)
+
+    def snapshot(self):
+        """
+           Returns:
+               frozenset: Names of the keys held down now, in lower case.
+        """
+        with self._lock:
+            return frozenset(self.pressed)
+
+
+class ScriptedInput:
+    """
+       Keys pressed by a script instead of the keyboard, to drive and benchmark the control without a keyboard hook.
+
+       Args:
+           script (list): (ticks, keys) steps, the key names are held down for that many snapshots.
+           repeat (bool): Start the script again at its end, otherwise no key is pressed after it.
+    """
+
+    def __init__(self, script, repeat=False):
+        self.snapshots = [frozenset(keys) for ticks, keys in script for _ in range(ticks)]
+        self.repeat = repeat
+        self.position = 0
+
+    def snapshot(self):
+        if self.position >= len(self.snapshots):
+            if not self.repeat or not self.snapshots:
+                return frozenset()
+            self.position = 0
+        keys = self.snapshots[self.position]
+        self.position += 1
+        return keys
+
+    def done(self):
+        return not self.repeat and self.position >= len(self.snapshots)
+
 
+def init():
+    """
+        Import the keyboard module, it needs root on Linux and is only imported when the keyboard is used.
+    """
+    global keyboard
+    if keyboard is None:
+        import keyboard as keyboard_module
+        keyboard = keyboard_module
 
-def keyboard_reader():
+
+def set_input(new_source):
+    """
+        Read the keys from another source, any object with a snapshot() method returning the pressed key names.
+    """
+    global source, previous
+    source = new_source
+    previous = frozenset()
+
+
+def keyboard_reader(now=None):
     """
         Read keyboard inputs to control motors and other actions.
 
+        The pressed keys are read once, as a snapshot of the input source, and the speeds ramp with the time
+        of the control tick. The latch toggles when 'l' goes down, at most once per LATCH_DEBOUNCE seconds.
+
+        Args:
+            now (float): time.monotonic() at the control tick, now by default.
+
         Returns:
             lm (int): Speed of the left motor.
             rm (int): Speed of the right motor.
@@ -138,7 +259,15 @@ def keyboard_reader():
             back_rm (bool): Backward motion status for right motor.
             disconnect (bool): Disconnect status.
     """
-    global lm, rm, time0, time1, time2, time3, extra1, extra2, latch
+    global lm, rm, time0, time1, time2, time3, extra1, extra2, latch, latch_time, previous
+    if source is None:
+        set_input(KeyboardInput())
+    if now is None:
+        now = time.monotonic()
+    pressed = source.snapshot()
+    went_down = pressed - previous
+    previous = pressed
+    up, down, left, right = "up" in pressed, "down" in pressed, "left" in pressed, "right" in pressed
     up_arm = 0
     down_arm = 0
     l_turn = 0
@@ -150,39 +279,39 @@ def keyboard_reader():
     nothing = 1
 
     # Check for Emergency Stop
-    if keyboard.is_pressed('esc'):  # Emergency Stop key
+    if "esc" in pressed:  # Emergency Stop key
         emergency_stop = True
         return lm, rm, latch, up_arm, down_arm, back_lm, back_rm, disconnect, emergency_stop
 
     # Control logic for left, right, up, and down movements
-    if keyboard.is_pressed('left') and not keyboard.is_pressed('up') and not keyboard.is_pressed('down'):
+    if left and not up and not down:
         l_turn = True
         back_lm = 1
         nothing = 0
         rm = 10
         lm = 10
 
-    if keyboard.is_pressed('right') and not keyboard.is_pressed('up') and not keyboard.is_pressed('down'):
+    if right and not up and not down:
         r_turn = True
         back_rm = 1
         nothing = 0
         rm = 10
         lm = 10
 
-    if keyboard.is_pressed('up') and not keyboard.is_pressed('left') and not keyboard.is_pressed('right'):
+    if up and not left and not right:
         nothing = 0
-        time1 = time.time()
+        time1 = now
         rm = extra1 + int((time1 - time0) * fsa)
         lm = rm
         rm = max(0, min(rm, up_forward_limit))
         lm = max(0, min(lm, up_forward_limit))
-    elif not keyboard.is_pressed('down'):
-        time0 = time.time()
+    elif not down:
+        time0 = now
 
-    if keyboard.is_pressed('up + right'):
+    if up and right:
         r_turn = 1
         nothing = 0
-        time2 = time.time()
+        time2 = now
         if rm < turnMotorLimit:
             lm = int(extra2 + (time2 - time3) * fmt)
         elif lm > turnMotorLimit:
@@ -190,14 +319,14 @@ def keyboard_reader():
         rm = max(0, min(rm, up_forward_turn_limit))
         lm = max(0, min(lm, up_forward_turn_limit))
         extra1 = lm
-    elif not keyboard.is_pressed('up + left') and not keyboard.is_pressed('down'):
+    elif not (up and left) and not down:
         extra2 = rm
-        time3 = time.time()
+        time3 = now
 
-    if keyboard.is_pressed('up + left'):
+    if up and left:
         l_turn = 1
         nothing = 0
-        time2 = time.time()
+        time2 = now
         if lm < turnMotorLimit:
             rm = int(extra2 + (time2 - time3) * fmt)
         elif rm > turnMotorLimit:
@@ -205,44 +334,45 @@ def keyboard_reader():
         rm = max(0, min(rm, up_forward_turn_limit))
         lm = max(0, min(lm, up_forward_turn_limit))
         extra1 = rm
-    elif not keyboard.is_pressed('up + right') and not keyboard.is_pressed('down'):
+    elif not (up and right) and not down:
         extra2 = lm
-        time3 = time.time()
+        time3 = now
 
-    if keyboard.is_pressed('down'):
+    if down:
         back_lm = 1
         back_rm = 1
         nothing = 0
-        time1 = time.time()
+        time1 = now
         rm = extra1 + int((time1 - time0) * bsa)
         lm = rm
-        if keyboard.is_pressed('left'):
+        if left:
             l_turn = 1
             back_rm = 0
             rm = 5
-        elif keyboard.is_pressed('right'):
+        elif right:
             r_turn = 1
             back_lm = 0
             rm = 5
         rm = max(0, min(rm, up_backward_limit))
         lm = max(0, min(lm, up_backward_limit))
 
-    elif not keyboard.is_pressed('up'):
-        time0 = time.time()
+    elif not up:
+        time0 = now
 
     # U/Y - tests only: designed for the developer/tester tests.
-    if keyboard.is_pressed('u') or keyboard.is_pressed('U'):
+    if "u" in pressed:
         up_arm = 1
 
-    elif keyboard.is_pressed('y') or keyboard.is_pressed('Y'):
+    elif "y" in pressed:
         down_arm = 1
 
     # L - tests only: designed for the developer/tester tests.
-    if keyboard.is_pressed('l') or keyboard.is_pressed('L'):
-        latch = 1 - latch  # Toggle latch status
-        time.sleep(0.4)  # debounce delay
+    if "l" in pressed:
+        if "l" in went_down and now - latch_time >= LATCH_DEBOUNCE:
+            latch = 1 - latch  # Toggle latch status once per press
+            latch_time = now
 
-    elif keyboard.is_pressed('d') or keyboard.is_pressed('D'):
+    elif "d" in pressed:
         disconnect = True  # set disconnect flag
 
     # uf no keys pressed, stop motors
@@ -254,7 +384,3 @@ def keyboard_reader():
     # Update motor visuals
     motors(lm, rm, latch, up_arm, down_arm, l_turn, r_turn, back_lm, back_rm)
     return lm, rm, latch, up_arm, down_arm, back_lm, back_rm, disconnect, emergency_stop
-
-
-# cleanup openCV windows
-cv2.destroyAllWindows()
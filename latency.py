@@ -0,0 +1,235 @@
+import json
+import os
+import threading
+import time
+import numpy as np
+
+# Stages from the frame capture to the GPIO command, in the order they run
+STAGES = ("capture", "grayscale", "detection", "pose_estimation", "filtering", "mapping_image", "display", "gpio",
+          "photon_to_pwm")
+# Latency objectives in seconds, every slower sample counts as a violation
+SLO = {"photon_to_pwm": float(os.environ.get("AUTOLINK_LATENCY_SLO", 0.15))}
+
+SUB_BUCKETS = 32  # buckets per power of two, the values are kept with a relative error below 1/32
+MAX_VALUE_US = 60 * 1000000  # longer samples are counted as 60 s
+EXPORT_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0)  # Prometheus "le" bounds
+EXPORT_INTERVAL = 5.0  # seconds between the periodic snapshots
+JSON_FILE = "latency.json"
+PROMETHEUS_FILE = "latency.prom"
+
+enabled = os.environ.get("AUTOLINK_LATENCY", "") == "1"  # the stages are only recorded when enabled
+histograms = {}  # Histogram by stage, created on the first sample
+violations = dict.fromkeys(SLO, 0)  # samples slower than the objective, by stage
+_lock = threading.Lock()
+_exporter = None
+
+
+def _bucket_count():
+    return 2 * SUB_BUCKETS + SUB_BUCKETS * (int(MAX_VALUE_US).bit_length() - 6)
+
+
+class Histogram:
+    """
+    HDR style histogram of durations in a fixed array of log-linear buckets.
+
+    Durations are counted in microseconds: exactly below 2 * SUB_BUCKETS, above it in SUB_BUCKETS buckets per
+    power of two. Recording is an index calculation and an increment, the memory does not grow with the samples.
+    """
+
+    def __init__(self):
+        self.counts = [0] * _bucket_count()  # a list is faster than an array to increment one item
+        self.count = 0
+        self.total = 0.0  # sum of the samples in seconds
+        self.max = 0.0
+
+    @staticmethod
+    def index(value_us):
+        if value_us < 2 * SUB_BUCKETS:
+            return value_us
+        shift = value_us.bit_length() - 6  # value_us >> shift is in [SUB_BUCKETS, 2 * SUB_BUCKETS)
+        return 2 * SUB_BUCKETS + (shift - 1) * SUB_BUCKETS + (value_us >> shift) - SUB_BUCKETS
+
+    @staticmethod
+    def lowest(index):
+        """
+        Returns:
+            int: The smallest value in microseconds of a bucket.
+        """
+        if index < 2 * SUB_BUCKETS:
+            return index
+        shift = (index - 2 * SUB_BUCKETS) // SUB_BUCKETS + 1
+        return (SUB_BUCKETS + (index - 2 * SUB_BUCKETS) % SUB_BUCKETS) << shift
+
+    def record(self, seconds):
+        value_us = min(max(int(seconds * 1e6), 0), MAX_VALUE_US)
+        self.counts[self.index(value_us)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, q):
+        """
+        Returns:
+            float: The q-th percentile in seconds, the middle of its bucket.
+        """
+        if not self.count:
+            return 0.0
+        index = int(np.searchsorted(np.cumsum(self.counts), q / 100 * self.count))
+        low, high = self.lowest(index), self.lowest(index + 1)
+        return min((low + high) / 2 * 1e-6, self.max)
+
+    def below(self, seconds):
+        """
+        Returns:
+            int: Number of samples of at most seconds, counting whole buckets.
+        """
+        last = self.index(min(int(seconds * 1e6), MAX_VALUE_US))
+        return sum(self.counts[:last + 1])
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: Count, mean, percentiles and maximum, in milliseconds.
+        """
+        return {"count": self.count, "mean_ms": self.total / self.count * 1000 if self.count else 0.0,
+                "p50_ms": self.percentile(50) * 1000, "p90_ms": self.percentile(90) * 1000,
+                "p99_ms": self.percentile(99) * 1000, "p999_ms": self.percentile(99.9) * 1000,
+                "max_ms": self.max * 1000}
+
+
+def record(stage, seconds):
+    """
+    Record a duration of a stage, nothing is done when the instrumentation is disabled.
+    """
+    if not enabled:
+        return
+    with _lock:
+        histogram = histograms.get(stage)
+        if histogram is None:
+            histogram = histograms[stage] = Histogram()
+        histogram.record(seconds)
+        if stage in SLO and seconds > SLO[stage]:
+            violations[stage] += 1
+
+
+def lap(stage, start):
+    """
+    Record the time since start for a stage.
+
+    Returns:
+        float: time.monotonic() now, the start of the next stage.
+    """
+    now = time.monotonic()
+    if enabled:
+        record(stage, now - start)
+    return now
+
+
+def enable(on=True):
+    global enabled
+    enabled = on
+
+
+def reset():
+    with _lock:
+        histograms.clear()
+        violations.update(dict.fromkeys(SLO, 0))
+
+
+def slo_met(stage="photon_to_pwm", percentile=99):
+    """
+    Returns:
+        bool: True if the percentile of the stage is within its objective, or if it has no samples.
+    """
+    histogram = histograms.get(stage)
+    return histogram is None or histogram.percentile(percentile) <= SLO[stage]
+
+
+def snapshot():
+    """
+    Returns:
+        dict: The snapshot of every stage, the objectives and their violations.
+    """
+    with _lock:
+        stages = {stage: histograms[stage].snapshot() for stage in STAGES + tuple(sorted(histograms.keys() - set(STAGES)))
+                  if stage in histograms}
+        return {"time": time.time(), "stages": stages,
+                "slo": {stage: {"objective_ms": objective * 1000, "violations": violations[stage],
+                                "met": slo_met(stage)} for stage, objective in SLO.items()}}
+
+
+def report():
+    """
+    Returns:
+        str: A text table of the stages.
+    """
+    lines = [f"{'stage':<16}{'count':>8}{'mean':>9}{'p50':>9}{'p99':>9}{'max':>9}  ms"]
+    data = snapshot()
+    for stage, values in data["stages"].items():
+        lines.append(f"{stage:<16}{values['count']:>8}{values['mean_ms']:>9.2f}{values['p50_ms']:>9.2f}"
+                     f"{values['p99_ms']:>9.2f}{values['max_ms']:>9.2f}")
+    for stage, slo in data["slo"].items():
+        lines.append(f"{stage} objective {slo['objective_ms']:.0f} ms: {'met' if slo['met'] else 'VIOLATED'}, "
+                     f"{slo['violations']} slower samples")
+    return "\n".join(lines)
+
+
+def prometheus():
+    """
+    Returns:
+        str: The histograms in the Prometheus text format, with the EXPORT_BUCKETS bounds.
+    """
+    lines = ["# HELP autolink_stage_latency_seconds Latency of the docking loop stages.",
+             "# TYPE autolink_stage_latency_seconds histogram"]
+    with _lock:
+        for stage, histogram in histograms.items():
+            for bound in EXPORT_BUCKETS:
+                lines.append(f'autolink_stage_latency_seconds_bucket{{stage="{stage}",le="{bound}"}} '
+                             f'{histogram.below(bound)}')
+            lines.append(f'autolink_stage_latency_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}')
+            lines.append(f'autolink_stage_latency_seconds_sum{{stage="{stage}"}} {histogram.total}')
+            lines.append(f'autolink_stage_latency_seconds_count{{stage="{stage}"}} {histogram.count}')
+        lines += ["# HELP autolink_latency_slo_seconds Latency objective of a stage.",
+                  "# TYPE autolink_latency_slo_seconds gauge"]
+        lines += [f'autolink_latency_slo_seconds{{stage="{stage}"}} {objective}' for stage, objective in SLO.items()]
+        lines += ["# HELP autolink_latency_slo_violations_total Samples slower than the objective.",
+                  "# TYPE autolink_latency_slo_violations_total counter"]
+        lines += [f'autolink_latency_slo_violations_total{{stage="{stage}"}} {count}'
+                  for stage, count in violations.items()]
+    return "\n".join(lines) + "\n"
+
+
+def _write(path, text):
+    temporary = path + ".tmp"
+    with open(temporary, "w") as file:
+        file.write(text)
+    os.replace(temporary, path)  # a scraper never reads a partly written file
+
+
+def export(json_path=JSON_FILE, prometheus_path=PROMETHEUS_FILE):
+    """
+    Write the JSON snapshot and the Prometheus file.
+    """
+    if json_path:
+        _write(json_path, json.dumps(snapshot(), indent=2))
+    if prometheus_path:
+        _write(prometheus_path, prometheus())
+
+
+def start_export(interval=EXPORT_INTERVAL, json_path=JSON_FILE, prometheus_path=PROMETHEUS_FILE):
+    """
+    Enable the instrumentation and export the snapshots every interval seconds on a background thread.
+    """
+    global _exporter
+    enable()
+    if _exporter is not None:
+        return
+
+    def export_loop():
+        while True:
+            time.sleep(interval)
+            export(json_path, prometheus_path)
+
+    _exporter = threading.Thread(target=export_loop, name="latency-export", daemon=True)
+    _exporter.start()
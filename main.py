@@ -1,28 +1,98 @@
+import sys
+import aruco_detection
 from aruco_detection import aruco_detecting
 import mapping_processing
 import connection_functions
-import cv2 as cv
+import camera_capture
+import vision_pipeline
+import async_runtime
+import session_recorder
+import latency
+import ui_service
+import multi_camera
+import docking_lut
+import marker_board
+import detector_tuning
+import GPIO_activation
+from docking_geometry import docking_decision
 
-# initialize video capture from the default camera
-cap = cv.VideoCapture(0)
+# 'python main.py --pipeline' runs capture, detection and the windows in their own processes,
+# 'python main.py --multi-camera' fuses the cameras of multi_camera.CAMERAS
+# 'python main.py --async' runs the loop, the docking and the disconnection as asyncio tasks
+# 'python main.py --record' records the session to session_<date>_<time>.rec, see session_recorder.py
+# 'python main.py --headless' shows no windows, the keys are typed in the terminal followed by Enter
+# 'python main.py --latency' writes the latency of every stage to latency.json and latency.prom, see latency.py
+# 'python main.py --docking-lut' steers step 1 with the precomputed table of docking_lut.py
+# 'python main.py --detector-profile' uses the detector settings selected by detector_tuning.py
+# 'python main.py --board' estimates one pose from all the markers of the board.json layout, see marker_board.py
+if "--headless" in sys.argv:
+    ui_service.HEADLESS = True
+if "--record" in sys.argv:
+    session_recorder.start()
+if "--latency" in sys.argv:
+    latency.start_export()
+if "--docking-lut" in sys.argv:
+    docking_lut.init()
+if "--detector-profile" in sys.argv:
+    aruco_detection.load_profile(detector_tuning.PROFILE_FILE)
+if "--board" in sys.argv:
+    aruco_detection.BOARD = marker_board.BOARD_FILE
+if "--async" in sys.argv:
+    async_runtime.run(0)
+    session_recorder.stop()
+    sys.exit()
+pipeline = None
+if "--pipeline" in sys.argv:
+    pipeline = vision_pipeline.VisionPipeline(0).start()
+elif "--multi-camera" in sys.argv:
+    try:
+        pipeline = multi_camera.CameraRig().start()
+    except ValueError as error:
+        sys.exit(str(error))
+else:
+    # start the shared capture of the default camera, auto_connection reads from the same one
+    cap = camera_capture.get_camera(0)
+    # load the calibration and render the map layers while the camera starts
+    aruco_detection.init()
+    mapping_processing.init()
 first_permission = True
 first_no_detection = True
 first_no_permission = True
 while True:
-    # read a frame from the camera
-    ret, frame = cap.read()
+    if pipeline is not None:
+        # the newest pose from the detection process or the cameras, and the keys pressed in their windows
+        pose = pipeline.read_pose()
+        key = pipeline.read_key()
+        if pose is None:
+            if pipeline.failed():
+                print("There is a camera problem")
+                break
+            if key == ord("q") or key == ord("Q"):
+                break
+            continue  # no new pose in time, the detection is only late
+        detection, distance, wheelX, wheelZ, wheelAngle, _ = pose
+    else:
+        # read a frame from the camera, with the time it was captured
+        result = cap.read_frame()
+        key = ui_service.read_key()  # key pressed in the windows, without waiting
 
-    if not ret:
-        print("There is a camera problem")
-        break
-    key = cv.waitKey(1)  # wait for a short period for key press
+        if result is None:
+            if not cap.isOpened():
+                print("There is a camera problem")
+                break
+            if key == ord("q") or key == ord("Q"):
+                break
+            continue  # no new frame in time, a late frame is not a camera problem
+        frame, timestamp, _ = result
 
-    # Detect aruco markers in the frame
-    aruco_image, detection, distance, wheelX, wheelZ, wheelAngle = aruco_detecting(frame)
+        # Detect aruco markers in the frame
+        aruco_image, detection, distance, wheelX, wheelZ, wheelAngle = aruco_detecting(frame, timestamp)
+        # the UI thread draws the markers and the map when it refreshes the windows
+        ui_service.show_detection(aruco_image, detection, wheelX, wheelZ, wheelAngle)
 
     if detection:
         # process the mapping based on detected marker data
-        map_image, goodPos, turnRad, x1 = mapping_processing.mapping_image(wheelX, wheelZ, wheelAngle)
+        goodPos, turnRad, x1 = docking_decision(wheelX, wheelZ, wheelAngle)
 
         if goodPos:
             if first_permission:
@@ -32,14 +102,14 @@ while True:
                 first_no_detection = True
             if key == ord("c") or key == ord("C"):  # Check for user input to connect
                 # >>>>>>>>>>>>>  AUTO CONNECTION
-                connection_successful = connection_functions.auto_connection()
+                connection_successful = connection_functions.auto_connection(pipeline=pipeline)
 
                 if not connection_successful:
                     print("Connection interrupted. Returning to detection step.")
-                    # initialize video capture from the default camera
                     first_permission = True
                     first_no_detection = True
-                    cap = cv.VideoCapture(0)
+                    if pipeline is None:
+                        cap = camera_capture.get_camera(0)  # reopens the camera only if it failed
                     continue  # Restart the loop to detect and process again
 
                 print("connected , press 'd' for disconnection\n")
@@ -49,10 +119,7 @@ while True:
 
                 # >>>>>>>>>>>>>  DISCONNECTING
                 print("disconnecting")
-                connection_functions.disconnection()
-
-                # Re-initialize camera after disconnection
-                cap = cv.VideoCapture(0)
+                connection_functions.disconnection(pipeline=pipeline)
         else:
             if first_no_permission:
                 print("No permission to connect, adjust the wheelchair position ")
@@ -61,20 +128,30 @@ while True:
                 first_no_detection = True
 
     else:
-        # If no detection, show a blank map image
-        map_image = mapping_processing.blankImg()
         if first_no_detection:
             print("No detection\n")
             first_no_detection = False
             first_permission = True
             first_no_permission = True
 
-    # display the aruco detection image and the mapped image
-    cv.imshow("aruco", aruco_image)
-    cv.imshow("mapp", map_image)
     if key == ord("q") or key == ord("Q"):  # exit if 'q' is pressed
         break
 
-# Release the camera and destroy all openCV windows
-cap.release()
-cv.destroyAllWindows()
+if GPIO_activation.outputs is not None:
+    stats = GPIO_activation.gpio_stats()
+    print(f"GPIO: {stats['backend_calls']} backend calls, {stats['skipped']} unchanged writes skipped, "
+          f"{stats['mean_write_us']:.1f} us per command")
+
+# Release the camera and close the windows
+if pipeline is not None:
+    for stage, rate in pipeline.throughput().items():
+        print(f"{stage}: {rate:.1f} frames/s")
+    pipeline.stop()
+else:
+    cap.stop()
+session_recorder.stop()
+if latency.enabled:
+    latency.export()
+    print(latency.report())
+if ui_service.ui is not None:
+    ui_service.ui.stop()  # closes the windows
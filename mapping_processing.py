@@ -1,61 +1,229 @@
 import cv2 as cv
 import numpy as np
 import math
+from functools import lru_cache
+from docking_geometry import docking_geometry, x0, y0, cameraPos
 
 # Initialize a blank image for the mapping and robot display
-pathImg = np.zeros((1200, 1800, 3), dtype=np.uint8)  # graph image dimensions
-x0, y0 = int(pathImg.shape[1] / 2), pathImg.shape[0]  # center coordinates
+pathImg = np.zeros((y0, 2 * x0, 3), dtype=np.uint8)  # graph image dimensions, x0 and y0 are its bottom center
 w, h = 800, 700  # the 'pathImg' really bigger then the showing image, the showing image size is w and h
-cameraPos = (x0, y0 - 110)  # camera position offset
-robImg = cv.imread("robot.png")  # load and resize robot image
-robImg = cv.resize(robImg, (0, 0), fx=0.2, fy=0.15)
+vx0, vy0 = x0 - int(w / 2), y0 - h  # top-left corner of the showing image inside 'pathImg'
+robImg = None  # resized robot image, loaded by init()
+wheelImg = None  # the wheelchair image, it is rotated by rotated_wheel(), loaded by init()
 
+WHEEL_ANGLE_STEP = 0.5  # the wheelchair image is rotated in steps of this many degrees
+WHEEL_CACHE_SIZE = 128  # rotated wheelchair images kept in memory, about 250 KB each
 
-def blankImg():
+# Cached layers of the showing image, built once by _build_layers()
+blankLayer = None  # what blankImg() returns
+baseLayer = None  # static background of mapping_image, before the wheelchair, heading line and arc are drawn
+topMask = None  # pixels that the robot image and the grey borders paint over the dynamic drawing
+recorder = None  # receives the decisions of mapping_image when the session is recorded, see session_recorder
+staticMask = None  # topMask plus the green grid, which is painted over the wheelchair image
+outImg = None  # output buffer reused by mapping_image
+shapeMask = None  # full size scratch mask for the shapes mapping_image draws, see _paint()
+colorImg = None  # scratch image holding the color of the shape being painted
+
+
+def init():
     """
-        Create a blank image with a grid, robot image, and frame borders.
+        Load the robot and wheelchair images and render the static layers of the display.
 
-        Returns:
-            np.ndarray: The generated blank image.
+        Importing the module does not read any file, this runs on the first map or it can be called at startup.
+    """
+    global robImg, wheelImg
+    if robImg is None:
+        robImg = cv.imread("robot.png")  # load and resize robot image
+        robImg = cv.resize(robImg, (0, 0), fx=0.2, fy=0.15)
+    if wheelImg is None:
+        wheelImg = cv.imread("wheel_chair.png")  # load the wheelchair image
+        # wheelImg = cv.resize(wheelImg, (0, 0), fx=0.6, fy=0.6)
+    if baseLayer is None:
+        _build_layers()
+
+
+def _draw_grid(img):
     """
-    pathImg = np.zeros((1200, 1800, 3), dtype=np.uint8)
+        Draw the green grid on a full size 'pathImg' canvas.
+    """
+    for i in range(0, img.shape[1], 20):
+        cv.line(img, (i, 0), (i, img.shape[1]), (0, 50, 0), 1)
+    for i in range(0, img.shape[0], 20):
+        cv.line(img, (0, i), (img.shape[1], i), (0, 50, 0), 1)
+
 
-    # green grid
-    for i in range(0, pathImg.shape[1], 20):
-        cv.line(pathImg, (i, 0), (i, pathImg.shape[1]), (0, 50, 0), 1)
-    for i in range(0, pathImg.shape[0], 20):
-        cv.line(pathImg, (0, i), (pathImg.shape[1], i), (0, 50, 0), 1)
+def _draw_robot(img):
+    """
+        Place the robot image on a full size 'pathImg' canvas.
+    """
+    img[(y0 - robImg.shape[0]):y0, (x0 - int(robImg.shape[1] / 2)):
+                                   (x0 - int(robImg.shape[1] / 2) + robImg.shape[1])] = robImg
 
-    # place the robot image on the grid
-    pathImg[(y0 - robImg.shape[0]):y0, (x0 - int(robImg.shape[1] / 2)): (x0 - int(robImg.shape[1] / 2)
-                                                                         + robImg.shape[1])] = robImg
 
-    # draw grey frame borders
+def _draw_borders(img):
+    """
+        Draw the grey frame borders and the outer rectangle of the display on a full size 'pathImg' canvas.
+    """
     greyColor = (100, 100, 100)
-    for i in range(0, pathImg.shape[0], 100):
-        cv.line(pathImg, (0, i), (int((pathImg.shape[1] - w) / 2 + 10), i), greyColor, 4)
-        cv.line(pathImg, (int(pathImg.shape[1] - ((pathImg.shape[1] - w) / 2 + 10)), i), (pathImg.shape[1], i),
-                greyColor, 2)
-    for i in range(0, pathImg.shape[1], 100):
-        cv.line(pathImg, (i, 0), (i, (pathImg.shape[0] - h + 10)), greyColor, 2)
-        cv.line(pathImg, (i, (pathImg.shape[0] - 10)), (i, pathImg.shape[0]), greyColor, 2)
+    for i in range(0, img.shape[0], 100):
+        cv.line(img, (0, i), (int((img.shape[1] - w) / 2 + 10), i), greyColor, 4)
+        cv.line(img, (int(img.shape[1] - ((img.shape[1] - w) / 2 + 10)), i), (img.shape[1], i), greyColor, 2)
+    for i in range(0, img.shape[1], 100):
+        cv.line(img, (i, 0), (i, (img.shape[0] - h + 10)), greyColor, 2)
+        cv.line(img, (i, (img.shape[0] - 10)), (i, img.shape[0]), greyColor, 2)
+
+    cv.rectangle(img, (int((img.shape[1] - w) / 2), (img.shape[0] - h)),
+                 (int(img.shape[1] - ((img.shape[1] - w) / 2)), img.shape[0]), greyColor, 5)
+
+
+def _crop(img):
+    """
+        Crop a full size 'pathImg' canvas to the display size.
+    """
+    return img[vy0:y0, vx0:(x0 + int(w / 2))]
+
+
+def _build_layers():
+    """
+        Render the static layers of the display once and keep them cropped to the display size.
+
+        mapping_image draws the wheelchair image under the grid, the robot image and the borders, and its
+        heading line under the robot image and the borders. Instead of redrawing those static layers every
+        frame, their pixels are restored from 'baseLayer' through 'staticMask' and 'topMask'.
+    """
+    global blankLayer, baseLayer, topMask, staticMask, outImg, shapeMask, colorImg
+
+    canvas = np.zeros((1200, 1800, 3), dtype=np.uint8)
+    _draw_grid(canvas)
+    _draw_robot(canvas)
+    _draw_borders(canvas)
+    cv.circle(canvas, cameraPos, 4, (0, 200, 0), -1)  # the camera position
+    blankLayer = _crop(canvas).copy()
+
+    # mapping_image repaints the grid, the robot image and the borders over the blank image
+    canvas = np.zeros((1200, 1800, 3), dtype=np.uint8)
+    _crop(canvas)[:] = blankLayer
+    _draw_grid(canvas)
+    _draw_robot(canvas)
+    _draw_borders(canvas)
+    baseLayer = _crop(canvas).copy()
+
+    canvas = np.zeros((1200, 1800, 3), dtype=np.uint8)
+    _draw_borders(canvas)
+    topMask = _crop(canvas).any(axis=2).astype(np.uint8) * 255
+    topMask[(h - robImg.shape[0]):, (x0 - vx0 - int(robImg.shape[1] / 2)):
+                                     (x0 - vx0 - int(robImg.shape[1] / 2) + robImg.shape[1])] = 255
+
+    canvas = np.zeros((1200, 1800, 3), dtype=np.uint8)
+    _draw_grid(canvas)
+    staticMask = _crop(canvas).any(axis=2).astype(np.uint8) * 255 | topMask
+
+    outImg = np.empty_like(baseLayer)
+    shapeMask = np.zeros(pathImg.shape[:2], dtype=np.uint8)
+    colorImg = np.empty_like(baseLayer)
+
+
+def _restore(img, mask, top, bottom, left, right):
+    """
+        Copy the static pixels selected by 'mask' back from 'baseLayer' inside a region of the display image.
+    """
+    top, left = max(top, 0), max(left, 0)
+    bottom, right = min(bottom, img.shape[0]), min(right, img.shape[1])
+    if top < bottom and left < right:
+        cv.copyTo(baseLayer[top:bottom, left:right], mask[top:bottom, left:right], img[top:bottom, left:right])
+
+
+def _paint(img, color, box, draw):
+    """
+        Draw a shape given in 'pathImg' coordinates on the display image.
+
+        cv.line and cv.ellipse clip their outlines to the image they draw on, so drawing straight on the
+        display image would move the pixels of shapes that cross its edge. The shape is drawn on the full size
+        'shapeMask' instead, painted on the display image inside 'box' and then erased from the mask again.
+
+        Args:
+            img (np.ndarray): The display image.
+            color (tuple): BGR color of the shape.
+            box (tuple): (left, top, right, bottom) bounds of the shape in 'pathImg' coordinates.
+            draw (callable): draw(mask, value) draws the shape on a full size mask.
+
+        Returns:
+            tuple: (top, bottom, left, right) of the painted region in the display image.
+    """
+    left, top = max(box[0], vx0), max(box[1], vy0)
+    right, bottom = min(box[2], x0 + int(w / 2)), min(box[3], y0)
+    if left < right and top < bottom:
+        draw(shapeMask, 255)
+        fill = colorImg[(top - vy0):(bottom - vy0), (left - vx0):(right - vx0)]
+        fill[:] = color
+        cv.copyTo(fill, shapeMask[top:bottom, left:right], img[(top - vy0):(bottom - vy0), (left - vx0):(right - vx0)])
+        draw(shapeMask, 0)
+    return top - vy0, bottom - vy0, left - vx0, right - vx0
+
+
+def _arc_box(center, radius, start, end):
+    """
+        Bounds of a circle arc drawn by cv.ellipse, padded for the arc thickness.
+
+        Returns:
+            tuple: (left, top, right, bottom) of the arc in 'pathImg' coordinates.
+    """
+    start, end = sorted((round(start), round(end)))  # cv.ellipse rounds the angles to whole degrees
+    angles = [start, end] + list(range(math.ceil(start / 90) * 90, end + 1, 90))
+    xs = [center[0] + radius * math.cos(math.radians(angle)) for angle in angles]
+    ys = [center[1] + radius * math.sin(math.radians(angle)) for angle in angles]
+    return int(min(xs)) - 5, int(min(ys)) - 5, int(max(xs)) + 6, int(max(ys)) + 6
+
+
+@lru_cache(maxsize=WHEEL_CACHE_SIZE)
+def _rotate_wheel(step):
+    """
+        Rotate the wheelchair image by a whole number of WHEEL_ANGLE_STEP steps.
+    """
+    height, width = wheelImg.shape[:2]
+    centerX, centerY = (width // 2, height // 2)
+    M = cv.getRotationMatrix2D((centerX, centerY + 50), step * WHEEL_ANGLE_STEP, 0.5)
+    rotated = cv.warpAffine(wheelImg, M, (width, height))
+    rotated.flags.writeable = False  # it is shared by every frame with the same angle
+    return rotated
 
-    # it draws the outer rectangle for the display
-    cv.rectangle(pathImg, (int((pathImg.shape[1] - w) / 2), (pathImg.shape[0] - h)),
-                 (int(pathImg.shape[1] - ((pathImg.shape[1] - w) / 2)), pathImg.shape[0]), greyColor, 5)
 
-    # draw the camera position
-    cv.circle(pathImg, cameraPos, 4, (0, 200, 0), -1)
+def rotated_wheel(wheelAngle):
+    """
+        Get the wheelchair image rotated by an angle, rounded to WHEEL_ANGLE_STEP.
+
+        The rotated images are memoized, the least recently used ones are dropped once WHEEL_CACHE_SIZE
+        angles are stored.
 
-    # now it crops the image to the display size
-    pathImg = pathImg[(y0 - h):y0, (x0 - int(w / 2)):(x0 + int(w / 2))]
-    return pathImg
+        Args:
+            wheelAngle (float): Orientation angle of the wheel in degrees.
+
+        Returns:
+            np.ndarray: The rotated wheelchair image (read only).
+    """
+    if wheelImg is None:
+        init()
+    return _rotate_wheel(round(wheelAngle / WHEEL_ANGLE_STEP) % round(360 / WHEEL_ANGLE_STEP))
+
+
+def blankImg():
+    """
+        Create a blank image with a grid, robot image, and frame borders.
+
+        Returns:
+            np.ndarray: The generated blank image.
+    """
+    if blankLayer is None:
+        init()
+    return blankLayer.copy()
 
 
 def mapping_image(wheelX, wheelY, wheelAngle):
     """
         Map the robot's position and orientation based on wheel data.
 
+        The returned image is a buffer that is reused by the next call, copy it if it has to be kept.
+
         Args:
             wheelX (float): X position of the wheel.
             wheelY (float): Y position of the wheel.
@@ -68,105 +236,62 @@ def mapping_image(wheelX, wheelY, wheelAngle):
                 - turnRad (int): Turning radius.
                 - x1 (float): X displacement from the camera position.
     """
-    goodPos = False
-    pathImg = np.zeros((1200, 1800, 3), dtype=np.uint8)  # create a new blank image
-    pathImg[(y0 - h):y0, (x0 - int(w / 2)):(x0 + int(w / 2))] = blankImg()
+    if baseLayer is None:
+        init()
+    pathImg = outImg
+    np.copyto(pathImg, baseLayer)  # start from the static background
 
-    # load and position the wheelchair image
-    wheelImg = cv.imread("wheel_chair.png")
-    # wheelImg = cv.resize(wheelImg, (0, 0), fx=0.6, fy=0.6)
-    wheelPos = (int(x0 + wheelX * 4.5), int(y0 - 110 - wheelY * 4.5))
-    height, width = wheelImg.shape[:2]
-    centerX, centerY = (width // 2, height // 2)
+    # the drawing below is done in 'pathImg' coordinates, so every point is shifted to the display image
+    def view(point):
+        return point[0] - vx0, point[1] - vy0
 
-    # rotate the wheelchair image
-    M = cv.getRotationMatrix2D((centerX, centerY + 50), wheelAngle, 0.5)
-    wheelImg = cv.warpAffine(wheelImg, M, (width, height))
+    # it calculates the wheelchair position, the turning radius and angle
+    geometry = docking_geometry(wheelX, wheelY, wheelAngle)
+    wheelPos = tuple(geometry["wheelPos"].tolist())
+    middlePoint = tuple(geometry["middlePoint"].tolist())
+    goodPos, turnRad, x1 = bool(geometry["goodPos"]), int(geometry["turnRad"]), int(geometry["x1"])
 
-    # it places the wheelchair image if it's within bounds
-    if (500 < wheelPos[0] < 1300) and (500 < wheelPos[1] < 1100):
-        pathImg[(wheelPos[1] - int(wheelImg.shape[0] * 0.62)): (
-                wheelPos[1] - int(wheelImg.shape[0] * 0.62) + wheelImg.shape[0]), (wheelPos[0]
-                                                                                   - int(wheelImg.shape[1] / 2)):
-                                                                                  (wheelPos[0] - int(wheelImg.shape[1] /
-                                                                                                     2) +
-                                                                                   wheelImg.shape[1])] = wheelImg
-
-    # Draw grid lines
-    for i in range(0, pathImg.shape[1], 20):
-        cv.line(pathImg, (i, 0), (i, pathImg.shape[1]), (0, 50, 0), 1)
+    # get the wheelchair image rotated
+    wheelImg = rotated_wheel(wheelAngle)
 
-    for i in range(0, pathImg.shape[0], 20):
-        cv.line(pathImg, (0, i), (pathImg.shape[1], i), (0, 50, 0), 1)
-
-    # it calculates the turning radius and angle
+    # it places the wheelchair image if it's within bounds, under the grid, the robot image and the borders
+    if (500 < wheelPos[0] < 1300) and (500 < wheelPos[1] < 1100):
+        left, top = view((wheelPos[0] - int(wheelImg.shape[1] / 2), wheelPos[1] - int(wheelImg.shape[0] * 0.62)))
+        bottom, right = top + wheelImg.shape[0], left + wheelImg.shape[1]
+        cropTop, cropLeft = max(0, -top), max(0, -left)
+        cropBottom = wheelImg.shape[0] - max(0, bottom - pathImg.shape[0])
+        cropRight = wheelImg.shape[1] - max(0, right - pathImg.shape[1])
+        pathImg[(top + cropTop):(top + cropBottom), (left + cropLeft):(left + cropRight)] = \
+            wheelImg[cropTop:cropBottom, cropLeft:cropRight]
+        _restore(pathImg, staticMask, top, bottom, left, right)
+
+    # the heading line goes under the robot image and the borders
     theta = math.radians(wheelAngle)
-
     dx = int(50 * math.cos(theta))
     dy = int(50 * math.sin(theta))
-    cv.line(pathImg, (wheelPos[0] - dx, wheelPos[1] + dy),
-            (wheelPos[0] + dx, wheelPos[1] - dy),
-            (0, 255, 0), 3)
-
-    # Place the robot image on top of the mapping image
-    pathImg[(y0 - robImg.shape[0]):y0, (x0 - int(robImg.shape[1] / 2)):
-                                       (x0 - int(robImg.shape[1] / 2) + robImg.shape[1])] = robImg
-
-    # now it draws grey frame borders
-    greyColor = (100, 100, 100)
-    for i in range(0, pathImg.shape[0], 100):
-        cv.line(pathImg, (0, i), (int((pathImg.shape[1] - w) / 2 + 10), i), greyColor, 4)
-        cv.line(pathImg, (int(pathImg.shape[1] - ((pathImg.shape[1] - w) / 2 + 10)), i),
-                (pathImg.shape[1], i), greyColor, 2)
-
-    for i in range(0, pathImg.shape[1], 100):
-        cv.line(pathImg, (i, 0), (i, (pathImg.shape[0] - h + 10)), greyColor, 2)
-        cv.line(pathImg, (i, (pathImg.shape[0] - 10)), (i, pathImg.shape[0]), greyColor, 2)
-
-    # Draw the outer rectangle for the display
-    cv.rectangle(pathImg, (int((pathImg.shape[1] - w) / 2), (pathImg.shape[0] - h)),
-                 (int(pathImg.shape[1] - ((pathImg.shape[1] - w) / 2)), pathImg.shape[0]),
-                 greyColor, 5)
-
-    # calculate and draw the turning arc
-    dx2 = int(100 * math.sin(theta))
-    dy2 = int(100 * math.cos(theta))
-    middlePoint = (wheelPos[0] + dx2, wheelPos[1] + dy2)
-    cv.line(pathImg, cameraPos, middlePoint, (255, 0, 0), 1)
-    cv.line(pathImg, wheelPos, middlePoint, (255, 0, 0), 1)
-    cv.circle(pathImg, cameraPos, 6, (0, 0, 255), -1)
-    cv.circle(pathImg, middlePoint, 6, (0, 0, 255), -1)
-    cv.circle(pathImg, wheelPos, 6, (0, 0, 255), -1)
-
-    # now it calculates displacement and turning radius
-    x1 = middlePoint[0] - cameraPos[0]
-    y1 = middlePoint[1] - cameraPos[1]
-
-    x1 = 1 if x1 == 0 else x1  # prevent division by zero
-
-    Bangle = math.atan(y1 / x1)  #
-    d1 = math.sqrt(x1 ** 2 + y1 ** 2)
-    turnRad = int((d1 / (2 * math.cos(Bangle))))
-
-    # determine if the position is good based on the angles
-    if Bangle > 0:
-        if abs(180 - 2 * (Bangle * 180 / math.pi) - wheelAngle) < 45:
-            goodPos = True
-            arcColor = (0, 255, 0)  # green if position is good
-        else:
-            arcColor = (0, 0, 255)  # red if position is not good
-        cv.ellipse(pathImg, ((cameraPos[0] - turnRad), cameraPos[1]), (turnRad, turnRad), 0, 0,
-                   -(180 - 2 * (abs(Bangle) * 180 / math.pi)), arcColor, 4)
-
-    else:
-        if abs(180 + 2 * (Bangle * 180 / math.pi) + wheelAngle) < 45:
-            goodPos = True
-            arcColor = (0, 255, 0)
-        else:
-            arcColor = (0, 0, 255)
-        cv.ellipse(pathImg, ((cameraPos[0] + turnRad), cameraPos[1]), (turnRad, turnRad), 0,
-                   180, (360 - 2 * (abs(Bangle) * 180 / math.pi)), arcColor, 4)
-
-    # crop the image to the display size
-    pathImg = pathImg[(y0 - h):y0, (x0 - int(w / 2)):(x0 + int(w / 2))]
+    lineStart, lineEnd = (wheelPos[0] - dx, wheelPos[1] + dy), (wheelPos[0] + dx, wheelPos[1] - dy)
+    lineBox = _paint(pathImg, (0, 255, 0),
+                     (wheelPos[0] - abs(dx) - 3, wheelPos[1] - abs(dy) - 3,
+                      wheelPos[0] + abs(dx) + 4, wheelPos[1] + abs(dy) + 4),
+                     lambda mask, value: cv.line(mask, lineStart, lineEnd, value, 3))
+    _restore(pathImg, topMask, *lineBox)
+
+    # draw the turning arc
+    for point in (cameraPos, wheelPos):
+        _paint(pathImg, (255, 0, 0),
+               (min(point[0], middlePoint[0]), min(point[1], middlePoint[1]),
+                max(point[0], middlePoint[0]) + 1, max(point[1], middlePoint[1]) + 1),
+               lambda mask, value: cv.line(mask, point, middlePoint, value, 1))
+    cv.circle(pathImg, view(cameraPos), 6, (0, 0, 255), -1)
+    cv.circle(pathImg, view(middlePoint), 6, (0, 0, 255), -1)
+    cv.circle(pathImg, view(wheelPos), 6, (0, 0, 255), -1)
+
+    arcColor = (0, 255, 0) if goodPos else (0, 0, 255)  # green if position is good, red if not
+    arcCenter = tuple(geometry["arcCenter"].tolist())
+    arcStart, arcEnd = float(geometry["arcStart"]), float(geometry["arcEnd"])
+    _paint(pathImg, arcColor, _arc_box(arcCenter, turnRad, arcStart, arcEnd),
+           lambda mask, value: cv.ellipse(mask, arcCenter, (turnRad, turnRad), 0, arcStart, arcEnd, value, 4))
+
+    if recorder is not None:
+        recorder.mapping(wheelX, wheelY, wheelAngle, goodPos, turnRad, x1)
     return pathImg, goodPos, turnRad, x1
@@ -0,0 +1,118 @@
+import json
+import cv2 as cv
+from cv2 import aruco
+import numpy as np
+
+# Layout of the markers on the wheelchair, see MarkerBoard.from_file
+BOARD_FILE = "board.json"
+
+
+def _centered(object_points, origin):
+    """
+    Move the corners of an OpenCV board (origin at the top left, y down) to the frame of a single marker: x right,
+    y up and z towards the camera, with the board origin at the given point from the board's center.
+    """
+    points = np.asarray(object_points, dtype=np.float32).reshape(-1, 4, 3).copy()
+    center = (points.reshape(-1, 3).min(axis=0) + points.reshape(-1, 3).max(axis=0)) / 2
+    points[..., 0] = points[..., 0] - center[0] - origin[0]
+    points[..., 1] = center[1] - points[..., 1] - origin[1]
+    return points
+
+
+class MarkerBoard:
+    """
+    Several markers at known places on the wheelchair, whose pose is estimated with one solvePnP over the corners of
+    all the visible markers.
+
+    The board frame is the frame of a single marker: x right, y up, z out of the board, with its origin at the point
+    the single marker mode reports, so the docking geometry works the same in both modes. A partly hidden or steep
+    board still has a pose as long as one of its markers is detected, and more markers give a steadier pose.
+    """
+
+    def __init__(self, ids, corners, name=""):
+        """
+        Args:
+            ids (list): Marker IDs.
+            corners (list): (4, 3) corners of every marker in the board frame, in cm, in the order the detector
+                returns them: top left, top right, bottom right, bottom left.
+            name (str): Name of the layout.
+        """
+        self.corners = {int(marker_id): np.asarray(points, dtype=np.float32).reshape(4, 3)
+                        for marker_id, points in zip(ids, corners)}
+        self.name = name
+
+    @classmethod
+    def from_file(cls, path=BOARD_FILE):
+        """
+        Load a board layout from a JSON file.
+
+        The "layout" is one of:
+            - "markers": "markers" is a list of {"id", "size", "center": [x, y]}, square markers in the board plane,
+              in cm with x right and y up.
+            - "grid": an aruco.GridBoard of "columns" x "rows" markers of "marker_size" cm, "separation" cm apart.
+            - "charuco": the markers of an aruco.CharucoBoard of "columns" x "rows" squares of "square_size" cm, with
+              markers of "marker_size" cm.
+        The grid and ChArUco markers have the IDs from "first_id" (0 by default), centered on the board. "origin"
+        is the point of the board reported as the wheelchair position, [0, 0] (the center) by default.
+
+        Returns:
+            MarkerBoard: The board.
+        """
+        with open(path) as file:
+            config = json.load(file)
+        layout = config.get("layout", "markers")
+        origin = config.get("origin", (0.0, 0.0))
+        name = config.get("name", path)
+        if layout == "markers":
+            ids, corners = [], []
+            for marker in config["markers"]:
+                half = marker["size"] / 2
+                x, y = marker["center"][0] - origin[0], marker["center"][1] - origin[1]
+                ids.append(marker["id"])
+                corners.append([[x - half, y + half, 0], [x + half, y + half, 0],
+                                [x + half, y - half, 0], [x - half, y - half, 0]])
+            return cls(ids, corners, name)
+
+        dictionary = aruco.getPredefinedDictionary(getattr(aruco, config.get("dictionary", "DICT_4X4_250")))
+        size = (config["columns"], config["rows"])
+        first_id = config.get("first_id", 0)
+        if layout == "grid":
+            ids = np.arange(first_id, first_id + size[0] * size[1])
+            board = aruco.GridBoard(size, config["marker_size"], config["separation"], dictionary, ids)
+        elif layout == "charuco":
+            ids = np.arange(first_id, first_id + size[0] * size[1] // 2)
+            board = aruco.CharucoBoard(size, config["square_size"], config["marker_size"], dictionary, ids)
+        else:
+            raise ValueError(f"Unknown board layout {layout!r} in {path}")
+        return cls(board.getIds().ravel(), _centered(board.getObjPoints(), origin), name)
+
+    def estimate_pose(self, marker_corners, marker_IDs, mtx, distortion):
+        """
+        Estimate the board pose from all the detected markers of the board at once.
+
+        Args:
+            marker_corners (list): Detected corners, like detector.detectMarkers returns them.
+            marker_IDs (ndarray): Detected IDs.
+            mtx (ndarray): Camera matrix.
+            distortion (ndarray): Distortion coefficients.
+
+        Returns:
+            tuple: (rvec, tvec, used) with (3,) vectors and the indexes of the board markers among the detected
+                ones, or None when no marker of the board is detected once.
+        """
+        ids = np.asarray(marker_IDs).ravel()
+        values, counts = np.unique(ids, return_counts=True)
+        repeated = set(values[counts > 1].tolist())
+        # every board marker is on the board once, all the copies of a repeated ID are dropped since the true one
+        # cannot be told from the false detections
+        used = [i for i, marker_id in enumerate(ids.tolist())
+                if marker_id in self.corners and marker_id not in repeated]
+        if not used:
+            return None
+        object_points = np.concatenate([self.corners[ids[i]] for i in used])
+        image_points = np.concatenate([np.asarray(marker_corners[i], dtype=np.float32).reshape(4, 2) for i in used])
+        _, rvec, tvec = cv.solvePnP(object_points, image_points, mtx, distortion, flags=cv.SOLVEPNP_IPPE)
+        if len(used) > 1:
+            # the planar solution is exact for one square, refine the reprojection error of all the markers
+            rvec, tvec = cv.solvePnPRefineLM(object_points, image_points, mtx, distortion, rvec, tvec)
+        return rvec.ravel(), tvec.ravel(), used
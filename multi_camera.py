@@ -0,0 +1,207 @@
+import os
+import threading
+import time
+import numpy as np
+
+import camera_capture
+import ui_service
+from aruco_detection import MarkerDetector, default_board
+from pose_filter import PoseFilter
+
+# Cameras of the rig: (camera index, calibration file, mount). The mount is the camera's (x, z, yaw) in the robot
+# frame, in cm, cm and degrees, the robot frame is the frame of the main camera (x right, z forward).
+# Only the main camera by default, add the other cameras of the robot with their own calibration and mount, like
+# (2, "arrays_narrow.npz", (0.0, 12.0, 0.0)) for a narrow angle camera 12 cm in front of the main one.
+CAMERAS = [(0, "arrays.npz", (0.0, 0.0, 0.0))]
+
+
+def to_robot_frame(tvec, angle, mount):
+    """
+    Move a marker pose from a camera's frame to the robot frame.
+
+    Args:
+        tvec (ndarray): (3,) marker position in the camera frame.
+        angle (float): Marker angle around the camera's vertical axis, in degrees.
+        mount (tuple): (x, z, yaw) of the camera in the robot frame.
+
+    Returns:
+        tuple: (x, y, z, angle) in the robot frame.
+    """
+    mount_x, mount_z, yaw = mount
+    cos, sin = np.cos(np.radians(yaw)), np.sin(np.radians(yaw))
+    x = cos * tvec[0] + sin * tvec[2] + mount_x
+    z = -sin * tvec[0] + cos * tvec[2] + mount_z
+    return float(x), float(tvec[1]), float(z), float(angle + yaw)
+
+
+class CameraRig:
+    """
+    Several cameras, each with its own detector and thread, fused into one wheelchair pose in the robot frame.
+
+    Every camera's accepted marker poses are moved to the robot frame and fed to one pose filter, so the pose
+    stays tracked while the marker is seen by any camera. The detection and pose estimation of OpenCV release
+    the GIL, so the camera threads run on separate cores. It can be used like a VisionPipeline by
+    auto_connection and main.py.
+    """
+
+    renders = False  # the windows are shown by the process that reads the poses, with show()
+
+    def __init__(self, cameras=CAMERAS):
+        """
+        Args:
+            cameras (list): (camera index, calibration file, mount) of every camera, like CAMERAS.
+
+        Raises:
+            ValueError: If a calibration file is missing or two cameras have the same mount, the rig is not
+                configured for these cameras.
+        """
+        for index, path, mount in cameras:
+            if not os.path.isfile(path):
+                raise ValueError(f"Calibration file {path} of camera {index} not found, calibrate the camera and "
+                                 f"set it in multi_camera.CAMERAS first")
+        mounts = [tuple(mount) for _, _, mount in cameras]
+        if len(set(mounts)) < len(mounts):
+            raise ValueError("Two cameras have the same mount, set the position of every camera on the robot in "
+                             "multi_camera.CAMERAS first")
+        self.indexes = [index for index, _, _ in cameras]
+        self.detectors = [MarkerDetector.from_calibration(path, board=default_board()) for _, path, _ in cameras]
+        self.mounts = [mount for _, _, mount in cameras]
+        self.pose_filter = PoseFilter()  # the fused pose
+        self._condition = threading.Condition()
+        self._images = [None] * len(cameras)  # newest frame of every camera, with its accepted markers
+        self._counts = np.zeros(len(cameras), dtype=np.int64)  # processed frames of every camera
+        self._frame_seq = 0  # processed frames of all the cameras
+        self._frame_time = 0.0  # capture time of the newest processed frame
+        self._measured_seq = 0  # fused measurements
+        self._distance = 500000  # distance of the newest fused measurement
+        self._read_frame_seq = 0
+        self._read_measured_seq = 0
+        self._failed = False
+        self._running = False
+        self._threads = []
+        self._start_time = None
+
+    def start(self):
+        """
+        Start the cameras and their detection threads.
+
+        Returns:
+            CameraRig: The started rig.
+        """
+        self._running = True
+        for k, index in enumerate(self.indexes):
+            thread = threading.Thread(target=self._detect, args=(k,), name=f"detection-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        self._start_time = time.monotonic()
+        return self
+
+    def _detect(self, k):
+        """
+        Detection thread of a camera: detect the marker on every new frame and fuse the accepted poses.
+        """
+        camera = camera_capture.get_camera(self.indexes[k])
+        detector = self.detectors[k]
+        while self._running:
+            result = camera.read_frame()
+            if result is None:
+                if not camera.isOpened():
+                    with self._condition:
+                        self._failed = True
+                        self._condition.notify_all()
+                    return
+                continue
+            frame, timestamp, _ = result
+            image = detector.aruco_detecting(frame, timestamp)[0]
+            markers = detector.frame_overlay
+            measurement = detector.measurement
+            with self._condition:
+                if measurement is not None and measurement[2] == timestamp:
+                    x, y, z, angle = to_robot_frame(measurement[0], measurement[1], self.mounts[k])
+                    if self.pose_filter.update(x, z, angle, timestamp):
+                        self._distance = float(np.sqrt(x * x + y * y + z * z))
+                        self._measured_seq += 1
+                self._images[k] = (image, markers)
+                self._counts[k] += 1
+                self._frame_seq += 1
+                self._frame_time = max(self._frame_time, timestamp)
+                self._condition.notify_all()
+
+    def read_pose(self, timeout=1.0, predict=False):
+        """
+        Wait for a frame of any camera newer than the last pose read, and get the fused pose.
+
+        Args:
+            timeout (float): Maximal wait in seconds.
+            predict (bool): Predict the pose for now instead of for the capture time of the newest frame.
+
+        Returns:
+            tuple: (detection, distance, x, z, angle, timestamp), or None if a camera failed or timed out.
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._frame_seq > self._read_frame_seq or self._failed, timeout):
+                return None
+            if self._failed:
+                return None
+            self._read_frame_seq = self._frame_seq
+            timestamp = self._frame_time
+            if not self.pose_filter.tracking(timestamp):
+                return False, 500000, 0, 1000, 0, timestamp
+            # the distance is only known when a camera measured the marker since the last read
+            distance = self._distance if self._measured_seq > self._read_measured_seq else 500000
+            self._read_measured_seq = self._measured_seq
+            wheelX, wheelZ, wheelAngle = self.pose_filter.predict(time.monotonic() if predict else timestamp)
+        return True, distance, wheelX, wheelZ, wheelAngle, timestamp
+
+    def failed(self):
+        """
+        Returns:
+            bool: True if a camera failed.
+        """
+        return self._failed
+
+    def show(self):
+        """
+        Pass the newest frame of every camera and the map of the fused pose to the UI thread.
+        """
+        with self._condition:
+            images = list(self._images)
+            timestamp = self._frame_time
+            detection = self.pose_filter.tracking(timestamp)
+            wheelX, wheelZ, wheelAngle = self.pose_filter.predict(timestamp)
+        for index, detector, image in zip(self.indexes, self.detectors, images):
+            if image is not None:
+                frame, markers = image
+                ui_service.show(f"aruco {index}", frame,
+                                lambda frame, detector=detector, markers=markers: detector.draw_overlay(frame, markers))
+        ui_service.show_map(detection, wheelX, wheelZ, wheelAngle)
+
+    def read_key(self):
+        """
+        Show the newest frames and the map, see show(), and get the pressed key, like cv.waitKey(1).
+        """
+        self.show()
+        return ui_service.read_key()
+
+    def throughput(self):
+        """
+        Get the rate of every camera since the rig started.
+
+        Returns:
+            dict: Frames per second by camera name.
+        """
+        elapsed = max(time.monotonic() - self._start_time, 1e-9)
+        return {f"camera {index}": int(count) / elapsed for index, count in zip(self.indexes, self._counts)}
+
+    def stop(self):
+        """
+        Stop the detection threads and release the cameras.
+        """
+        self._running = False
+        for thread in self._threads:
+            thread.join(timeout=2.0)
+        self._threads = []
+        for index in self.indexes:
+            camera = camera_capture.cameras.pop(index, None)
+            if camera is not None:
+                camera.stop()
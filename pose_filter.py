@@ -0,0 +1,152 @@
+import numpy as np
+
+# Measurement noise of the marker pose, standard deviations in cm, cm and degrees
+MEASUREMENT_STD = (1.0, 1.5, 3.0)
+# Process noise, standard deviations of the unmodeled accelerations in cm/s^2, cm/s^2 and degrees/s^2
+ACCELERATION_STD = (40.0, 40.0, 60.0)
+GATE = 11.34  # Mahalanobis distance squared for rejecting a measurement, the 99% chi-square value of 3 dof
+MAX_REJECTIONS = 3  # consecutive rejected measurements before the filter restarts at the new measurement
+MAX_COAST = 0.35  # seconds without an accepted measurement before the track is lost
+MAX_PREDICTION = 0.5  # seconds the pose is extrapolated ahead at most
+HISTORY_SIZE = 256  # measurements kept in the history ring
+
+
+class PoseFilter:
+    """
+    Constant velocity Kalman filter over the wheelchair pose (x, z, angle).
+
+    The state is (x, z, angle, vx, vz, v_angle). Measurements that are too far from the prediction,
+    by their Mahalanobis distance, are rejected unless they keep coming, then the filter restarts at them.
+    Between frames and through short dropouts the pose is predicted from the velocity, so the pose can be
+    taken at the moment a motor command is issued instead of at the moment the frame was captured.
+    """
+
+    def __init__(self, measurement_std=MEASUREMENT_STD, acceleration_std=ACCELERATION_STD, gate=GATE,
+                 max_rejections=MAX_REJECTIONS, max_coast=MAX_COAST, history_size=HISTORY_SIZE):
+        self.measurement_noise = np.diag(np.square(measurement_std))
+        self.acceleration_var = np.square(acceleration_std)
+        self.gate = gate
+        self.max_rejections = max_rejections
+        self.max_coast = max_coast
+        self.state = np.zeros(6)
+        self.covariance = np.eye(6)
+        self.time = 0.0  # time of the state
+        self.last_update = 0.0  # time of the last accepted measurement
+        self.initialized = False
+        self.rejections = 0
+        # history ring: timestamp, measured x, z, angle, 1 if accepted
+        self._history = np.zeros((history_size, 5))
+        self._history_count = 0
+
+    def reset(self):
+        """
+        Forget the track, the next measurement starts a new one.
+        """
+        self.initialized = False
+        self.rejections = 0
+
+    def tracking(self, timestamp):
+        """
+        Check if the track is still valid at a time.
+
+        Returns:
+            bool: True if a measurement was accepted less than max_coast seconds before.
+        """
+        return self.initialized and timestamp - self.last_update <= self.max_coast
+
+    def _start(self, measurement, timestamp):
+        self.state[:3] = measurement
+        self.state[3:] = 0
+        self.covariance = np.diag(np.concatenate((np.diag(self.measurement_noise), self.acceleration_var * 0.25)))
+        self.time = self.last_update = timestamp
+        self.initialized = True
+        self.rejections = 0
+
+    def _predict(self, dt):
+        """
+        Transition matrix and process noise of a step of dt seconds.
+        """
+        transition = np.eye(6)
+        transition[:3, 3:] = np.eye(3) * dt
+        noise = np.zeros((6, 6))
+        noise[:3, :3] = np.diag(self.acceleration_var * dt ** 4 / 4)
+        noise[:3, 3:] = noise[3:, :3] = np.diag(self.acceleration_var * dt ** 3 / 2)
+        noise[3:, 3:] = np.diag(self.acceleration_var * dt ** 2)
+        return transition, noise
+
+    def update(self, x, z, angle, timestamp):
+        """
+        Add a measured pose.
+
+        Args:
+            x (float): X position of the wheel, in cm.
+            z (float): Z position of the wheel, in cm.
+            angle (float): Orientation angle of the wheel, in degrees.
+            timestamp (float): time.monotonic() when the frame was captured.
+
+        Returns:
+            bool: True if the measurement was accepted.
+        """
+        measurement = np.array((x, z, angle), dtype=np.float64)
+        if not self.tracking(timestamp):
+            self._start(measurement, timestamp)
+            self._record(measurement, timestamp, True)
+            return True
+
+        dt = max(timestamp - self.time, 0.0)  # a late frame is treated as one at the time of the state
+        transition, noise = self._predict(dt)
+        state = transition @ self.state
+        covariance = transition @ self.covariance @ transition.T + noise
+
+        innovation = measurement - state[:3]
+        innovation_cov = covariance[:3, :3] + self.measurement_noise
+        distance = innovation @ np.linalg.solve(innovation_cov, innovation)
+        if distance > self.gate:
+            self.rejections += 1
+            if self.rejections < self.max_rejections:
+                self._record(measurement, timestamp, False)
+                return False
+            self._start(measurement, timestamp)  # the outliers are consistent, the track was wrong
+            self._record(measurement, timestamp, True)
+            return True
+
+        gain = np.linalg.solve(innovation_cov, covariance[:3, :]).T
+        self.state = state + gain @ innovation
+        self.covariance = covariance - gain @ covariance[:3, :]
+        self.time = self.last_update = max(timestamp, self.time)
+        self.rejections = 0
+        self._record(measurement, timestamp, True)
+        return True
+
+    def predict(self, timestamp):
+        """
+        Get the pose extrapolated to a time, without changing the filter.
+
+        Args:
+            timestamp (float): time.monotonic() of the moment the pose is needed, like when a motor command is issued.
+
+        Returns:
+            tuple: (x, z, angle)
+        """
+        dt = min(max(timestamp - self.time, 0.0), MAX_PREDICTION)
+        x, z, angle = self.state[:3] + self.state[3:] * dt
+        return float(x), float(z), float(angle)
+
+    def _record(self, measurement, timestamp, accepted):
+        row = self._history[self._history_count % len(self._history)]
+        row[0] = timestamp
+        row[1:4] = measurement
+        row[4] = accepted
+        self._history_count += 1
+
+    def history(self):
+        """
+        Get the recorded measurements, oldest first.
+
+        Returns:
+            ndarray: (N, 5) rows of timestamp, x, z, angle and 1 if the measurement was accepted.
+        """
+        size = len(self._history)
+        if self._history_count <= size:
+            return self._history[:self._history_count].copy()
+        return np.roll(self._history, -(self._history_count % size), axis=0)
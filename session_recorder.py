@@ -0,0 +1,438 @@
+import mmap
+import os
+import queue
+import struct
+import sys
+import threading
+import time
+import cv2 as cv
+import numpy as np
+
+import aruco_detection
+import mapping_processing
+import GPIO_activation
+import docking_control
+from docking_geometry import docking_decision
+
+# Record kinds
+FRAME, POSE, MAP, TICK, COMMAND = 1, 2, 3, 4, 5
+
+FILE_HEADER = b"AUTOLINK-SESSION-1\n"
+RECORD_HEADER = struct.Struct("<BdI")  # kind, timestamp, payload length, in front of every record of the data file
+POSE_RECORD = struct.Struct("<?4d")  # detection, distance, wheelX, wheelZ, wheelAngle
+MAP_RECORD = struct.Struct("<3d?2d")  # wheelX, wheelZ, wheelAngle, goodPos, turnRad, x1
+TICK_RECORD = struct.Struct("<Id?4d")  # tick number, prediction time, detection, distance, wheelX, wheelZ, wheelAngle
+COMMAND_RECORD = struct.Struct("<?7d")  # low_output, lm, rm, latch, up_arm, down_arm, back_lm, back_rm
+RAW_HEADER = struct.Struct("<3I")  # height, width, channels of a raw frame
+RECORD_STRUCTS = {POSE: POSE_RECORD, MAP: MAP_RECORD, TICK: TICK_RECORD, COMMAND: COMMAND_RECORD}
+# index entry of every record, appended to the .idx file after its chunk of records is written
+INDEX_DTYPE = np.dtype([("offset", "<u8"), ("length", "<u4"), ("kind", "u1"), ("timestamp", "<f8")])
+
+FRAME_FORMATS = {"png": (".png", [cv.IMWRITE_PNG_COMPRESSION, 1]), "jpeg": (".jpg", [cv.IMWRITE_JPEG_QUALITY, 90]),
+                 "raw": None}
+FRAME_KINDS = {"png": 0, "jpeg": 1, "raw": 2}  # first byte of a frame payload
+QUEUE_SIZE = 64  # frames waiting for the writer thread, the newest are dropped when it falls behind
+CHUNK_SIZE = 32  # records written with one write() call
+
+recorder = None  # the running SessionRecorder, set by start()
+
+
+class SessionRecorder:
+    """
+    Append-only recording of a session: the camera frames with their capture time, the outputs of
+    aruco_detecting and mapping_image, the control ticks of the docking and every GPIO command.
+
+    The hot path only copies the frame and puts the record in a queue, the encoding and the writes are done by
+    a background thread in chunks of records. Only frames are dropped when the writer falls behind, queue_size
+    frames at most wait for it. The poses, decisions, ticks and commands are small and always recorded, so the
+    replay gets all of them. The index file next to the data file has the offset, kind and time of every record,
+    so a reader can memory map both and seek without loading the session.
+    """
+
+    def __init__(self, path, frame_format="png", queue_size=QUEUE_SIZE):
+        self.path = path
+        self.frame_format = frame_format
+        self.queue = queue.Queue()
+        self._frame_slots = threading.Semaphore(queue_size)  # frames that may still be queued
+        self._forwarders = []  # (thread, queue, dropped) of the child processes, see attach()
+        self.dropped = 0  # frames dropped because the writer fell behind
+        self.written = 0
+        self._data = open(path, "wb")
+        self._data.write(FILE_HEADER)
+        self._index = open(path + ".idx", "wb")
+        self._thread = threading.Thread(target=self._write_loop, name="session-recorder", daemon=True)
+        self._thread.start()
+
+    def _put(self, kind, timestamp, payload):
+        self.queue.put((kind, timestamp, payload))
+
+    def frame(self, frame, timestamp, copy=True):
+        """
+        Record a frame before it is detected, the detection draws on it. The frame is dropped when queue_size
+        frames are already waiting.
+
+        Args:
+            copy (bool): Copy the frame, False when nothing changes it afterwards.
+        """
+        if not self._frame_slots.acquire(blocking=False):
+            self.dropped += 1
+            return
+        self._put(FRAME, timestamp, frame.copy() if copy else frame)
+
+    def pose(self, timestamp, detection, distance, wheelX, wheelZ, wheelAngle):
+        self._put(POSE, timestamp, POSE_RECORD.pack(detection, distance, wheelX, wheelZ, wheelAngle))
+
+    def mapping(self, wheelX, wheelZ, wheelAngle, goodPos, turnRad, x1):
+        self._put(MAP, time.monotonic(), MAP_RECORD.pack(wheelX, wheelZ, wheelAngle, goodPos, turnRad, x1))
+
+    def tick(self, now, number, predicted, detection, distance, wheelX, wheelZ, wheelAngle):
+        """
+        Record a tick of the docking control loop.
+
+        Args:
+            now (float): Start of the tick.
+            number (int): Tick number of the loop, 1 for the first tick of a docking.
+            predicted (float): Time the pose was predicted for.
+        """
+        self._put(TICK, now, TICK_RECORD.pack(number, predicted, detection, distance, wheelX, wheelZ, wheelAngle))
+
+    def command(self, values):
+        """
+        Record a GPIO command, values are the GPIO_activation arguments or None for low_output.
+        """
+        payload = COMMAND_RECORD.pack(True, *(0,) * 7) if values is None else COMMAND_RECORD.pack(False, *values)
+        self._put(COMMAND, time.monotonic(), payload)
+
+    def attach(self, context):
+        """
+        Get a recorder for a child process, whose records are forwarded to this one by a thread.
+
+        A forked child inherits the recorder but not its writer thread, so its records would be lost. Start the
+        child with the returned ChildRecorder and set it as the recorder of its modules.
+
+        Args:
+            context: The multiprocessing context of the child.
+
+        Returns:
+            ChildRecorder: The recorder to pass to the child.
+        """
+        child = ChildRecorder(context.Queue(), context.Semaphore(QUEUE_SIZE), context.Value("i", 0))
+        thread = threading.Thread(target=self._forward, args=(child,), name="session-forwarder", daemon=True)
+        thread.start()
+        self._forwarders.append((thread, child))
+        return child
+
+    def _forward(self, child):
+        while True:
+            record = child.records.get()
+            if record is None:
+                return
+            kind, timestamp, payload = record
+            if kind == FRAME:
+                child.frame_slots.release()
+                self.frame(payload, timestamp, copy=False)  # unpickled, nothing else uses it
+            else:
+                self._put(kind, timestamp, payload)
+
+    def _encode_frame(self, frame):
+        if self.frame_format == "raw":
+            channels = frame.shape[2] if frame.ndim == 3 else 1
+            return bytes([FRAME_KINDS["raw"]]) + RAW_HEADER.pack(frame.shape[0], frame.shape[1], channels) + \
+                frame.tobytes()
+        extension, params = FRAME_FORMATS[self.frame_format]
+        return bytes([FRAME_KINDS[self.frame_format]]) + cv.imencode(extension, frame, params)[1].tobytes()
+
+    def _write_loop(self):
+        offset = len(FILE_HEADER)
+        while True:
+            records = [self.queue.get()]
+            while len(records) < CHUNK_SIZE:  # take whatever else is waiting
+                try:
+                    records.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = records[-1] is None
+            records = [record for record in records if record is not None]
+
+            chunk, index = [], np.empty(len(records), INDEX_DTYPE)
+            for i, (kind, timestamp, payload) in enumerate(records):
+                if kind == FRAME:
+                    payload = self._encode_frame(payload)
+                    self._frame_slots.release()
+                chunk.append(RECORD_HEADER.pack(kind, timestamp, len(payload)))
+                chunk.append(payload)
+                offset += RECORD_HEADER.size
+                index[i] = (offset, len(payload), kind, timestamp)
+                offset += len(payload)
+            self._data.write(b"".join(chunk))
+            self._data.flush()
+            self._index.write(index.tobytes())  # after the data, so the index never points past it
+            self._index.flush()
+            self.written += len(records)
+            if stop:
+                return
+
+    def close(self):
+        """
+        Write the queued records and close the files, after the records the child processes sent until now.
+        """
+        for thread, child in self._forwarders:
+            child.records.put(None)
+            thread.join()
+            self.dropped += child.dropped.value
+        self.queue.put(None)
+        self._thread.join()
+        self._data.close()
+        self._index.close()
+
+
+class ChildRecorder:
+    """
+    The recorder of a child process, see SessionRecorder.attach: it sends the frames, the poses and the
+    decisions to the parent's recorder through a multiprocessing queue. Like in the parent, only the frames are
+    dropped when QUEUE_SIZE of them are waiting.
+    """
+
+    def __init__(self, records, frame_slots, dropped):
+        self.records = records
+        self.frame_slots = frame_slots
+        self.dropped = dropped  # shared count of the frames dropped in the child
+
+    def frame(self, frame, timestamp):
+        if not self.frame_slots.acquire(block=False):
+            with self.dropped.get_lock():
+                self.dropped.value += 1
+            return
+        self.records.put((FRAME, timestamp, frame.copy()))
+
+    def pose(self, timestamp, detection, distance, wheelX, wheelZ, wheelAngle):
+        self.records.put((POSE, timestamp, POSE_RECORD.pack(detection, distance, wheelX, wheelZ, wheelAngle)))
+
+    def mapping(self, wheelX, wheelZ, wheelAngle, goodPos, turnRad, x1):
+        self.records.put((MAP, time.monotonic(), MAP_RECORD.pack(wheelX, wheelZ, wheelAngle, goodPos, turnRad, x1)))
+
+
+def start(path=None, frame_format="png"):
+    """
+    Start recording the session: aruco_detecting, mapping_image and the GPIO commands report to the recorder.
+
+    Args:
+        path (str): Data file, session_<date>_<time>.rec by default. The index is written to path + ".idx".
+        frame_format (str): "png" (lossless), "jpeg" (smaller, the replayed detections differ slightly) or "raw".
+
+    Returns:
+        SessionRecorder: The recorder.
+    """
+    global recorder
+    recorder = SessionRecorder(path or time.strftime("session_%Y%m%d_%H%M%S.rec"), frame_format)
+    aruco_detection.recorder = mapping_processing.recorder = GPIO_activation.recorder = recorder
+    return recorder
+
+
+def stop():
+    """
+    Stop recording and close the files.
+    """
+    global recorder
+    if recorder is None:
+        return
+    aruco_detection.recorder = mapping_processing.recorder = GPIO_activation.recorder = None
+    recorder.close()
+    print(f"recorded {recorder.written} records to {recorder.path}, {recorder.dropped} dropped")
+    recorder = None
+
+
+class SessionReader:
+    """
+    Memory mapped recorded session, the records are decoded only when they are read.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        if self._file.read(len(FILE_HEADER)) != FILE_HEADER:
+            raise ValueError(f"{path} is not a recorded session")
+        self.data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        count = os.path.getsize(path + ".idx") // INDEX_DTYPE.itemsize  # a partly written last entry is ignored
+        self.index = np.memmap(path + ".idx", INDEX_DTYPE, mode="r", shape=(count,)) if count else \
+            np.empty(0, INDEX_DTYPE)
+
+    def __len__(self):
+        return len(self.index)
+
+    def find(self, timestamp):
+        """
+        Returns:
+            int: Position of the first record at or after a time.
+        """
+        later = np.flatnonzero(self.index["timestamp"] >= timestamp)
+        return int(later[0]) if len(later) else len(self.index)
+
+    def read(self, position):
+        """
+        Decode a record.
+
+        Returns:
+            tuple: (kind, timestamp, value), value is the frame, or the tuple of the record's fields.
+        """
+        offset, length, kind, timestamp = self.index[position].tolist()
+        payload = self.data[offset:offset + length]
+        if kind == FRAME:
+            if payload[0] == FRAME_KINDS["raw"]:
+                height, width, channels = RAW_HEADER.unpack_from(payload, 1)
+                value = np.frombuffer(payload, np.uint8, offset=1 + RAW_HEADER.size)
+                value = value.reshape(height, width, channels).copy()  # writable, like a decoded frame
+            else:
+                value = cv.imdecode(np.frombuffer(payload, np.uint8, offset=1), cv.IMREAD_UNCHANGED)
+        else:
+            value = RECORD_STRUCTS[kind].unpack(payload)
+        return kind, timestamp, value
+
+    def records(self, start=0, stop=None):
+        for position in range(start, len(self.index) if stop is None else stop):
+            yield self.read(position)
+
+    def close(self):
+        self.data.close()
+        self._file.close()
+
+
+def _command_values(record):
+    return None if record[0] else tuple(record[1:])
+
+
+def _differs(a, b, tolerance):
+    return any(abs(x - y) > tolerance for x, y in zip(a, b))
+
+
+class Replay:
+    """
+    Feed a recorded session through detection, the docking decision and the docking control on the simulated
+    GPIO backend, as fast as possible, and compare every output with the recorded one.
+
+    Time comes from the recording: the frames are detected at their capture time and the docking ticks run at
+    their recorded time, so a replay of the same session always gives the same outputs.
+    """
+
+    def __init__(self, path, tolerance=1e-3, max_differences=20):
+        self.reader = SessionReader(path)
+        self.tolerance = tolerance
+        self.max_differences = max_differences
+        self.commands = []  # GPIO commands of the replay, GPIO_activation reports them like to a recorder
+        self.differences = []  # (position, kind, recorded, replayed), the first max_differences
+        self.counts = dict.fromkeys(("frames", "poses", "maps", "ticks", "commands"), 0)
+        self.mismatches = dict.fromkeys(("poses", "maps", "ticks", "commands"), 0)
+
+    def command(self, values):
+        self.commands.append(values)
+
+    def _compare(self, name, position, recorded, replayed, different):
+        self.counts[name] += 1
+        if different:
+            self.mismatches[name] += 1
+            if len(self.differences) < self.max_differences:
+                self.differences.append((position, name, recorded, replayed))
+
+    def _check_commands(self, position, recorded):
+        """
+        Compare the commands recorded after a tick with the ones the replayed tick issued.
+        """
+        replayed, self.commands = self.commands, []
+        for i in range(max(len(recorded), len(replayed))):
+            a = recorded[i] if i < len(recorded) else "missing"
+            b = replayed[i] if i < len(replayed) else "missing"
+            self._compare("commands", position, a, b,
+                          isinstance(a, str) or isinstance(b, str) or (a is None) != (b is None) or
+                          (a is not None and _differs(a, b, self.tolerance)))
+
+    def run(self):
+        """
+        Returns:
+            dict: The record and mismatch counts, the first differences and the speed relative to real time.
+        """
+        GPIO_activation.init("simulated")
+        GPIO_activation.recorder = self
+        aruco_detection.init().reset()
+        pose = (False, 500000, 0, 1000, 0)  # replayed detection of the last frame
+        recorded_pose = pose
+        tick_pose = pose  # the pose the docking steered on, kept between ticks like in auto_connection
+        new_frame = False
+        machine, tick_position, tick_commands = None, None, []
+        start = time.perf_counter()
+        try:
+            for position in range(len(self.reader)):
+                kind, timestamp, value = self.reader.read(position)
+                if kind == COMMAND:
+                    if tick_position is not None:
+                        tick_commands.append(_command_values(value))
+                    continue
+                if kind == MAP:  # drawn on the UI thread, between the commands of a tick or not
+                    inputs = value[:3]
+                    if not _differs(inputs, recorded_pose[2:], 0):
+                        inputs = pose[2:]  # the map of the detected pose, replay it on the replayed one
+                    decision = docking_decision(*inputs)
+                    self._compare("maps", position, value[3:], decision, _differs(value[3:], decision, 0))
+                    continue
+                if tick_position is not None:  # the commands of the last tick are all read
+                    self._check_commands(tick_position, tick_commands)
+                    tick_position, tick_commands = None, []
+                self.commands = []  # only the commands of the ticks are replayed
+
+                if kind == FRAME:
+                    self.counts["frames"] += 1
+                    pose = tuple(aruco_detection.aruco_detecting(value, timestamp)[1:])
+                    new_frame = True
+                elif kind == POSE:
+                    recorded_pose = value
+                    self._compare("poses", position, value, pose,
+                                  value[0] != pose[0] or _differs(value[1:], pose[1:], self.tolerance))
+                elif kind == TICK:
+                    number, predicted, *recorded_inputs = value
+                    if number == 1 or machine is None:
+                        machine = docking_control.DockingStateMachine()
+                    if new_frame:
+                        tick_pose = pose
+                    else:
+                        tick_pose = (aruco_detection.pose_filter.tracking(timestamp),) + tick_pose[1:]
+                    if tick_pose[0]:
+                        tick_pose = tick_pose[:2] + tuple(aruco_detection.pose_filter.predict(predicted))
+                    new_frame = False
+                    self._compare("ticks", position, tuple(recorded_inputs), tick_pose,
+                                  recorded_inputs[0] != tick_pose[0] or
+                                  _differs(recorded_inputs[1:], tick_pose[1:], self.tolerance))
+                    if machine.tick(timestamp, *tick_pose) != docking_control.RUNNING:
+                        machine = None
+                    tick_position = position
+            if tick_position is not None:
+                self._check_commands(tick_position, tick_commands)
+        finally:
+            GPIO_activation.recorder = None
+        elapsed = time.perf_counter() - start
+
+        timestamps = self.reader.index["timestamp"]
+        duration = float(timestamps.max() - timestamps.min()) if len(timestamps) else 0.0
+        return {"records": len(self.reader), "counts": self.counts, "mismatches": self.mismatches,
+                "differences": self.differences, "replay_seconds": elapsed,
+                "speedup": duration / elapsed if elapsed else 0.0}
+
+
+def replay(path, tolerance=1e-3):
+    """
+    Replay a recorded session and print how its outputs compare with the recorded ones.
+
+    Returns:
+        dict: See Replay.run.
+    """
+    report = Replay(path, tolerance).run()
+    print(f"{report['records']} records replayed in {report['replay_seconds']:.2f} s "
+          f"({report['speedup']:.1f}x real time)")
+    for name, count in report["counts"].items():
+        print(f"{name}: {count} compared, {report['mismatches'].get(name, 0)} different")
+    for position, name, recorded, replayed in report["differences"]:
+        print(f"  record {position} ({name}): recorded {recorded}, replayed {replayed}")
+    return report
+
+
+if __name__ == "__main__":
+    # 'python session_recorder.py session.rec' replays a session recorded with 'python main.py --record'
+    replay(sys.argv[1])
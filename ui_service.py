@@ -0,0 +1,193 @@
+import os
+import sys
+import threading
+import time
+from collections import deque
+import cv2 as cv
+import latency
+import aruco_detection
+import mapping_processing
+
+UI_RATE = float(os.environ.get("AUTOLINK_UI_RATE", 12))  # window refreshes per second
+HEADLESS = os.environ.get("AUTOLINK_HEADLESS", "") == "1"  # no windows, the keys are read from stdin
+KEY_BUFFER = 16  # pressed keys kept until they are read
+
+ui = None  # the shared UIService, started by get_ui()
+
+
+class UIService:
+    """
+    The OpenCV windows on their own thread, refreshed at a fixed display rate.
+
+    show() only stores the newest snapshot of a window, with an optional drawing function that runs on the
+    UI thread when the snapshot is shown, so frames replaced before the next refresh are never drawn. The
+    keys pressed in the windows are buffered for read_key(). All the HighGUI calls are made on the UI thread.
+
+    In headless mode nothing is drawn or shown, and a line typed on stdin counts as the key of its first letter.
+    """
+
+    def __init__(self, rate=UI_RATE, headless=HEADLESS):
+        self.period = 1 / rate
+        self.headless = headless
+        self._pending = {}  # newest (image, draw) of every window, not shown yet
+        self._keys = deque(maxlen=KEY_BUFFER)
+        self._lock = threading.Lock()
+        self._destroy = False
+        self._running = False
+        self._thread = None
+        self.stats = {"submitted": 0, "rendered": 0, "render_time": 0.0}
+
+    def start(self):
+        if self._thread is None:
+            self._running = True
+            target = self._stdin_loop if self.headless else self._render_loop
+            self._thread = threading.Thread(target=target, name="ui", daemon=True)
+            self._thread.start()
+        return self
+
+    def show(self, name, image=None, draw=None):
+        """
+        Replace the snapshot of a window.
+
+        Args:
+            name (str): Window name.
+            image (ndarray): The image, or the image draw() is called with. It must not change after the call.
+            draw (callable): Called on the UI thread when the window is refreshed: draw(image) when there is an
+                image, draw() otherwise, returns the image to show.
+        """
+        if self.headless:
+            return
+        with self._lock:
+            self._pending[name] = (image, draw)
+            self.stats["submitted"] += 1
+
+    def read_key(self):
+        """
+        Get the oldest key pressed since the last call, without waiting.
+
+        Returns:
+            int: The key code like cv.waitKey, -1 if no key was pressed.
+        """
+        with self._lock:
+            return self._keys.popleft() if self._keys else -1
+
+    def destroy_windows(self):
+        """
+        Close the windows on the next refresh, a window opens again when it is shown.
+        """
+        with self._lock:
+            self._pending.clear()
+            self._destroy = True
+
+    def _render_loop(self):
+        deadline = time.monotonic()
+        while self._running:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                destroy, self._destroy = self._destroy, False
+            if destroy:
+                cv.destroyAllWindows()
+            start = time.monotonic()
+            for name, (image, draw) in pending.items():
+                if draw is not None:
+                    image = draw(image.copy()) if image is not None else draw()
+                cv.imshow(name, image)
+            if pending:
+                self.stats["rendered"] += 1
+                self.stats["render_time"] += time.monotonic() - start
+            key = cv.waitKey(1)
+            if pending:
+                latency.lap("display", start)
+            if key != -1:
+                with self._lock:
+                    self._keys.append(key)
+            deadline = max(deadline + self.period, time.monotonic())
+            time.sleep(max(deadline - time.monotonic(), 0))
+        cv.destroyAllWindows()
+
+    def _stdin_loop(self):
+        for line in sys.stdin:
+            line = line.strip()
+            if line:
+                with self._lock:
+                    self._keys.append(ord(line[0]))
+            if not self._running:
+                break
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None and not self.headless:
+            self._thread.join(timeout=1.0)
+        self._thread = None
+
+
+def get_ui():
+    """
+    Get the shared UI service, starting it on the first call with UI_RATE and HEADLESS.
+    """
+    global ui
+    if ui is None:
+        ui = UIService(UI_RATE, HEADLESS).start()
+    return ui
+
+
+def show(name, image=None, draw=None):
+    """
+    UIService.show on the shared UI service.
+    """
+    get_ui().show(name, image, draw)
+
+
+def read_key():
+    return get_ui().read_key()
+
+
+def destroy_windows():
+    if ui is not None:
+        ui.destroy_windows()
+
+
+def show_detection(frame, detection, wheelX, wheelZ, wheelAngle, detector=None, markers=None):
+    """
+    Show a frame with the markers aruco_detecting accepted in it, and the map of the pose.
+
+    The marker overlay and the map are only drawn when the windows are refreshed.
+
+    Args:
+        frame (ndarray): The frame returned by aruco_detecting.
+        detection (bool): Detection status of aruco_detecting.
+        wheelX, wheelZ, wheelAngle (float): The pose of aruco_detecting.
+        detector (MarkerDetector): The detector of the frame, the default camera's one by default.
+        markers (list): The accepted markers of the frame, the detector's frame_overlay by default.
+    """
+    service = get_ui()
+    if service.headless:
+        return
+    detector = detector or aruco_detection.default_detector
+    if markers is None:
+        markers = detector.frame_overlay  # a new list, never changed, every frame
+    service.show("aruco", frame, lambda image: detector.draw_overlay(image, markers))
+    show_map(detection, wheelX, wheelZ, wheelAngle)
+
+
+def show_map(detection, wheelX, wheelZ, wheelAngle):
+    """
+    Show the map of a pose, drawn when the windows are refreshed.
+
+    Args:
+        detection (bool): Detection status, the map is blank without a detection.
+        wheelX, wheelZ, wheelAngle (float): The pose.
+    """
+    service = get_ui()
+    if service.headless:
+        return
+    if detection:
+        def draw_map():
+            start = time.monotonic()
+            image = mapping_processing.mapping_image(wheelX, wheelZ, wheelAngle)[0]
+            latency.lap("mapping_image", start)
+            return image
+
+        service.show("mapp", draw=draw_map)
+    else:
+        service.show("mapp", draw=mapping_processing.blankImg)
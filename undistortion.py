@@ -0,0 +1,128 @@
+import hashlib
+import os
+import cv2 as cv
+import numpy as np
+
+ALPHA = 1  # free scaling of getOptimalNewCameraMatrix, 1 keeps all the pixels of the original frame
+
+
+def calibration_hash(camera_matrix, distortion):
+    """
+    Get a short hash of a calibration, the cached camera matrix of a calibration is only used with it.
+    """
+    digest = hashlib.sha1()
+    for array in (camera_matrix, distortion):
+        digest.update(np.ascontiguousarray(array, dtype=np.float64).tobytes())
+    return digest.hexdigest()[:16]
+
+
+class Undistortion:
+    """
+    Undistortion of one calibration at one resolution.
+
+    The optimal new camera matrix is saved as .npy files in cache_dir, named by the calibration hash and the
+    resolution, and loaded when they exist. The fixed point (CV_16SC2) remap tables of undistort_frame() are only
+    built on its first call and never saved, the detection undistorts the corners alone.
+    """
+
+    def __init__(self, camera_matrix, distortion, resolution, cache_dir=None, alpha=ALPHA):
+        self.cam_mat = camera_matrix
+        self.dist_co = distortion
+        self.resolution = tuple(resolution)  # (width, height)
+        self.alpha = alpha
+        self.key = f"{calibration_hash(camera_matrix, distortion)}_{resolution[0]}x{resolution[1]}_{alpha:g}"
+        self.cache_dir = cache_dir
+        if not self._load():
+            self._build()
+            self._save()
+        self.map1 = self.map2 = None  # remap tables, built by the first undistort_frame()
+        self.no_distortion = np.zeros(5)  # distortion coefficients of the new camera matrix
+
+    def _path(self, name):
+        return os.path.join(self.cache_dir, f"undistort_{self.key}_{name}.npy")
+
+    def _load(self):
+        """
+        Load the cached camera matrix.
+
+        Returns:
+            bool: True if they were in the cache.
+        """
+        if self.cache_dir is None:
+            return False
+        try:
+            self.new_cam_mat = np.load(self._path("camera_matrix"))
+            self.roi = tuple(int(v) for v in np.load(self._path("roi")))
+        except (OSError, ValueError):  # missing or partly written
+            return False
+        return True
+
+    def _build(self):
+        self.new_cam_mat, roi = cv.getOptimalNewCameraMatrix(self.cam_mat, self.dist_co, self.resolution, self.alpha,
+                                                             self.resolution)
+        self.roi = tuple(int(v) for v in roi)
+
+    def _save(self):
+        if self.cache_dir is None:
+            return
+        try:
+            for name, array in (("camera_matrix", self.new_cam_mat), ("roi", np.array(self.roi))):
+                temporary = self._path(name) + ".tmp"
+                with open(temporary, "wb") as file:
+                    np.save(file, array)
+                os.replace(temporary, self._path(name))  # readers never see a partly written file
+        except OSError as error:
+            print(f"Could not save the undistortion camera matrix: {error}")
+
+    def undistort_frame(self, frame, out=None):
+        """
+        Undistort a whole frame with the remap tables, built on the first call.
+
+        Args:
+            frame (ndarray): Frame of the resolution of the undistortion.
+            out (ndarray): Optional output buffer.
+
+        Returns:
+            ndarray: The frame as seen by a pinhole camera with new_cam_mat.
+        """
+        if self.map1 is None:
+            self.map1, self.map2 = cv.initUndistortRectifyMap(self.cam_mat, self.dist_co, None, self.new_cam_mat,
+                                                              self.resolution, cv.CV_16SC2)
+        return cv.remap(frame, self.map1, self.map2, cv.INTER_LINEAR, dst=out)
+
+    def undistort_points(self, corners):
+        """
+        Undistort detected corners only, to the pixels of the pinhole camera new_cam_mat.
+
+        Args:
+            corners (ndarray or list): (N, 4, 2) corners, or the corners tuple of detector.detectMarkers.
+
+        Returns:
+            ndarray: (N, 4, 2) undistorted corners.
+        """
+        points = np.asarray(corners, dtype=np.float32).reshape(-1, 1, 2)
+        return cv.undistortPoints(points, self.cam_mat, self.dist_co, P=self.new_cam_mat).reshape(-1, 4, 2)
+
+
+undistortions = {}  # built undistortions by calibration hash and resolution
+
+
+def get_undistortion(camera_matrix, distortion, resolution, cache_dir=None):
+    """
+    Get the undistortion of a calibration at a resolution, loading or building its camera matrix on the first call.
+
+    Args:
+        camera_matrix (ndarray): Camera matrix.
+        distortion (ndarray): Distortion coefficients.
+        resolution (tuple): (width, height) of the frames.
+        cache_dir (str): Directory of the cached camera matrix, usually the one of the calibration file. None to not
+            cache.
+
+    Returns:
+        Undistortion: The shared undistortion.
+    """
+    key = (calibration_hash(camera_matrix, distortion), tuple(resolution))
+    undistortion = undistortions.get(key)
+    if undistortion is None:
+        undistortion = undistortions[key] = Undistortion(camera_matrix, distortion, resolution, cache_dir)
+    return undistortion
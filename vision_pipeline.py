@@ -0,0 +1,308 @@
+import multiprocessing as mp
+import time
+from multiprocessing import shared_memory
+import numpy as np
+import pose_filter
+
+FRAME_SHAPE = (480, 640, 3)  # capture resolution, frames of other sizes are resized to it
+RING_SLOTS = 4  # frames kept in a ring, a reader has this many frame periods before its slot is reused
+POLL_INTERVAL = 0.001  # seconds between checks for a new frame or pose
+
+# indexes of the shared stage counters
+CAPTURED, DETECTED, RENDERED, CONTROLLED, CAMERA_FAILED = range(5)
+STAGES = {"capture": CAPTURED, "detection": DETECTED, "rendering": RENDERED, "control": CONTROLLED}
+
+
+class SharedFrameRing:
+    """
+    Ring of frame slots in shared memory, written by one process and read by others without pickling.
+
+    Every slot has the sequence number of the frame it holds, -1 while it is written. A reader copies
+    the newest slot and checks afterwards that its sequence number did not change.
+    """
+
+    def __init__(self, shape=FRAME_SHAPE, slots=RING_SLOTS):
+        self.shape = shape
+        self.slots = slots
+        header = 8 * (1 + 2 * slots)
+        self._shm = shared_memory.SharedMemory(create=True, size=header + int(np.prod(shape)) * slots)
+        self.latest = np.ndarray((1,), dtype=np.int64, buffer=self._shm.buf)  # seq of the newest frame
+        self.seqs = np.ndarray((slots,), dtype=np.int64, buffer=self._shm.buf, offset=8)
+        self.stamps = np.ndarray((slots,), dtype=np.float64, buffer=self._shm.buf, offset=8 * (1 + slots))
+        self.frames = np.ndarray((slots,) + shape, dtype=np.uint8, buffer=self._shm.buf, offset=header)
+        self.latest[0] = 0
+        self.seqs[:] = -1
+
+    def write(self, frame, timestamp):
+        """
+        Write a frame into the next slot and publish it as the newest one.
+        """
+        seq = int(self.latest[0]) + 1
+        slot = seq % self.slots
+        self.seqs[slot] = -1
+        self.frames[slot][:] = frame
+        self.stamps[slot] = timestamp
+        self.seqs[slot] = seq
+        self.latest[0] = seq
+
+    def read(self, after_seq, out):
+        """
+        Copy the newest frame into 'out' if it is newer than 'after_seq'.
+
+        Returns:
+            tuple: (seq, timestamp), or None if there is no newer frame or it was overwritten while copied.
+        """
+        seq = int(self.latest[0])
+        if seq <= after_seq:
+            return None
+        slot = seq % self.slots
+        timestamp = float(self.stamps[slot])
+        out[:] = self.frames[slot]
+        if self.seqs[slot] != seq:  # the writer came around the ring while we copied
+            return None
+        return seq, timestamp
+
+    def close(self):
+        self._shm.close()
+        self._shm.unlink()
+
+
+class SharedRecord:
+    """
+    Fixed size record of float64 values in shared memory, with one writer and lock-free readers.
+
+    The first value is a sequence counter that is odd while the writer changes the record (a seqlock).
+    """
+
+    def __init__(self, size):
+        self._shm = shared_memory.SharedMemory(create=True, size=8 * (size + 1))
+        self.values = np.ndarray((size + 1,), dtype=np.float64, buffer=self._shm.buf)
+        self.values[:] = 0
+
+    def write(self, *values):
+        self.values[0] += 1
+        self.values[1:len(values) + 1] = values
+        self.values[0] += 1
+
+    def read(self):
+        """
+        Returns:
+            tuple: (seq, values), seq counts the writes.
+        """
+        while True:
+            seq = self.values[0]
+            values = self.values[1:].copy()
+            if seq % 2 == 0 and self.values[0] == seq:
+                return int(seq) // 2, values
+
+    def close(self):
+        self._shm.close()
+        self._shm.unlink()
+
+
+def capture_stage(camera_index, ring, counters, stop):
+    """
+    Capture process: read the camera and write every frame into the frame ring.
+    """
+    import cv2 as cv
+
+    cap = cv.VideoCapture(camera_index)
+    cap.set(cv.CAP_PROP_FRAME_WIDTH, ring.shape[1])
+    cap.set(cv.CAP_PROP_FRAME_HEIGHT, ring.shape[0])
+    cap.set(cv.CAP_PROP_BUFFERSIZE, 1)
+    while not stop.is_set():
+        ret, frame = cap.read()
+        if not ret:
+            counters[CAMERA_FAILED] = 1
+            break
+        if frame.shape != ring.shape:
+            frame = cv.resize(frame, (ring.shape[1], ring.shape[0]))
+        ring.write(frame, time.monotonic())
+        counters[CAPTURED] += 1
+    cap.release()
+
+
+def detection_stage(frames, display, pose, counters, stop, recorder=None):
+    """
+    Detection process: detect the marker and estimate its pose on the newest frame.
+
+    The pose is written to the pose record for the control process, with the velocity of the pose filter,
+    the frame with the accepted markers drawn to the display ring at the display rate of ui_service.UI_RATE.
+    When the session is recorded, the frames and the poses go to the recorder of the control process.
+    """
+    import aruco_detection
+    from ui_service import UI_RATE
+
+    aruco_detection.recorder = recorder  # the inherited recorder has no writer thread in this process
+    frame = np.empty(frames.shape, dtype=np.uint8)
+    seq = 0
+    displayed = 0.0  # capture time of the last frame sent to the display
+    while not stop.is_set():
+        result = frames.read(seq, frame)
+        if result is None:
+            time.sleep(POLL_INTERVAL)
+            continue
+        seq, timestamp = result
+        aruco_image, detection, distance, wheelX, wheelZ, wheelAngle = aruco_detection.aruco_detecting(frame, timestamp)
+        pose.write(timestamp, detection, distance, wheelX, wheelZ, wheelAngle, *aruco_detection.pose_filter.state[3:])
+        if timestamp - displayed >= 1 / UI_RATE:  # only the frames that are shown are drawn
+            markers = aruco_detection.default_detector.frame_overlay
+            if markers:  # drawn on a copy, the frame may be the detector's last valid one
+                aruco_image = aruco_detection.default_detector.draw_overlay(aruco_image.copy(), markers)
+            display.write(aruco_image, timestamp)
+            displayed = timestamp
+        counters[DETECTED] += 1
+
+
+def render_stage(display, pose, keys, counters, stop, recorder=None):
+    """
+    Rendering process: draw the map and show the OpenCV windows, pass the pressed keys to the control process.
+    When the session is recorded, the docking decisions of the maps go to the recorder of the control process.
+    """
+    import cv2 as cv
+    import mapping_processing
+
+    mapping_processing.recorder = recorder
+    frame = np.empty(display.shape, dtype=np.uint8)
+    seq = 0
+    while not stop.is_set():
+        result = display.read(seq, frame)
+        if result is None:
+            key = cv.waitKey(1)
+        else:
+            seq = result[0]
+            timestamp, detection, distance, wheelX, wheelZ, wheelAngle = pose.read()[1][:6]
+            if detection:
+                map_image = mapping_processing.mapping_image(wheelX, wheelZ, wheelAngle)[0]
+            else:
+                map_image = mapping_processing.blankImg()
+            cv.imshow("aruco", frame)
+            cv.imshow("mapp", map_image)
+            key = cv.waitKey(1)
+            counters[RENDERED] += 1
+        if key != -1:
+            keys.write(key)
+    cv.destroyAllWindows()
+
+
+class VisionPipeline:
+    """
+    Capture, detection and rendering in their own processes, so they run on separate cores of the Pi.
+
+    Frames move between the processes through shared memory rings, the pose and the pressed keys through
+    lock-free shared records. The control process reads them with read_pose() and read_key().
+    """
+
+    renders = True  # the rendering process shows the windows
+
+    def __init__(self, camera_index=0, shape=FRAME_SHAPE):
+        self.camera_index = camera_index
+        self.frames = SharedFrameRing(shape)
+        self.display = SharedFrameRing(shape)
+        self.pose = SharedRecord(9)  # timestamp, detection, distance, x, z, angle and the velocity of x, z, angle
+        self.keys = SharedRecord(1)
+        self._counters_shm = shared_memory.SharedMemory(create=True, size=8 * 5)
+        self.counters = np.ndarray((5,), dtype=np.int64, buffer=self._counters_shm.buf)
+        self.counters[:] = 0
+        self._context = mp.get_context("fork")  # the children inherit the shared memory objects
+        self._stop = self._context.Event()
+        self._processes = []
+        self._pose_seq = 0
+        self._key_seq = 0
+        self._start_time = None
+
+    def start(self):
+        """
+        Start the capture, detection and rendering processes.
+
+        Returns:
+            VisionPipeline: The started pipeline.
+        """
+        import session_recorder
+
+        recorders = [None, None]
+        if session_recorder.recorder is not None:  # the children send their records to this process
+            recorders = [session_recorder.recorder.attach(self._context) for _ in recorders]
+        stages = ((capture_stage, (self.camera_index, self.frames, self.counters, self._stop)),
+                  (detection_stage, (self.frames, self.display, self.pose, self.counters, self._stop, recorders[0])),
+                  (render_stage, (self.display, self.pose, self.keys, self.counters, self._stop, recorders[1])))
+        for target, args in stages:
+            process = self._context.Process(target=target, args=args, name=target.__name__, daemon=True)
+            process.start()
+            self._processes.append(process)
+        self._start_time = time.monotonic()
+        return self
+
+    def read_pose(self, timeout=1.0, predict=False):
+        """
+        Wait for a pose newer than the last one read.
+
+        Args:
+            timeout (float): Maximal wait in seconds.
+            predict (bool): Extrapolate the pose from the frame's capture time to now, with the filter's velocity.
+
+        Returns:
+            tuple: (detection, distance, x, z, angle, timestamp), or None if the camera failed or timed out.
+        """
+        deadline = time.monotonic() + timeout
+        while not self.counters[CAMERA_FAILED]:
+            seq, values = self.pose.read()
+            if seq > self._pose_seq:
+                self._pose_seq = seq
+                self.counters[CONTROLLED] += 1
+                timestamp, detection, distance, wheelX, wheelZ, wheelAngle, vx, vz, v_angle = values.tolist()
+                if predict and detection:
+                    dt = min(max(time.monotonic() - timestamp, 0.0), pose_filter.MAX_PREDICTION)
+                    wheelX, wheelZ, wheelAngle = wheelX + vx * dt, wheelZ + vz * dt, wheelAngle + v_angle * dt
+                return bool(detection), distance, wheelX, wheelZ, wheelAngle, timestamp
+            if time.monotonic() >= deadline:
+                break
+            time.sleep(POLL_INTERVAL)
+        return None
+
+    def failed(self):
+        """
+        Tell a dead pipeline from a late pose: read_pose() returns None for both.
+
+        Returns:
+            bool: True if the camera failed or a stage process died.
+        """
+        return bool(self.counters[CAMERA_FAILED]) or any(not process.is_alive() for process in self._processes)
+
+    def read_key(self):
+        """
+        Get the newest key pressed in the OpenCV windows, like cv.waitKey.
+
+        Returns:
+            int: The key code, or -1 if no key was pressed since the last call.
+        """
+        seq, values = self.keys.read()
+        if seq == self._key_seq:
+            return -1
+        self._key_seq = seq
+        return int(values[0])
+
+    def throughput(self):
+        """
+        Get the rate of every stage since the pipeline started.
+
+        Returns:
+            dict: Frames per second by stage name.
+        """
+        elapsed = max(time.monotonic() - self._start_time, 1e-9)
+        return {name: int(self.counters[index]) / elapsed for name, index in STAGES.items()}
+
+    def stop(self):
+        """
+        Stop the processes and free the shared memory.
+        """
+        self._stop.set()
+        for process in self._processes:
+            process.join(timeout=2.0)
+            if process.is_alive():
+                process.terminate()
+        self._processes = []
+        for shared in (self.frames, self.display, self.pose, self.keys):
+            shared.close()
+        self._counters_shm.close()
+        self._counters_shm.unlink()